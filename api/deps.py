@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import AsyncGenerator, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Optional
 
 from models.public import Tenant
 
@@ -9,7 +10,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 
 from core.config import settings
-from core.db import AsyncSessionFactory
+from core.db import (
+    AsyncSessionFactory,
+    bind_tenant_schema,
+    open_read_session,
+    replica_router,
+    shard_session,
+    tenant_session,
+)
+from core.shards import DEFAULT_SHARD
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +31,34 @@ async def get_tenant_info(request: Request) -> Optional[Tenant]:
 # --- 用于租户 API 的依赖项 ---
 async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
     """FastAPI 依赖项，用于获取设置了正确 search_path 的数据库会话。"""
+    async with request_tenant_db(request) as session:
+        yield session
+
+
+async def get_db_unless_write_batching(request: Request) -> AsyncGenerator[Optional[AsyncSession], None]:
+    """
+    单行写入接口使用的依赖项: 开启 PRODUCT_WRITE_BATCHING 时返回 None 且不占用连接，
+    写入交给 core.write_batching 合并执行；否则与 get_db 相同。
+    """
+    if settings.PRODUCT_WRITE_BATCHING:
+        yield None
+        return
+    async with request_tenant_db(request) as session:
+        yield session
+
+
+async def get_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    只读接口使用的依赖项: 配置了 DATABASE_REPLICA_URLS 时 session 来自只读副本 (轮询，副本不可用时回退主库)，
+    租户 schema 的绑定方式与 get_db 相同。副本存在复制延迟，刚写入的数据可能暂时读不到。
+    """
+    async with request_tenant_db(request, read_only=True) as session:
+        yield session
+
+
+@asynccontextmanager
+async def request_tenant_db(request: Request, read_only: bool = False) -> AsyncIterator[AsyncSession]:
+    """当前请求的租户 session: 正常退出时提交，出错时回滚。read_only 时优先使用只读副本"""
     tenant_schema = getattr(request.state, "tenant_schema", None)
     if not tenant_schema:
         # 如果中间件未能设置 schema（例如访问了公共路径或出错）
@@ -33,15 +70,20 @@ async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
             detail="Could not determine tenant context for this request."
         )
 
-    session: AsyncSession = AsyncSessionFactory()
+    shard = getattr(request.state, "tenant_shard", DEFAULT_SHARD)
+    row_scope = getattr(request.state, "tenant_row_scope", None)
+    if read_only and replica_router.replicas and shard == DEFAULT_SHARD:
+        session = await open_read_session(tenant_schema, row_scope=row_scope)
+        owns_session, needs_binding = True, False
+    else:
+        # 请求级会话模式下，TenantMiddleware 已在同一个事务中完成租户查询并绑定了租户 schema
+        session = getattr(request.state, "db_session", None)
+        owns_session = needs_binding = session is None
+        if owns_session:
+            session = shard_session(shard)
     try:
-        # --- 关键: 设置当前会话/事务的 search_path ---
-        # 使用 f-string 可能有注入风险，但 schema_name 来自我们数据库且经过验证，风险较低
-        # 更好的做法是使用参数绑定，但 SET search_path 不直接支持
-        # 确保 schema_name 是合法的标识符（例如，只允许字母、数字、下划线）
-        # 这里的 schema_name 是从数据库查出来的，相对安全
-        # 总是包含 'public' 作为备选，这样可以访问共享表和函数
-        await session.execute(text(f"SET LOCAL search_path = '{tenant_schema}', public;"))
+        if needs_binding:
+            await bind_tenant_schema(session, tenant_schema, row_scope)
         yield session  # 提供 session 给 API 函数
         await session.commit()
     except Exception as e:
@@ -49,7 +91,28 @@ async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
         await session.rollback()
         raise  # 将异常重新抛出，FastAPI 会处理成 500 错误
     finally:
-        await session.close()
+        # 中间件创建的 session 由中间件在响应结束后关闭
+        if owns_session:
+            await session.close()
+
+
+@asynccontextmanager
+async def open_tenant_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """
+    在依赖项之外 (例如 StreamingResponse 的生成器中) 获取当前租户的 session。
+    请求级会话模式下复用中间件的 session (由中间件在响应结束后关闭)，否则新建一个并在退出时关闭。
+    """
+    session: AsyncSession | None = getattr(request.state, "db_session", None)
+    if session is not None:
+        yield session
+        return
+    tenant_schema = getattr(request.state, "tenant_schema", None)
+    if not tenant_schema:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not determine tenant context for this request.")
+    async with tenant_session(
+        tenant_schema, getattr(request.state, "tenant_shard", DEFAULT_SHARD), getattr(request.state, "tenant_row_scope", None)
+    ) as session:
+        yield session
 
 
 # --- 用于管理接口的依赖项 ---
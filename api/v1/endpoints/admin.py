@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import json
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.responses import StreamingResponse
+
+from api import deps
+from core.db import pool_stats
+from core.fanout import REPORTS, FanoutSummary, missing_params, tenant_fanout
+from core.jobs import provisioning_workers
+from core.profiling import sql_profiler
+from core.tenant_cache import tenant_cache
+from core.write_batching import product_write_batcher
+from schemas.report import FanoutQuery
+
+router = APIRouter()
+
+
+@router.get("/stats", dependencies=[Depends(deps.verify_admin_key)])
+async def read_runtime_stats():
+    """获取运行时统计信息, 如租户缓存命中率、连接池亲和命中率、开通任务计数、写入合并批次分布、按语句指纹聚合的 SQL 耗时 (需要 Admin Key)"""
+    return {
+        "tenant_cache": tenant_cache.stats(),
+        "connection_pool": pool_stats(),
+        "provisioning": provisioning_workers.stats(),
+        "write_batching": product_write_batcher.stats(),
+        "sql_profile": sql_profiler.stats(),
+    }
+
+
+@router.get("/reports", dependencies=[Depends(deps.verify_admin_key)])
+async def list_reports():
+    """列出可以跨租户执行的预定义报表及其 SQL (需要 Admin Key)"""
+    return REPORTS
+
+
+@router.post("/reports/fanout", response_class=StreamingResponse, dependencies=[Depends(deps.verify_admin_key)])
+async def run_fanout_report(query: FanoutQuery):
+    """
+    对所有 (或指定的) 活跃租户执行一个预定义报表，以 NDJSON 流式返回 (需要 Admin Key)。
+    每个租户完成后立即输出一行 {tenant_id, schema_name, ok, rows, duration_ms, error}，
+    单个租户失败不影响其他租户；最后一行为 {"summary": {tenants, succeeded, failed, wall_time_s}}。
+    """
+    sql = REPORTS.get(query.report)
+    if sql is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report '{query.report}'.")
+    missing = missing_params(sql, query.params)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing report parameters: {', '.join(missing)}.")
+
+    async def stream_results() -> AsyncIterator[bytes]:
+        summary = FanoutSummary()
+        async for result in tenant_fanout.run(sql, query.params, mode=query.mode, tenant_ids=query.tenant_ids):
+            summary.add(result)
+            yield (json.dumps(result.as_dict(), ensure_ascii=False, default=str) + "\n").encode()
+        yield (json.dumps({"summary": summary.as_dict()}) + "\n").encode()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from core.db import pool_stats
+from core.metrics import metrics_registry, render_gauge
+from core.shards import DEFAULT_SHARD
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _pool_samples(stats: dict) -> list[tuple[dict, dict]]:
+    """pool_stats() 展开为 (标签, 连接池统计)：每个分片的主库与每个只读副本各一项"""
+    samples = [({"pool": DEFAULT_SHARD}, stats)]
+    samples += [({"pool": name}, shard_stats) for name, shard_stats in stats.get("shards", {}).items()]
+    samples += [({"pool": f"replica:{replica['name']}"}, replica["pool"]) for replica in stats.get("replicas", {}).get("replicas", [])]
+    return samples
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    """Prometheus 文本格式的指标: 按租户 (前 METRICS_TOP_TENANTS 名 + other) 的请求与数据库指标，以及连接池使用情况"""
+    pools = _pool_samples(pool_stats())
+    body = metrics_registry.render()
+    body += render_gauge("db_pool_size", "Configured pool size", ((labels, stats["size"]) for labels, stats in pools))
+    body += render_gauge("db_pool_checked_out", "Connections currently checked out", ((labels, stats["checked_out"]) for labels, stats in pools))
+    body += render_gauge("db_pool_overflow", "Overflow connections currently open", ((labels, stats["overflow"]) for labels, stats in pools))
+    return PlainTextResponse(body, media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,27 +1,42 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Body, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from api import deps
-from crud import crud_tenant
-from schemas.tenant import TenantCreate, TenantInDB, TenantUpdate
+from core.config import settings
+from core.db import shard_registry
+from core.jobs import provisioning_workers
+from core.pagination import InvalidCursor, decode_cursor, next_cursor, set_next_page_headers
+from crud import crud_provisioning_job, crud_tenant
+from schemas.tenant import (
+    ProvisioningJobInDB,
+    TenantBulkCreate,
+    TenantBulkCreateResult,
+    TenantBulkItemResult,
+    TenantCreate,
+    TenantInDB,
+    TenantProvisioningAccepted,
+    TenantUpdate,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-@router.post("/", response_model=TenantInDB, status_code=status.HTTP_201_CREATED, dependencies=[Depends(deps.verify_admin_key)])
+@router.post("/", response_model=TenantProvisioningAccepted, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(deps.verify_admin_key)])
 async def create_new_tenant(
     tenant_in: TenantCreate = Body(...),
     db: AsyncSession = Depends(deps.get_public_db)
 ):
     """
-    创建新租户 (包括 schema 和 public 表记录)。
-    需要 Admin API Key。
-    **注意:** 此端点完成后，需要手动或通过后台任务为新 schema 运行数据库迁移。
+    创建新租户 (需要 Admin API Key)。
+    未指定 shard 时租户 schema 放在当前租户数最少的分片上。
+    租户记录创建后立即返回 202 与开通任务；schema 的创建、迁移和激活由后台任务完成，
+    进度通过 GET /admin/tenants/jobs/{job_id} 查询，任务成功后租户才可以访问。
     """
     # 检查 subdomain 和 schema_name 是否已存在
     existing_subdomain = await crud_tenant.get_tenant_by_subdomain(db, tenant_in.subdomain)
@@ -36,10 +51,15 @@ async def create_new_tenant(
     if existing_schema:
         raise HTTPException(status_code=400, detail=f"Schema name '{tenant_in.schema_name}' already exists or is planned.")
 
+    if tenant_in.shard is not None and tenant_in.shard not in shard_registry:
+        raise HTTPException(status_code=400, detail=f"Unknown shard '{tenant_in.shard}'.")
+
     try:
-        tenant = await crud_tenant.create_tenant(db, tenant_in=tenant_in)
-        # 此处应该触发后台任务运行迁移: trigger_migration_task(tenant.schema_name)
-        return tenant
+        shard = tenant_in.shard or (await crud_tenant.place_tenants(db, shard_registry.names, 1))[0]
+        tenant = await crud_tenant.create_tenant(db, tenant_in=tenant_in, shard=shard)
+        job = await crud_provisioning_job.create_job(db, tenant)
+        # 先提交再唤醒工作协程，保证它们能领取到这个任务
+        await db.commit()
     except HTTPException as http_exc:
         raise http_exc
     except ValueError as ve:  # Pydantic 或 CRUD 中的验证错误
@@ -48,16 +68,116 @@ async def create_new_tenant(
         logger.error(f"Failed to create tenant '{tenant_in.name}': {e}", exc_info=True)
         # 回滚可能已在 get_public_db 的 finally 块中处理，但这里提供详细错误
         raise HTTPException(status_code=500, detail=f"Internal server error during tenant creation: {e}")
+    provisioning_workers.notify()
+    return TenantProvisioningAccepted(tenant=tenant, job=job)
+
+
+def _bulk_item_error(tenant_in: TenantCreate, existing: dict[str, set], seen: dict[str, dict]) -> str | None:
+    """检查单个条目与已有租户、以及与同一批次中前面条目的冲突"""
+    if tenant_in.shard is not None and tenant_in.shard not in shard_registry:
+        return f"Unknown shard '{tenant_in.shard}'."
+    for field, label in (("subdomain", "Subdomain"), ("schema_name", "Schema name"), ("name", "Name")):
+        value = getattr(tenant_in, field)
+        if value is None:
+            continue
+        if value in existing[field]:
+            return f"{label} '{value}' already registered."
+        if value in seen[field]:
+            return f"{label} '{value}' duplicates item {seen[field][value]} in this request."
+    return None
+
+
+@router.post("/bulk", response_model=TenantBulkCreateResult, status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(deps.verify_admin_key)])
+async def create_tenants_in_bulk(
+    bulk_in: TenantBulkCreate = Body(...),
+    db: AsyncSession = Depends(deps.get_public_db)
+):
+    """
+    批量创建租户 (需要 Admin Key)。
+    整批只做一次唯一性查询和一条多行 INSERT，冲突的条目被拒绝而不影响其他条目；
+    每个被接受的租户对应一个开通任务，由后台工作协程并行开通。结果按请求顺序逐条返回。
+    """
+    if len(bulk_in.tenants) > settings.TENANT_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.TENANT_BULK_MAX_ITEMS} tenants can be created per request.")
+
+    existing: dict[str, set] = {"name": set(), "schema_name": set(), "subdomain": set()}
+    for name, schema_name, subdomain in await crud_tenant.find_conflicts(db, bulk_in.tenants):
+        existing["name"].add(name)
+        existing["schema_name"].add(schema_name)
+        existing["subdomain"].add(subdomain)
+
+    results: dict[int, TenantBulkItemResult] = {}
+    accepted: list[tuple[int, TenantCreate]] = []
+    seen: dict[str, dict] = {"name": {}, "schema_name": {}, "subdomain": {}}
+    for index, tenant_in in enumerate(bulk_in.tenants):
+        error = _bulk_item_error(tenant_in, existing, seen)
+        if error is not None:
+            results[index] = TenantBulkItemResult(index=index, status="rejected", error=error)
+            continue
+        for field in seen:
+            value = getattr(tenant_in, field)
+            if value is not None:
+                seen[field][value] = index
+        accepted.append((index, tenant_in))
+
+    if accepted:
+        try:
+            # 未指定分片的条目按当前负载依次放到租户数最少的分片
+            placements = iter(await crud_tenant.place_tenants(
+                db, shard_registry.names, sum(1 for _, tenant_in in accepted if tenant_in.shard is None)
+            ))
+            shards = [tenant_in.shard or next(placements) for _, tenant_in in accepted]
+            tenants = await crud_tenant.create_tenants_bulk(db, [tenant_in for _, tenant_in in accepted], shards)
+            jobs = await crud_provisioning_job.create_jobs_bulk(db, tenants)
+            await db.commit()
+        except IntegrityError as e:
+            # 唯一性检查之后有其他请求创建了冲突的租户
+            logger.warning(f"Bulk tenant creation conflicted with concurrent changes: {e}")
+            raise HTTPException(status_code=409, detail="Tenants were created concurrently with conflicting names; retry the request.")
+        for (index, _), tenant, job in zip(accepted, tenants, jobs):
+            results[index] = TenantBulkItemResult(index=index, status="accepted", tenant=tenant, job_id=job.id)
+        provisioning_workers.notify()
+
+    return TenantBulkCreateResult(
+        accepted=len(accepted),
+        rejected=len(bulk_in.tenants) - len(accepted),
+        results=[results[index] for index in range(len(bulk_in.tenants))],
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=ProvisioningJobInDB, dependencies=[Depends(deps.verify_admin_key)])
+async def read_provisioning_job(
+    job_id: int,
+    db: AsyncSession = Depends(deps.get_public_db)
+):
+    """查询租户开通任务的状态与进度 (需要 Admin Key)"""
+    job = await crud_provisioning_job.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Provisioning job not found")
+    return job
 
 
 @router.get("/", response_model=List[TenantInDB], dependencies=[Depends(deps.verify_admin_key)])
 async def read_tenants(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(deps.get_public_db)
 ):
-    """获取租户列表 (需要 Admin Key)"""
-    tenants = await crud_tenant.get_tenants(db, skip=skip, limit=limit)
+    """
+    获取租户列表 (需要 Admin Key)，按 id 排序。
+    翻页时传入上一页响应头 X-Next-Cursor 中的 cursor；不传 cursor 时仍支持 skip/limit。
+    """
+    if cursor is not None and skip:
+        raise HTTPException(status_code=400, detail="skip cannot be combined with cursor.")
+    try:
+        after = decode_cursor(cursor, "id") if cursor is not None else None
+        tenants = await crud_tenant.get_tenants(db, skip=skip, limit=limit, after=after)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_page_headers(request, response, next_cursor(tenants, ("id",), "id", limit))
     return tenants
 
 
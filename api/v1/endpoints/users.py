@@ -1,52 +1,221 @@
 # -*- coding: utf-8 -*-
-from typing import List
+import csv
+import io
+import json
+import logging
+import time
+from typing import AsyncIterator, List, Literal, Optional, Sequence
 
 from models.public import Tenant
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import StreamingResponse
 
 from api import deps
+from core.config import settings
+from core.ingest import iter_csv_batches, iter_ndjson_batches, validate_batch
+from core.pagination import InvalidCursor, decode_cursor, next_cursor, set_next_page_headers
+from core.tenancy import tenant_data_schema, tenant_row_scope
+from core.write_batching import product_write_batcher
 from crud import crud_user
-from schemas.user import ProductCreate, ProductInDB
+from schemas.user import (
+    ProductBatchResult,
+    ProductCreate,
+    ProductImportError,
+    ProductImportResult,
+    ProductInDB,
+)
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
 @router.post("/", response_model=ProductInDB, status_code=status.HTTP_201_CREATED)
 async def create_tenant_item(
     item_in: ProductCreate,
-    db: AsyncSession = Depends(deps.get_db),  # 获取设置了 search_path 的 session
+    db: AsyncSession | None = Depends(deps.get_db_unless_write_batching),  # 获取设置了 search_path 的 session
     current_tenant: Tenant | None = Depends(deps.get_tenant_info)  # 获取当前租户信息
 ):
     """
     在当前租户的 schema 中创建一个新的 Item。
+    开启 PRODUCT_WRITE_BATCHING 时与同一租户的并发写入合并为一条多行 INSERT 执行 (见 core/write_batching.py)。
     """
     if not current_tenant:  # 理论上 get_db 会先失败，但加层保险
         raise HTTPException(status_code=400, detail="Tenant context not available.")
+    if db is None:
+        key = (current_tenant.shard, tenant_data_schema(current_tenant), tenant_row_scope(current_tenant))
+        return await product_write_batcher.submit(key, item_in)
     return await crud_user.create_item(db=db, item=item_in)
 
 
+def _encode_json_list(rows: Sequence[Row]) -> bytes:
+    return orjson.dumps([row._asdict() for row in rows])
+
+
 @router.get("/", response_model=List[ProductInDB])
 async def read_tenant_items(
-    skip: int = 0,
-    limit: int = 100,
-    db: AsyncSession = Depends(deps.get_db),
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: Literal["id", "name"] = "id",
+    db: AsyncSession = Depends(deps.get_read_db),
     current_tenant: Tenant | None = Depends(deps.get_tenant_info)
 ):
     """
     获取当前租户的 Item 列表。
+    传入上一页响应头 X-Next-Cursor 中的 cursor 即可翻页 (键集分页，深翻页不变慢)；
+    不传 cursor 时仍支持旧的 skip/limit 分页。响应头中没有 X-Next-Cursor 表示已是最后一页。
+    只查询需要的列并用 orjson 直接编码为响应体，跳过 ORM 对象构造与 response_model 的逐条校验
+    (OpenAPI 中的响应模型不变)。
+    """
+    if not current_tenant:
+        raise HTTPException(status_code=400, detail="Tenant context not available.")
+    if cursor is not None and skip:
+        raise HTTPException(status_code=400, detail="skip cannot be combined with cursor.")
+    try:
+        after = decode_cursor(cursor, sort) if cursor is not None else None
+        rows = await crud_user.get_item_rows(db=db, skip=skip, limit=limit, sort=sort, after=after)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response = Response(content=_encode_json_list(rows), media_type="application/json")
+    set_next_page_headers(request, response, next_cursor(rows, crud_user.PRODUCT_SORT_KEYS[sort], sort, limit))
+    return response
+
+
+# 必须在 /{item_id} 之前声明
+@router.get("/batch", response_model=ProductBatchResult)
+async def read_tenant_items_by_ids(
+    ids: List[int] = Query(..., description="重复传参: ?ids=1&ids=2"),
+    db: AsyncSession = Depends(deps.get_read_db),
+    current_tenant: Tenant | None = Depends(deps.get_tenant_info)
+):
+    """
+    按 id 列表批量获取当前租户的 Item: 一次请求、一条查询。
+    items 与 ids 按请求顺序一一对应，不存在的 id 对应 null 并列入 missing。
     """
     if not current_tenant:
         raise HTTPException(status_code=400, detail="Tenant context not available.")
-    items = await crud_user.get_items(db=db, skip=skip, limit=limit)
-    return items
+    if len(ids) > settings.PRODUCT_MULTI_GET_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.PRODUCT_MULTI_GET_MAX_IDS} ids per request.")
+    unique_ids = list(dict.fromkeys(ids))
+    found = await crud_user.get_items_by_ids(db=db, ids=unique_ids)
+    return ProductBatchResult(
+        items=[ProductInDB.model_validate(found[item_id]) if item_id in found else None for item_id in ids],
+        missing=[item_id for item_id in unique_ids if item_id not in found],
+    )
+
+
+EXPORT_COLUMNS = ("id", "name", "description", "price")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _encode_ndjson(rows: Sequence[Row]) -> bytes:
+    return "".join(json.dumps(row._asdict(), ensure_ascii=False) + "\n" for row in rows).encode()
+
+
+def _encode_csv(rows: Sequence[Row]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+# 必须在 /{item_id} 之前声明，否则 "export" 会被当作 item_id 匹配
+@router.get("/export", response_class=StreamingResponse, responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}})
+async def export_tenant_items(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=50000),
+    current_tenant: Tenant | None = Depends(deps.get_tenant_info)
+):
+    """
+    以 NDJSON 或 CSV 流式导出当前租户的全部 Item (按 id 排序)。
+    数据通过服务端游标分批读取、逐批发送: 内存占用与表大小无关；
+    客户端读得慢时发送会阻塞，游标也随之暂停读取 (背压)。客户端断开时游标与连接随即释放。
+    """
+    if not current_tenant:
+        raise HTTPException(status_code=400, detail="Tenant context not available.")
+    encode = _encode_ndjson if format == "ndjson" else _encode_csv
+
+    async def stream_rows() -> AsyncIterator[bytes]:
+        # session 在生成器中打开: 依赖项 (get_db) 会在响应体开始发送前退出
+        async with deps.open_tenant_session(request) as db:
+            if format == "csv":
+                yield encode([EXPORT_COLUMNS])
+            async for rows in crud_user.iter_item_batches(db, batch_size=batch_size):
+                yield encode(rows)
+
+    filename = f"{current_tenant.schema_name}-products.{format}"
+    return StreamingResponse(
+        stream_rows(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+IMPORT_PARSERS = {"ndjson": iter_ndjson_batches, "csv": iter_csv_batches}
+
+
+@router.post("/import", response_model=ProductImportResult)
+async def import_tenant_items(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    on_error: Literal["skip", "abort"] = "skip",
+    db: AsyncSession = Depends(deps.get_db),
+    current_tenant: Tenant | None = Depends(deps.get_tenant_info)
+):
+    """
+    从流式上传的 NDJSON 或 CSV (首行为表头: name,description,price) 批量导入当前租户的 Item。
+
+    请求体边读边解析，每 IMPORT_BATCH_SIZE 行用 ProductCreate 校验一次，合法的行通过同一条
+    COPY 语句写入 (共享 schema 中的租户每批一条多行 INSERT)，全部成功后一次提交。on_error=skip 时跳过不合法的行并在响应中逐行报告；
+    on_error=abort 时遇到第一条不合法的行即返回 422，不写入任何数据。
+    """
+    if not current_tenant:
+        raise HTTPException(status_code=400, detail="Tenant context not available.")
+
+    started = time.perf_counter()
+    received = inserted = rejected = 0
+    errors: list[ProductImportError] = []
+
+    row_scope = tenant_row_scope(current_tenant)
+    async with crud_user.copy_items(db, tenant_data_schema(current_tenant), use_insert=row_scope is not None) as write_items:
+        async for batch in IMPORT_PARSERS[format](request.stream(), settings.IMPORT_BATCH_SIZE):
+            received += len(batch)
+            valid, batch_errors = validate_batch(ProductCreate, batch)
+            if batch_errors:
+                if on_error == "abort":
+                    line, messages = min(batch_errors)
+                    raise HTTPException(status_code=422, detail={"line": line, "errors": messages})
+                rejected += len(batch_errors)
+                errors.extend(
+                    ProductImportError(line=line, errors=messages)
+                    for line, messages in batch_errors[:max(settings.IMPORT_MAX_ERRORS - len(errors), 0)]
+                )
+            await write_items(valid)
+            inserted += len(valid)
+    await db.commit()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Imported {inserted} products into '{current_tenant.schema_name}' in {elapsed:.2f}s")
+    return ProductImportResult(
+        rows_received=received,
+        rows_inserted=inserted,
+        rows_rejected=rejected,
+        elapsed_s=round(elapsed, 3),
+        rows_per_sec=round(inserted / elapsed, 1) if elapsed else 0.0,
+        errors=sorted(errors, key=lambda error: error.line),
+        errors_truncated=rejected > len(errors),
+    )
 
 
 @router.get("/{item_id}", response_model=ProductInDB)
 async def read_tenant_item(
     item_id: int,
-    db: AsyncSession = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     current_tenant: Tenant | None = Depends(deps.get_tenant_info)
 ):
     """获取当前租户的指定 Item"""
@@ -6,6 +6,14 @@ from fastapi import FastAPI, HTTPException, Request, status
 from starlette.responses import JSONResponse
 
 from api.v1.api import api_router
+from api.v1.endpoints import metrics
+from core.config import settings
+from core.fanout import tenant_fanout
+from core.jobs import provisioning_workers
+from core.tenant_cache import tenant_cache, tenant_cache_listener
+from core.write_batching import product_write_batcher
+from middlewares.metrics import MetricsMiddleware
+from middlewares.profiling import ProfilingMiddleware
 from middlewares.tenant import TenantMiddleware
 
 logging.basicConfig(level=logging.DEBUG)
@@ -16,25 +24,18 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Application startup...")
+    await provisioning_workers.start()
+    if settings.TENANT_CACHE_LISTEN and tenant_cache.enabled:
+        await tenant_cache_listener.start()
     yield
+    await tenant_cache_listener.stop()
+    await product_write_batcher.drain()
+    await provisioning_workers.stop()
+    await tenant_fanout.close()
     logger.info("Application shutdown...")
 
-# --- FastAPI 实例 ---
-app = FastAPI(
-    title="Multi-Tenant App",
-    description="Example FastAPI application with PostgreSQL Schema-per-Tenant Multi-Tenancy",
-    version="0.1.0",
-    lifespan=lifespan
-)
-# --- 路由 ---
-app.include_router(api_router, prefix="/api/v1")
-# --- 中间件 ---
-# TenantMiddleware 必须放在需要租户上下文的路由之前
-app.add_middleware(TenantMiddleware)
-
 
 # --- 全局异常处理 (可选) ---
-@app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     # 避免覆盖 FastAPI 的 HTTPException 处理
     if isinstance(exc, HTTPException):
@@ -45,3 +46,31 @@ async def general_exception_handler(request: Request, exc: Exception):
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"detail": f"Internal server error: {type(exc).__name__}"},
     )
+
+
+def create_app(tenant_middleware: type = TenantMiddleware) -> FastAPI:
+    """创建 FastAPI 应用；tenant_middleware 参数便于基准测试对比不同的中间件实现"""
+    # --- FastAPI 实例 ---
+    app = FastAPI(
+        title="Multi-Tenant App",
+        description="Example FastAPI application with PostgreSQL Schema-per-Tenant Multi-Tenancy",
+        version="0.1.0",
+        lifespan=lifespan
+    )
+    # --- 路由 ---
+    app.include_router(api_router, prefix="/api/v1")
+    if settings.METRICS_ENABLED:
+        app.include_router(metrics.router, tags=["Metrics"])
+    # --- 中间件 ---
+    # TenantMiddleware 必须放在需要租户上下文的路由之前
+    app.add_middleware(tenant_middleware)
+    if settings.PROFILE_SQL:
+        app.add_middleware(ProfilingMiddleware)
+    if settings.METRICS_ENABLED:
+        # 后添加的中间件位于外层: 指标覆盖租户解析在内的整个请求
+        app.add_middleware(MetricsMiddleware)
+    app.add_exception_handler(Exception, general_exception_handler)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+对比两种租户绑定方式 (TENANT_BINDING_MODE) 在 crud_user 查询上的表现:
+
+* search_path: 每个事务先执行 SET LOCAL search_path (多一次往返)
+* schema_translate_map: 语句渲染为 "<schema>".products，无额外往返，编译缓存跨租户共享
+
+脚本会创建 --tenants 个 bench_binding_* schema 并各写入 --rows 个 products，
+随机挑选租户执行 get_items + get_item，报告吞吐量、延迟分位数以及编译缓存的增长量。
+
+    python -m benchmarks.bench_binding_mode --tenants 300 --transactions 20000 --concurrency 16
+"""
+import argparse
+import asyncio
+import random
+
+from benchmarks.common import create_bench_schemas, drop_bench_schemas, dump_json, run_load
+
+from core.config import settings
+from core.db import (
+    TENANT_BINDING_SCHEMA_TRANSLATE,
+    TENANT_BINDING_SEARCH_PATH,
+    AsyncSessionFactory,
+    bind_tenant_schema,
+    engine,
+)
+from crud import crud_user
+
+
+async def run_mode(mode: str, schemas: list[str], args: argparse.Namespace) -> dict:
+    settings.TENANT_BINDING_MODE = mode
+    rng = random.Random(args.seed)
+    compiled_cache = engine.sync_engine._compiled_cache
+    cache_size_before = len(compiled_cache) if compiled_cache is not None else 0
+
+    async def transaction(i: int) -> int:
+        schema = rng.choice(schemas)
+        async with AsyncSessionFactory() as session:
+            await bind_tenant_schema(session, schema)
+            await crud_user.get_items(session, skip=0, limit=20)
+            await crud_user.get_item(session, item_id=rng.randint(1, args.rows))
+            await session.commit()
+        return 200
+
+    await run_load(transaction, min(args.transactions, 500), args.concurrency)  # 预热
+    result = await run_load(transaction, args.transactions, args.concurrency)
+    result["mode"] = mode
+    result["compiled_cache_growth"] = (len(compiled_cache) if compiled_cache is not None else 0) - cache_size_before
+    return result
+
+
+async def main(args: argparse.Namespace) -> None:
+    schemas = [f"bench_binding_{i}" for i in range(args.tenants)]
+    print(f"Provisioning {len(schemas)} schemas ...")
+    await create_bench_schemas(engine, schemas, rows_per_schema=args.rows)
+    try:
+        results = []
+        for mode in (TENANT_BINDING_SEARCH_PATH, TENANT_BINDING_SCHEMA_TRANSLATE):
+            result = await run_mode(mode, schemas, args)
+            results.append(result)
+            print(f"{mode:>22}: {result['rps']:>9} tx/s  p50={result['latency']['p50_ms']}ms  "
+                  f"p99={result['latency']['p99_ms']}ms  compiled_cache_growth={result['compiled_cache_growth']}")
+        dump_json({"tenants": args.tenants, "rows": args.rows, "results": results}, args.output)
+    finally:
+        if not args.keep:
+            await drop_bench_schemas(engine, schemas)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="结束后保留创建的 schema")
+    parser.add_argument("--output", help="写入 JSON 结果的文件路径 (默认打印到标准输出)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+多租户负载测试: 开通 N 个租户、按指定分布写入 products，再用并发的异步负载生成器驱动 /api/v1/users/ 接口。
+
+* 租户: 在 public.tenants 中注册 bench-load-* 租户，并按模型定义创建 bench_load_* schema (不走 Alembic)
+* 数据分布: uniform (每个租户 --rows 行) 或 zipf (排名 r 的租户 --max-rows / r^s 行)，
+  另可用 --whales / --whale-rows 指定若干个超大 ("鲸鱼") 租户
+* 流量: 按 --mix 的比例混合列表 (list)、按 id 读取 (get) 与创建 (create) 请求；
+  --traffic uniform 时各租户请求数相同，proportional 时与数据量成正比
+* 规模: --tenants 10,1000,10000 先开通最多的租户数，再依次只对前 N 个租户施压
+
+默认在进程内通过 httpx.ASGITransport 驱动应用；--base-url 时改为请求已启动的服务 (需连接同一数据库，
+多 worker 时 /metrics 只反映处理抓取请求的那个 worker)。每轮前后抓取 /metrics (需要 METRICS_ENABLED=true)，
+由差值得到每个请求的 SQL 语句数 (数据库往返)、数据库耗时与取连接等待时间；指标未开启时这几项为 null。
+结果为 JSON (包含当前提交)，--baseline 传入另一次的结果文件时附带各项指标的变化百分比:
+
+    python -m benchmarks.bench_load --tenants 10,1000,10000 --distribution zipf --whales 3 --output after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from bisect import bisect
+from itertools import accumulate
+
+from benchmarks.common import (
+    create_bench_schemas,
+    drop_bench_schemas,
+    dump_json,
+    git_revision,
+    parse_metric_totals,
+    run_load,
+    summarize_latencies,
+)
+
+import httpx
+from sqlalchemy import text
+
+from core.config import settings
+from core.db import engine
+
+SCHEMA_PREFIX = "bench_load_"
+TENANT_NAME_PREFIX = "bench-load-"
+OPERATIONS = ("list", "get", "create")
+
+# /metrics 中用于计算每个请求数据库开销的计数器
+DB_STATEMENTS = "tenant_db_statements_total"
+DB_TIME = "tenant_db_time_seconds_sum"
+POOL_WAIT = "tenant_db_pool_wait_seconds_total"
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{operation}', expected one of {OPERATIONS}")
+        mix[operation] = float(weight)
+    return mix
+
+
+def product_counts(args: argparse.Namespace, tenants: int, rng: random.Random) -> list[int]:
+    """每个租户的 products 行数 (顺序随机，鲸鱼租户不总是排在前面)"""
+    if args.distribution == "zipf":
+        counts = [max(1, round(args.max_rows / rank ** args.zipf_s)) for rank in range(1, tenants + 1)]
+    else:
+        counts = [args.rows] * tenants
+    for index in range(min(args.whales, tenants)):
+        counts[index] = args.whale_rows
+    rng.shuffle(counts)
+    return counts
+
+
+async def cleanup() -> None:
+    """删除之前 (包括中断的) 运行留下的租户与 schema"""
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM public.tenants WHERE starts_with(name, :prefix)"), {"prefix": TENANT_NAME_PREFIX})
+        schemas = (await conn.execute(
+            text("SELECT nspname FROM pg_catalog.pg_namespace WHERE starts_with(nspname, :prefix)"), {"prefix": SCHEMA_PREFIX}
+        )).scalars().all()
+    await drop_bench_schemas(engine, schemas)
+
+
+async def provision(counts: list[int], concurrency: int) -> list[int]:
+    """注册租户、创建 schema 并写入数据，返回按 counts 顺序的租户 id"""
+    schemas = [f"{SCHEMA_PREFIX}{index}" for index in range(len(counts))]
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            text("INSERT INTO public.tenants (name, schema_name, is_active) VALUES (:name, :schema_name, true) RETURNING id, schema_name"),
+            [{"name": f"{TENANT_NAME_PREFIX}{index}", "schema_name": schema} for index, schema in enumerate(schemas)],
+        )
+        ids_by_schema = {schema_name: tenant_id for tenant_id, schema_name in result}
+
+    # 每个并发单元各负责一部分 schema (create_bench_schemas 每个 schema 一个事务)
+    await asyncio.gather(*(create_bench_schemas(engine, schemas[offset::concurrency]) for offset in range(concurrency)))
+
+    async def seed(offset: int) -> None:
+        for index in range(offset, len(schemas), concurrency):
+            async with engine.begin() as conn:
+                await conn.execute(
+                    text(f'INSERT INTO "{schemas[index]}".products (name, description, price) '
+                         "SELECT 'product-' || i, NULL, 1.0 + i % 100 FROM generate_series(1, :rows) AS i"),
+                    {"rows": counts[index]},
+                )
+
+    await asyncio.gather(*(seed(offset) for offset in range(concurrency)))
+    return [ids_by_schema[schema] for schema in schemas]
+
+
+async def scrape_metrics(client: httpx.AsyncClient, in_process: bool) -> dict[str, float] | None:
+    """抓取 /metrics；指标未开启 (进程内按配置判断，远程服务返回 404) 时返回 None"""
+    if in_process and not settings.METRICS_ENABLED:
+        return None
+    response = await client.get("/metrics")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return parse_metric_totals(response.text)
+
+
+async def run_scale(client: httpx.AsyncClient, tenant_ids: list[int], counts: list[int], args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    weights = counts if args.traffic == "proportional" else [1] * len(tenant_ids)
+    cumulative = list(accumulate(weights))
+    operations = list(args.mix)
+    operation_weights = list(accumulate(args.mix.values()))
+    latencies: dict[str, list[float]] = {operation: [] for operation in operations}
+    statuses: dict[str, dict[str, int]] = {operation: {} for operation in operations}
+
+    async def send_request(i: int) -> int:
+        index = bisect(cumulative, rng.random() * cumulative[-1])
+        operation = operations[bisect(operation_weights, rng.random() * operation_weights[-1])]
+        headers = {"X-Tenant-ID": str(tenant_ids[index])}
+        started = time.perf_counter()
+        if operation == "list":
+            response = await client.get("/api/v1/users/", params={"limit": args.page_size}, headers=headers)
+        elif operation == "get":
+            response = await client.get(f"/api/v1/users/{rng.randint(1, counts[index])}", headers=headers)
+        else:
+            response = await client.post("/api/v1/users/", json={"name": f"load-{i}", "price": 9.99}, headers=headers)
+        latencies[operation].append(time.perf_counter() - started)
+        status_key = str(response.status_code)
+        statuses[operation][status_key] = statuses[operation].get(status_key, 0) + 1
+        return response.status_code
+
+    # 预热: 填充租户缓存、连接池与编译缓存，不计入结果
+    await run_load(send_request, min(args.requests, args.warmup), args.concurrency)
+    for samples in latencies.values():
+        samples.clear()
+    for counter in statuses.values():
+        counter.clear()
+
+    before = await scrape_metrics(client, in_process=not args.base_url)
+    result = await run_load(send_request, args.requests, args.concurrency)
+    after = await scrape_metrics(client, in_process=not args.base_url)
+
+    def per_request(name: str, scale: float = 1.0) -> float | None:
+        if before is None or after is None or name not in after:
+            return None
+        return round((after[name] - before.get(name, 0.0)) * scale / args.requests, 3)
+
+    result.update({
+        "tenants": len(tenant_ids),
+        "per_operation": {
+            operation: {"latency": summarize_latencies(latencies[operation]), "statuses": statuses[operation]}
+            for operation in operations
+        },
+        "per_request": {
+            "db_statements": per_request(DB_STATEMENTS),
+            "db_time_ms": per_request(DB_TIME, 1000),
+            "pool_wait_ms": per_request(POOL_WAIT, 1000),
+        },
+    })
+    return result
+
+
+def compare(results: list[dict], baseline: dict) -> list[dict]:
+    """与基线结果中相同租户数的一轮对比，返回各项指标的变化百分比 (正数表示变大)"""
+    def change(new, old):
+        return round((new - old) / old * 100, 1) if new is not None and old else None
+
+    baseline_by_tenants = {result["tenants"]: result for result in baseline.get("results", [])}
+    diffs = []
+    for result in results:
+        old = baseline_by_tenants.get(result["tenants"])
+        if old is None:
+            continue
+        diff = {"tenants": result["tenants"], "rps_pct": change(result["rps"], old["rps"])}
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            diff[f"{key[:-3]}_pct"] = change(result["latency"][key], old["latency"][key])
+        for key, value in result["per_request"].items():
+            diff[f"{key}_pct"] = change(value, old["per_request"].get(key))
+        diffs.append(diff)
+    return diffs
+
+
+async def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    total_tenants = max(args.tenants)
+    counts = product_counts(args, total_tenants, rng)
+
+    print(f"Provisioning {total_tenants} tenants ({sum(counts)} products) ...")
+    await cleanup()
+    started = time.perf_counter()
+    tenant_ids = await provision(counts, args.provision_concurrency)
+    provisioning_s = time.perf_counter() - started
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        from app import create_app
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()), base_url="http://bench")
+    if not args.base_url and not settings.METRICS_ENABLED:
+        print("METRICS_ENABLED is off: per-request database statistics will be null")
+    try:
+        results = []
+        async with client:
+            for tenants in sorted(args.tenants):
+                result = await run_scale(client, tenant_ids[:tenants], counts[:tenants], args)
+                results.append(result)
+                print(f"tenants={tenants:>6}: {result['rps']:>9} req/s  p50={result['latency']['p50_ms']}ms  "
+                      f"p95={result['latency']['p95_ms']}ms  p99={result['latency']['p99_ms']}ms  "
+                      f"statements/req={result['per_request']['db_statements']}  "
+                      f"pool_wait/req={result['per_request']['pool_wait_ms']}ms  statuses={result['statuses']}")
+
+        sorted_counts = sorted(counts)
+        output = {
+            "git_revision": git_revision(),
+            "config": {
+                "distribution": args.distribution,
+                "traffic": args.traffic,
+                "mix": args.mix,
+                "page_size": args.page_size,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "seed": args.seed,
+                "target": args.base_url or "in-process",
+                "settings": {
+                    key: getattr(settings, key)
+                    for key in ("TENANT_BINDING_MODE", "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TENANT_AFFINITY",
+                                "DB_REQUEST_SCOPED_SESSION", "TENANT_CACHE_TTL", "PRODUCT_WRITE_BATCHING")
+                },
+            },
+            "provisioning": {
+                "tenants": total_tenants,
+                "elapsed_s": round(provisioning_s, 3),
+                "products": {"total": sum(counts), "p50": sorted_counts[len(counts) // 2], "max": sorted_counts[-1]},
+            },
+            "results": results,
+        }
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                output["baseline_diff"] = compare(results, json.load(f))
+        dump_json(output, args.output)
+    finally:
+        if not args.keep:
+            await cleanup()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=lambda value: [int(n) for n in value.split(",")], default=[10, 1000],
+                        help="逗号分隔的租户数，每个规模跑一轮")
+    parser.add_argument("--distribution", choices=("uniform", "zipf"), default="uniform")
+    parser.add_argument("--rows", type=int, default=100, help="uniform 分布下每个租户的 products 行数")
+    parser.add_argument("--max-rows", type=int, default=100000, help="zipf 分布下最大租户的行数")
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="zipf 分布的指数 (越大越倾斜)")
+    parser.add_argument("--whales", type=int, default=0, help="鲸鱼租户个数")
+    parser.add_argument("--whale-rows", type=int, default=1000000, help="每个鲸鱼租户的行数")
+    parser.add_argument("--traffic", choices=("uniform", "proportional"), default="uniform")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("list=70,get=25,create=5"))
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--provision-concurrency", type=int, default=4)
+    parser.add_argument("--base-url", help="请求已启动的服务而不是进程内的应用")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="结束后保留创建的租户与 schema")
+    parser.add_argument("--baseline", help="与之对比的另一次结果 (JSON 文件)")
+    parser.add_argument("--output", help="写入 JSON 结果的文件路径 (默认打印到标准输出)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+对比纯 ASGI 的 TenantMiddleware 与旧的 BaseHTTPMiddleware 实现。
+
+两个应用在同一进程内通过 httpx.ASGITransport 驱动 (不经过网络栈)，
+交替运行多轮，报告每种实现的 requests/sec 与 p50/p99 延迟。
+需要一个已完成迁移的活跃租户:
+
+    python -m benchmarks.bench_middleware --tenant-id 2 --requests 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+
+from app import create_app
+from benchmarks.common import dump_json, run_load
+
+import httpx
+
+from middlewares.tenant import BaseHTTPTenantMiddleware, TenantMiddleware
+
+IMPLEMENTATIONS = {
+    "pure_asgi": TenantMiddleware,
+    "base_http": BaseHTTPTenantMiddleware,
+}
+
+
+async def bench_one(middleware_class: type, args: argparse.Namespace) -> dict:
+    app = create_app(tenant_middleware=middleware_class)
+    transport = httpx.ASGITransport(app=app)
+    headers = {"X-Tenant-ID": str(args.tenant_id)}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        async def send_request(i: int) -> int:
+            response = await client.get(args.path)
+            return response.status_code
+
+        # 预热: 填充租户缓存与连接池
+        await run_load(send_request, min(args.requests, 200), args.concurrency)
+        return await run_load(send_request, args.requests, args.concurrency)
+
+
+async def main(args: argparse.Namespace) -> None:
+    rounds: dict[str, list[dict]] = {name: [] for name in IMPLEMENTATIONS}
+    for round_no in range(args.rounds):
+        for name, middleware_class in IMPLEMENTATIONS.items():
+            result = await bench_one(middleware_class, args)
+            rounds[name].append(result)
+            print(f"round {round_no + 1} {name:>10}: {result['rps']:>9} req/s  "
+                  f"p50={result['latency']['p50_ms']}ms  p99={result['latency']['p99_ms']}ms  "
+                  f"statuses={result['statuses']}")
+
+    summary = {}
+    for name, results in rounds.items():
+        summary[name] = {
+            "best_rps": max(r["rps"] for r in results),
+            "best_p99_ms": min(r["latency"]["p99_ms"] for r in results),
+            "rounds": results,
+        }
+    dump_json({"path": args.path, "summary": summary}, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenant-id", type=int, required=True)
+    parser.add_argument("--path", default="/api/v1/users/")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--output", help="写入 JSON 结果的文件路径 (默认打印到标准输出)")
+    asyncio.run(main(parser.parse_args()))
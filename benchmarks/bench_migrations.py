@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+测量 run_migrations.py 的租户迁移随租户数与工作进程数的扩展情况。
+
+创建 --schemas 个空的 bench_mig_* schema，用 run_migrations.migrate_schemas (与正式迁移相同的进程池与连接复用)
+把 migrations-tenants/versions 中的迁移链应用到全部 schema 上；--workers 中的每个进程数各跑一轮，每轮前重建 schema。
+--start-revision 指定时先 (不计时) 把所有 schema 迁移到该版本，只测量从它到 head 的部分，
+previous 表示最后一个会修改独享 schema 的迁移的上一个版本 (最接近一次发布时的迁移)：
+只修改共享 schema 的迁移 (模块中 SHARED_SCHEMA_ONLY = True，对 bench_mig_* 是空操作) 会被跳过，
+它们仍在测量范围内执行。也可以直接传入具体的版本号。
+
+迁移期间后台线程每隔 --sample-interval 秒查询一次 pg_stat_activity / pg_locks，记录:
+
+* 峰值连接数 (当前数据库)
+* 等待锁的后端数 (峰值与累计的 后端·秒)，其中等待 pg_catalog 中系统表上的锁的部分单独统计
+* 迁移期间新增的死锁数 (pg_stat_database)
+
+    python -m benchmarks.bench_migrations --schemas 2000 --workers 1,4,8,16 --output migrations.json
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import Optional
+
+import run_migrations
+from benchmarks.common import dump_json, git_revision, summarize_latencies
+
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, text
+
+from core.config import settings
+
+SCHEMA_PREFIX = "bench_mig_"
+# 每个事务创建/删除的 schema 数 (删除时每个 schema 的对象都要加锁，不能一次删太多)
+DDL_BATCH_SIZE = 100
+
+ACTIVITY_SQL = """
+    SELECT
+        (SELECT count(*) FROM pg_catalog.pg_stat_activity WHERE datname = current_database()) AS connections,
+        (SELECT count(*) FROM pg_catalog.pg_stat_activity
+         WHERE datname = current_database() AND wait_event_type = 'Lock') AS lock_waiters,
+        (SELECT count(DISTINCT l.pid) FROM pg_catalog.pg_locks l
+         JOIN pg_catalog.pg_class c ON c.oid = l.relation
+         WHERE NOT l.granted AND l.database = (SELECT oid FROM pg_catalog.pg_database WHERE datname = current_database())
+           AND c.relnamespace = CAST('pg_catalog' AS regnamespace)) AS catalog_lock_waiters
+"""
+DEADLOCKS_SQL = "SELECT deadlocks FROM pg_catalog.pg_stat_database WHERE datname = current_database()"
+
+
+class ActivitySampler(threading.Thread):
+    """在迁移期间定期采样连接数与锁等待"""
+
+    def __init__(self, engine, interval: float):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.samples = 0
+        self.peak_connections = 0
+        self.peak_lock_waiters = 0
+        self.peak_catalog_lock_waiters = 0
+        self.lock_wait_s = 0.0
+        self.catalog_lock_wait_s = 0.0
+        self.error: Optional[str] = None
+
+    def run(self) -> None:
+        try:
+            with self.engine.connect() as connection:
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+                while not self._stop_event.is_set():
+                    connections, lock_waiters, catalog_lock_waiters = connection.execute(text(ACTIVITY_SQL)).one()
+                    self.samples += 1
+                    self.peak_connections = max(self.peak_connections, connections)
+                    self.peak_lock_waiters = max(self.peak_lock_waiters, lock_waiters)
+                    self.peak_catalog_lock_waiters = max(self.peak_catalog_lock_waiters, catalog_lock_waiters)
+                    # 每个样本代表一个采样间隔: 等待的后端数 x 间隔 ≈ 累计等待时间
+                    self.lock_wait_s += lock_waiters * self.interval
+                    self.catalog_lock_wait_s += catalog_lock_waiters * self.interval
+                    self._stop_event.wait(self.interval)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        return {
+            "samples": self.samples,
+            "peak_connections": self.peak_connections,
+            "peak_lock_waiters": self.peak_lock_waiters,
+            "lock_wait_backend_s": round(self.lock_wait_s, 3),
+            "peak_catalog_lock_waiters": self.peak_catalog_lock_waiters,
+            "catalog_lock_wait_backend_s": round(self.catalog_lock_wait_s, 3),
+            "sampler_error": self.error,
+        }
+
+
+def execute_batched(engine, statements: list[str]) -> None:
+    for start in range(0, len(statements), DDL_BATCH_SIZE):
+        with engine.begin() as connection:
+            for statement in statements[start:start + DDL_BATCH_SIZE]:
+                connection.execute(text(statement))
+
+
+def drop_bench_schemas(engine) -> None:
+    """删除之前 (包括中断的) 运行留下的 bench_mig_* schema"""
+    with engine.connect() as connection:
+        schemas = connection.execute(
+            text("SELECT nspname FROM pg_catalog.pg_namespace WHERE starts_with(nspname, :prefix)"), {"prefix": SCHEMA_PREFIX}
+        ).scalars().all()
+    execute_batched(engine, [f"DROP SCHEMA {run_migrations._quote_ident(schema)} CASCADE" for schema in schemas])
+
+
+def resolve_start_revision(value: Optional[str]) -> Optional[str]:
+    if value != "previous":
+        return value
+    script = ScriptDirectory.from_config(run_migrations.make_alembic_config(f"{SCHEMA_PREFIX}0"))
+    revision = script.get_revision(script.get_current_head())
+    # 从 head 往下跳过只修改共享 schema 的迁移，否则测量的只是一个空操作
+    while getattr(revision.module, "SHARED_SCHEMA_ONLY", False):
+        if revision.down_revision is None:
+            break
+        revision = script.get_revision(revision.down_revision)
+    if revision.down_revision is None:
+        raise SystemExit(f"No revision before {revision.revision} changes dedicated schemas; there is no previous revision to start from")
+    if isinstance(revision.down_revision, tuple):
+        raise SystemExit(f"Revision {revision.revision} is a merge point; pass --start-revision explicitly")
+    return revision.down_revision
+
+
+def prepare_schemas(engine, schemas: list[str], start_revision: Optional[str], workers: int) -> None:
+    drop_bench_schemas(engine)
+    execute_batched(engine, [f"CREATE SCHEMA {run_migrations._quote_ident(schema)}" for schema in schemas])
+    if start_revision:
+        results = run_migrations.migrate_schemas([(run_migrations.DEFAULT_SHARD, schema) for schema in schemas], workers, start_revision)
+        failed = [result for result in results if not result.ok]
+        if failed:
+            raise SystemExit(f"Could not bring {len(failed)} schemas to {start_revision}: {failed[0].error}")
+
+
+def deadlocks(engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(text(DEADLOCKS_SQL)).scalar_one()
+
+
+def run_round(engine, schemas: list[str], workers: int, args: argparse.Namespace) -> dict:
+    prepare_schemas(engine, schemas, args.start_revision, max(args.workers))
+    targets = [(run_migrations.DEFAULT_SHARD, schema) for schema in schemas]
+
+    deadlocks_before = deadlocks(engine)
+    sampler = ActivitySampler(engine, args.sample_interval)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        results = run_migrations.migrate_schemas(targets, workers)
+    finally:
+        wall_time = time.perf_counter() - started
+        activity = sampler.stop()
+
+    succeeded = [result.duration for result in results if result.ok]
+    failed = [result for result in results if not result.ok]
+    return {
+        "workers": workers,
+        "schemas": len(schemas),
+        "succeeded": len(succeeded),
+        "failed": len(failed),
+        "first_error": failed[0].error if failed else None,
+        "wall_time_s": round(wall_time, 3),
+        "schemas_per_sec": round(len(results) / wall_time, 1) if wall_time else 0.0,
+        "schema_latency": summarize_latencies(succeeded),
+        "activity": activity,
+        "deadlocks": deadlocks(engine) - deadlocks_before,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    # 采样线程与 schema 的创建/删除使用独立的引擎，迁移本身由 run_migrations 的引擎 (每个工作进程一个连接) 执行
+    engine = create_engine(settings.DATABASE_URL, pool_size=2, max_overflow=0)
+    schemas = [f"{SCHEMA_PREFIX}{index}" for index in range(args.schemas)]
+    args.start_revision = resolve_start_revision(args.start_revision)
+    head = run_migrations.get_head_revision(schemas[0])
+    revisions = len(list(ScriptDirectory.from_config(run_migrations.make_alembic_config(schemas[0])).walk_revisions()))
+    try:
+        rounds = []
+        for workers in args.workers:
+            print(f"Migrating {len(schemas)} schemas from {args.start_revision or 'base'} to {head} with {workers} workers ...")
+            result = run_round(engine, schemas, workers, args)
+            rounds.append(result)
+            print(f"workers={workers:>3}: {result['wall_time_s']}s ({result['schemas_per_sec']} schemas/s)  "
+                  f"p50={result['schema_latency']['p50_ms']}ms  p99={result['schema_latency']['p99_ms']}ms  "
+                  f"peak_connections={result['activity']['peak_connections']}  "
+                  f"catalog_lock_wait={result['activity']['catalog_lock_wait_backend_s']}s  failed={result['failed']}")
+        dump_json({
+            "git_revision": git_revision(),
+            "schemas": args.schemas,
+            "revisions_in_chain": revisions,
+            "start_revision": args.start_revision,
+            "head": head,
+            "sample_interval_s": args.sample_interval,
+            "rounds": rounds,
+        }, args.output)
+    finally:
+        if not args.keep:
+            drop_bench_schemas(engine)
+        engine.dispose()
+        run_migrations._dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schemas", type=int, default=1000)
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1, 4, 8],
+                        help="逗号分隔的工作进程数，每个跑一轮")
+    parser.add_argument("--start-revision", help="先把 schema 迁移到该版本，只测量到 head 的部分 (previous 表示最后一个修改独享 schema 的迁移的上一个版本)")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="pg_stat_activity / pg_locks 采样间隔 (秒)")
+    parser.add_argument("--keep", action="store_true", help="结束后保留创建的 schema")
+    parser.add_argument("--output", help="写入 JSON 结果的文件路径 (默认打印到标准输出)")
+    main(parser.parse_args())
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+对比两种租户 schema 开通方式随迁移链增长的耗时:
+
+* replay: CREATE SCHEMA 后用 Alembic 从头回放全部迁移 (原有方式)
+* clone: 从已在 head 的模板 schema 克隆 (core/provisioning.py)
+
+迁移链由 migrations-tenants/versions 中的真实迁移，加上 --revisions 指定数量的合成迁移组成
+(每 4 个合成迁移中有一个新建带外键、索引和默认值的表，其余给已有的表加列和索引)，
+合成迁移只写入临时目录，不会修改仓库。每种链长各开通 --samples 个 schema，
+并比较 replay 与 clone 得到的 schema 结构 (列、默认值、约束、索引、alembic 版本) 是否一致。
+
+    python -m benchmarks.bench_provisioning --revisions 0,25,100,200 --samples 5
+"""
+import argparse
+import asyncio
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import dump_json, summarize_latencies
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, text
+
+from core.config import settings
+from core.db import AsyncSessionFactory, engine
+from core.provisioning import BASE_DIR, TENANTS_ALEMBIC_INI, clone_schema, quote_ident
+
+SYNTHETIC_REVISION = '''"""synthetic revision {index}
+
+Revision ID: {revision}
+Revises: {down_revision}
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+{upgrade}
+
+
+def downgrade() -> None:
+{downgrade}
+'''
+
+# 每 TABLE_EVERY 个合成迁移新建一张表，其余迁移给已有的表加列/加索引 (更接近真实迁移链的构成)
+TABLE_EVERY = 4
+
+CREATE_TABLE_OPS = '''    op.create_table('synthetic_{table}',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_synthetic_{table}_user_id_users'),
+        sa.PrimaryKeyConstraint('id', name='pk_synthetic_{table}')
+    )
+    op.create_index('ix_synthetic_{table}_name', 'synthetic_{table}', ['name'], unique=False)'''
+DROP_TABLE_OPS = '''    op.drop_index('ix_synthetic_{table}_name', table_name='synthetic_{table}')
+    op.drop_table('synthetic_{table}')'''
+ADD_COLUMN_OPS = '''    op.add_column('synthetic_{table}', sa.Column('attr_{index}', sa.String(), server_default='', nullable=False))
+    op.create_index('ix_synthetic_{table}_attr_{index}', 'synthetic_{table}', ['attr_{index}'], unique=False)
+    op.add_column('products', sa.Column('attr_{index}', sa.Integer(), nullable=True))'''
+DROP_COLUMN_OPS = '''    op.drop_column('products', 'attr_{index}')
+    op.drop_index('ix_synthetic_{table}_attr_{index}', table_name='synthetic_{table}')
+    op.drop_column('synthetic_{table}', 'attr_{index}')'''
+
+# 用于比较两个 schema 结构是否一致 (名称与定义中去掉 schema 前缀)
+DESCRIBE_SQL = {
+    "columns": """
+        SELECT c.relname, a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod), a.attnotnull,
+               pg_catalog.pg_get_expr(ad.adbin, ad.adrelid)
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+        LEFT JOIN pg_catalog.pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+        WHERE c.relnamespace = CAST(:schema AS regnamespace) AND c.relkind = 'r' AND a.attnum > 0 AND NOT a.attisdropped
+    """,
+    "constraints": """
+        SELECT c.relname, con.conname, pg_catalog.pg_get_constraintdef(con.oid)
+        FROM pg_catalog.pg_constraint con JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+        WHERE c.relnamespace = CAST(:schema AS regnamespace)
+    """,
+    "indexes": """
+        SELECT indexname, replace(indexdef, ' ON ' || schemaname || '.', ' ON ')
+        FROM pg_catalog.pg_indexes WHERE schemaname = :schema_name
+    """,
+    "sequences": """
+        SELECT sequencename, data_type, start_value, increment_by FROM pg_catalog.pg_sequences WHERE schemaname = :schema_name
+    """,
+}
+
+
+def build_script_location(workdir: str, synthetic_revisions: int) -> str:
+    """复制 migrations-tenants 到临时目录，并在真实 head 之后追加合成迁移"""
+    source = os.path.join(BASE_DIR, "migrations-tenants")
+    target = os.path.join(workdir, f"migrations-{synthetic_revisions}")
+    os.makedirs(os.path.join(target, "versions"))
+    for name in ("env.py", "script.py.mako"):
+        shutil.copy(os.path.join(source, name), target)
+    for path in glob.glob(os.path.join(source, "versions", "*.py")):
+        shutil.copy(path, os.path.join(target, "versions"))
+
+    down_revision = ScriptDirectory(target).get_current_head()
+    for index in range(synthetic_revisions):
+        revision = f"synthetic{index:05d}"
+        table = index // TABLE_EVERY
+        upgrade, downgrade = (CREATE_TABLE_OPS, DROP_TABLE_OPS) if index % TABLE_EVERY == 0 else (ADD_COLUMN_OPS, DROP_COLUMN_OPS)
+        with open(os.path.join(target, "versions", f"{revision}.py"), "w", encoding="utf-8") as f:
+            f.write(SYNTHETIC_REVISION.format(
+                index=index, revision=revision, down_revision=down_revision,
+                upgrade=upgrade.format(index=index, table=table), downgrade=downgrade.format(index=index, table=table),
+            ))
+        down_revision = revision
+    return target
+
+
+def replay_migrations(sync_engine, script_location: str, schema_name: str) -> float:
+    """CREATE SCHEMA + Alembic 回放全部迁移，返回耗时 (秒)"""
+    started = time.perf_counter()
+    with sync_engine.begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA {quote_ident(schema_name)}"))
+    with sync_engine.connect() as connection:
+        config = Config(TENANTS_ALEMBIC_INI)
+        config.set_main_option("script_location", script_location)
+        config.attributes["schema_name"] = schema_name
+        config.attributes["connection"] = connection
+        config.attributes["configure_logger"] = False
+        command.upgrade(config, "head")
+    return time.perf_counter() - started
+
+
+async def clone_from_template(template_schema: str, schema_name: str) -> float:
+    """从模板克隆 (单个事务)，返回耗时 (秒)"""
+    started = time.perf_counter()
+    async with AsyncSessionFactory() as session:
+        async with session.begin():
+            await clone_schema(session, template_schema, schema_name)
+    return time.perf_counter() - started
+
+
+def describe_schema(sync_engine, schema_name: str) -> dict:
+    params = {"schema": quote_ident(schema_name), "schema_name": schema_name}
+    with sync_engine.connect() as connection:
+        description = {key: sorted(tuple(row) for row in connection.execute(text(sql), params)) for key, sql in DESCRIBE_SQL.items()}
+        description["alembic_version"] = sorted(
+            row[0] for row in connection.execute(text(f"SELECT version_num FROM {quote_ident(schema_name)}.alembic_version"))
+        )
+    # 列默认值中的 nextval('<schema>.seq'::regclass) 与外键定义中的被引用表统一去掉 schema 前缀后再比较
+    description["columns"] = [
+        row[:4] + ((row[4] or "").replace(f"{schema_name}.", ""),) for row in description["columns"]
+    ]
+    description["constraints"] = [row[:2] + (row[2].replace(f"{schema_name}.", ""),) for row in description["constraints"]]
+    return description
+
+
+def tables_of(sync_engine, schema_name: str) -> list[str]:
+    with sync_engine.connect() as connection:
+        return [row[0] for row in connection.execute(
+            text("SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname = :schema_name"), {"schema_name": schema_name}
+        )]
+
+
+def drop_schemas(sync_engine, schema_names: list[str]) -> None:
+    for schema_name in schema_names:
+        with sync_engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {quote_ident(schema_name)} CASCADE"))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    sync_engine = create_engine(settings.DATABASE_URL)
+    workdir = tempfile.mkdtemp(prefix="bench_provisioning_")
+    created: list[str] = []
+    results = []
+    try:
+        for synthetic_revisions in args.revisions:
+            script_location = build_script_location(workdir, synthetic_revisions)
+            revision_count = len(list(ScriptDirectory(script_location).walk_revisions()))
+
+            template_schema = f"bench_prov_tpl_{synthetic_revisions}"
+            created.append(template_schema)
+            replay_migrations(sync_engine, script_location, template_schema)
+
+            replay_times, clone_times = [], []
+            for sample in range(args.samples):
+                replay_schema = f"bench_prov_replay_{synthetic_revisions}_{sample}"
+                clone_schema_name = f"bench_prov_clone_{synthetic_revisions}_{sample}"
+                created.extend([replay_schema, clone_schema_name])
+                replay_times.append(replay_migrations(sync_engine, script_location, replay_schema))
+                clone_times.append(await clone_from_template(template_schema, clone_schema_name))
+
+            identical = describe_schema(sync_engine, f"bench_prov_replay_{synthetic_revisions}_0") == describe_schema(
+                sync_engine, f"bench_prov_clone_{synthetic_revisions}_0"
+            )
+            replay = summarize_latencies(replay_times)
+            clone = summarize_latencies(clone_times)
+            results.append({
+                "revisions": revision_count,
+                "tables": len(tables_of(sync_engine, template_schema)),
+                "replay": replay,
+                "clone": clone,
+                "speedup_p50": round(replay["p50_ms"] / clone["p50_ms"], 1) if clone["p50_ms"] else None,
+                "identical_schema": identical,
+            })
+            print(f"revisions={revision_count}: replay p50 {replay['p50_ms']}ms, clone p50 {clone['p50_ms']}ms, identical={identical}")
+    finally:
+        if not args.keep:
+            drop_schemas(sync_engine, created)
+        shutil.rmtree(workdir, ignore_errors=True)
+        sync_engine.dispose()
+        await engine.dispose()
+
+    return {"samples": args.samples, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark tenant provisioning: template clone vs migration replay")
+    parser.add_argument("--revisions", type=lambda value: [int(n) for n in value.split(",")], default=[0, 25, 100, 200],
+                        help="comma separated numbers of synthetic revisions appended to the real migration chain")
+    parser.add_argument("--samples", type=int, default=5, help="schemas provisioned per mode and chain length")
+    parser.add_argument("--keep", action="store_true", help="keep the bench_prov_* schemas for inspection")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+    dump_json(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
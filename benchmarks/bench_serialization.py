@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+对比 GET /api/v1/users/ 一页数据的两种读取与序列化方式的 CPU 时间:
+
+* orm: crud_user.get_items 加载 Product 对象，经 FastAPI 的 response_model (List[ProductInDB]) 校验后由 JSONResponse 编码 (原有方式)
+* rows: crud_user.get_item_rows 只查询需要的列，用 orjson 直接编码 Row (当前列表接口的实现)
+
+创建一个 bench_serialization schema 并写入 --rows 个 products，对每个页大小交替运行两种方式各 --iterations 次
+(每次一个新的 session，与一个请求相同)，用 time.process_time 分别统计读取 (含驱动解码与对象构造) 和序列化的 CPU 时间，
+并确认两种方式输出的 JSON 内容一致。
+
+    python -m benchmarks.bench_serialization --page-sizes 20,100,1000 --iterations 500
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import create_bench_schemas, drop_bench_schemas, dump_json
+
+from fastapi.routing import APIRoute, serialize_response
+from starlette.responses import JSONResponse
+
+from api.v1.endpoints import users
+from core.db import AsyncSessionFactory, bind_tenant_schema, engine
+from crud import crud_user
+
+SCHEMA = "bench_serialization"
+
+
+def list_route() -> APIRoute:
+    return next(route for route in users.router.routes if isinstance(route, APIRoute) and route.endpoint is users.read_tenant_items)
+
+
+async def orm_page(limit: int, response_field) -> tuple[float, float, bytes]:
+    started = time.process_time()
+    async with AsyncSessionFactory() as session:
+        await bind_tenant_schema(session, SCHEMA)
+        items = await crud_user.get_items(session, limit=limit)
+        fetched = time.process_time()
+        content = await serialize_response(field=response_field, response_content=items)
+        body = JSONResponse(content).body
+        serialized = time.process_time()
+        await session.commit()
+    return fetched - started, serialized - fetched, body
+
+
+async def rows_page(limit: int, response_field) -> tuple[float, float, bytes]:
+    started = time.process_time()
+    async with AsyncSessionFactory() as session:
+        await bind_tenant_schema(session, SCHEMA)
+        rows = await crud_user.get_item_rows(session, limit=limit)
+        fetched = time.process_time()
+        body = users._encode_json_list(rows)
+        serialized = time.process_time()
+        await session.commit()
+    return fetched - started, serialized - fetched, body
+
+
+MODES = {"orm": orm_page, "rows": rows_page}
+
+
+async def bench_page_size(limit: int, args: argparse.Namespace, response_field) -> dict:
+    totals = {mode: [0.0, 0.0] for mode in MODES}
+    bodies = {}
+    for mode, page in MODES.items():  # 预热: 编译缓存、连接池
+        for _ in range(min(args.iterations, 20)):
+            await page(limit, response_field)
+    for _ in range(args.iterations):
+        for mode, page in MODES.items():
+            fetch_cpu, serialize_cpu, bodies[mode] = await page(limit, response_field)
+            totals[mode][0] += fetch_cpu
+            totals[mode][1] += serialize_cpu
+
+    result = {"page_size": limit, "identical_json": json.loads(bodies["orm"]) == json.loads(bodies["rows"])}
+    for mode, (fetch_cpu, serialize_cpu) in totals.items():
+        result[mode] = {
+            "fetch_cpu_us": round(fetch_cpu / args.iterations * 1e6, 1),
+            "serialize_cpu_us": round(serialize_cpu / args.iterations * 1e6, 1),
+            "total_cpu_us": round((fetch_cpu + serialize_cpu) / args.iterations * 1e6, 1),
+        }
+    result["speedup_total"] = round(result["orm"]["total_cpu_us"] / result["rows"]["total_cpu_us"], 2) if result["rows"]["total_cpu_us"] else None
+    return result
+
+
+async def main(args: argparse.Namespace) -> None:
+    await create_bench_schemas(engine, [SCHEMA], rows_per_schema=args.rows)
+    try:
+        response_field = list_route().response_field
+        results = []
+        for limit in args.page_sizes:
+            result = await bench_page_size(limit, args, response_field)
+            results.append(result)
+            print(f"page_size={limit:>5}: orm {result['orm']['total_cpu_us']}us/page "
+                  f"(serialize {result['orm']['serialize_cpu_us']}us), rows {result['rows']['total_cpu_us']}us/page "
+                  f"(serialize {result['rows']['serialize_cpu_us']}us), speedup x{result['speedup_total']}, "
+                  f"identical_json={result['identical_json']}")
+        dump_json({"rows": args.rows, "iterations": args.iterations, "results": results}, args.output)
+    finally:
+        if not args.keep:
+            await drop_bench_schemas(engine, [SCHEMA])
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-sizes", type=lambda value: [int(n) for n in value.split(",")], default=[20, 100, 1000])
+    parser.add_argument("--rows", type=int, default=1000, help="写入的 products 行数 (应不小于最大的页大小)")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="结束后保留创建的 schema")
+    parser.add_argument("--output", help="写入 JSON 结果的文件路径 (默认打印到标准输出)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""基准测试脚本共用的工具函数 (负载生成、延迟统计、结果输出)。"""
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Sequence
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """最近秩 (nearest-rank) 百分位数, sorted_values 必须已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies: Sequence[float]) -> dict:
+    """把以秒为单位的延迟列表汇总为毫秒级的分位数"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+async def run_load(
+    send_request: Callable[[int], Awaitable[int]],
+    total_requests: int,
+    concurrency: int,
+) -> dict:
+    """
+    用 concurrency 个协程并发执行 total_requests 次 send_request(i)。
+    send_request 返回 HTTP 状态码；结果包含吞吐量、延迟分位数和状态码分布。
+    """
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total_requests:
+            i = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                status_code = await send_request(i)
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status_code)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total_requests / elapsed, 1) if elapsed else 0.0,
+        "latency": summarize_latencies(latencies),
+        "statuses": dict(statuses),
+    }
+
+
+def dump_json(data: dict, path: str | None) -> None:
+    """输出 JSON 结果：指定 path 时写文件，否则打印到标准输出"""
+    text = json.dumps(data, indent=2, ensure_ascii=False, default=str)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def tenant_tables() -> list:
+    """models/tenant.py 中定义的、没有指定 schema 的租户表 (按依赖顺序)"""
+    # 导入 models.tenant 即注册了全部租户模型，它们与 public 模型共用 Product.metadata
+    from models.tenant import Product
+
+    return [table for table in Product.metadata.sorted_tables if table.schema is None]
+
+
+async def create_bench_schemas(engine, schema_names: Sequence[str], rows_per_schema: int = 0) -> None:
+    """
+    直接按模型定义创建基准测试用的租户 schema (不走 Alembic)，并为每个 schema 写入 rows_per_schema 个 products。
+    每个 schema 一个事务，避免单个事务持有过多锁。
+    """
+    from models.tenant import Product
+
+    from sqlalchemy import insert, text
+
+    tables = tenant_tables()
+    for schema in schema_names:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+            await conn.execution_options(schema_translate_map={None: schema})
+            await conn.run_sync(lambda sync_conn: tables[0].metadata.create_all(sync_conn, tables=tables))
+            if rows_per_schema:
+                await conn.execute(
+                    insert(Product),
+                    [{"name": f"product-{i}", "description": None, "price": 1.0 + i % 100} for i in range(rows_per_schema)],
+                )
+
+
+async def drop_bench_schemas(engine, schema_names: Sequence[str]) -> None:
+    from sqlalchemy import text
+
+    for schema in schema_names:
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE'))
+
+
+def git_revision() -> str | None:
+    """当前提交的短哈希 (工作区有未提交修改时加 -dirty)，便于在不同提交的结果之间对比"""
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_metric_totals(exposition: str) -> dict[str, float]:
+    """把 Prometheus 文本格式中每个指标名的所有样本 (不区分标签) 求和"""
+    totals: dict[str, float] = {}
+    for line in exposition.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        sample, _, value = line.rpartition(" ")
+        name = sample.split("{", 1)[0]
+        totals[name] = totals.get(name, 0.0) + float(value)
+    return totals
@@ -4,6 +4,8 @@ import os
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
+from core.shards import parse_shard_urls
+
 load_dotenv()
 
 
@@ -11,5 +13,122 @@ class Settings(BaseSettings):
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
     ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY", "default_key")
 
+    # --- 分片 (core/shards.py) ---
+    # 逗号分隔的 name=url，租户 schema 可以放在这些数据库中；DATABASE_URL 始终是名为 default 的分片，并存放 public.tenants
+    DATABASE_SHARDS: str = os.getenv("DATABASE_SHARDS", "")
+
+    # --- 共享 schema (core/tenancy.py) ---
+    # 小租户共用的 schema 名 (每个分片一个，由 run_migrations.py 创建并迁移) 与访问它时切换到的数据库角色
+    SHARED_TENANT_SCHEMA: str = os.getenv("SHARED_TENANT_SCHEMA", "tenant_shared")
+    SHARED_TENANT_ROLE: str = os.getenv("SHARED_TENANT_ROLE", "tenant_shared_rw")
+    # 创建租户时未指定 tenancy 的默认值: schema 或 shared
+    DEFAULT_TENANCY: str = os.getenv("DEFAULT_TENANCY", "schema")
+
+    # --- 只读副本 (仅用于 default 分片) ---
+    # 逗号分隔的只读副本连接串 (格式同 DATABASE_URL)；留空则只读请求也使用主库
+    DATABASE_REPLICA_URLS: str = os.getenv("DATABASE_REPLICA_URLS", "")
+    # 副本连接失败后，在该时间 (秒) 内不再向其分配读请求
+    DB_REPLICA_RETRY_INTERVAL: float = float(os.getenv("DB_REPLICA_RETRY_INTERVAL", "10"))
+
+    # --- 租户注册表缓存 (TenantMiddleware 使用) ---
+    # TENANT_CACHE_MAX_SIZE=0 或 TENANT_CACHE_TTL=0 表示关闭缓存
+    TENANT_CACHE_MAX_SIZE: int = int(os.getenv("TENANT_CACHE_MAX_SIZE", "10000"))
+    TENANT_CACHE_TTL: float = float(os.getenv("TENANT_CACHE_TTL", "30"))
+    TENANT_CACHE_NEGATIVE_TTL: float = float(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "5"))
+    # 负向条目 (不存在/未激活的租户) 单独计数的容量上限，不占用 TENANT_CACHE_MAX_SIZE
+    TENANT_CACHE_NEGATIVE_MAX_SIZE: int = int(os.getenv("TENANT_CACHE_NEGATIVE_MAX_SIZE", "1000"))
+    # 监听 public.tenants 变更通知 (LISTEN tenant_cache_invalidation)，使其他进程的修改立即生效
+    TENANT_CACHE_LISTEN: bool = os.getenv("TENANT_CACHE_LISTEN", "true").lower() in ("1", "true", "yes")
+
+    # --- 指标 (core/metrics.py, GET /metrics) ---
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # 导出时使用独立标签的租户数 (按请求数排名)，其余合并为 tenant="other"
+    METRICS_TOP_TENANTS: int = int(os.getenv("METRICS_TOP_TENANTS", "20"))
+    # 内存中保留明细的租户数上限，超出时请求数最少的租户并入 other
+    METRICS_TRACKED_TENANTS: int = int(os.getenv("METRICS_TRACKED_TENANTS", "1000"))
+
+    # --- SQL 性能剖析 (core/profiling.py) ---
+    PROFILE_SQL: bool = os.getenv("PROFILE_SQL", "false").lower() in ("1", "true", "yes")
+    # 超过该耗时 (毫秒) 的语句记入慢查询日志
+    PROFILE_SLOW_QUERY_MS: float = float(os.getenv("PROFILE_SLOW_QUERY_MS", "200"))
+    # 慢 SELECT 附带 EXPLAIN (ANALYZE, BUFFERS) 的抽样比例 (0-1，0 表示关闭；ANALYZE 会再执行一次查询)
+    PROFILE_EXPLAIN_SAMPLE_RATE: float = float(os.getenv("PROFILE_EXPLAIN_SAMPLE_RATE", "0"))
+    # 同一语句在一个请求中执行达到该次数时提示可能的 N+1 (0 表示关闭)
+    PROFILE_REPEAT_THRESHOLD: int = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "10"))
+    # 每个请求允许执行的语句数 (0 表示不限制)；PROFILE_QUERY_BUDGETS 按路由覆盖，例如 "GET /api/v1/users/=3,GET /api/v1/users/{item_id}=3"
+    PROFILE_QUERY_BUDGET: int = int(os.getenv("PROFILE_QUERY_BUDGET", "0"))
+    PROFILE_QUERY_BUDGETS: str = os.getenv("PROFILE_QUERY_BUDGETS", "")
+    # 超出预算时: log 记录警告；raise 使超出预算的语句抛出 QueryBudgetExceeded (用于测试)
+    PROFILE_QUERY_BUDGET_MODE: str = os.getenv("PROFILE_QUERY_BUDGET_MODE", "log")
+    # 按语句指纹聚合统计的数量上限
+    PROFILE_MAX_FINGERPRINTS: int = int(os.getenv("PROFILE_MAX_FINGERPRINTS", "500"))
+
+    # --- 请求级会话 ---
+    # 开启后, 租户查询、search_path 设置与业务查询共用同一个连接/事务 (每个请求只占用一次连接池)
+    DB_REQUEST_SCOPED_SESSION: bool = os.getenv("DB_REQUEST_SCOPED_SESSION", "false").lower() in ("1", "true", "yes")
+
+    # --- 租户绑定方式 ---
+    # search_path: 每个事务执行 SET LOCAL search_path (默认)
+    # schema_translate_map: 语句直接渲染为 "<schema>".<table>，无需额外往返
+    TENANT_BINDING_MODE: str = os.getenv("TENANT_BINDING_MODE", "search_path")
+
+    # --- 连接池 ---
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # 开启后使用租户亲和连接池 (core/pool.py): 优先复用已绑定同一租户的连接，
+    # search_path 改为会话级设置，连接已绑定所需 schema 时不再重复 SET (仅 search_path 绑定方式有效)
+    DB_POOL_TENANT_AFFINITY: bool = os.getenv("DB_POOL_TENANT_AFFINITY", "false").lower() in ("1", "true", "yes")
+
+    # --- 租户开通 ---
+    # 新租户从该模板 schema 克隆表结构 (模板由 run_migrations.py 维护在 head)；留空则只创建空 schema
+    TENANT_TEMPLATE_SCHEMA: str = os.getenv("TENANT_TEMPLATE_SCHEMA", "tenant_template")
+    # 批量创建租户接口单次请求允许的最大条目数
+    TENANT_BULK_MAX_ITEMS: int = int(os.getenv("TENANT_BULK_MAX_ITEMS", "5000"))
+    # 进程内并发执行开通任务的工作协程数 (0 表示本进程不执行开通任务)，任务使用独立的连接池
+    PROVISIONING_WORKERS: int = int(os.getenv("PROVISIONING_WORKERS", "2"))
+    # 没有新任务通知时轮询任务表的间隔 (秒)
+    PROVISIONING_POLL_INTERVAL: float = float(os.getenv("PROVISIONING_POLL_INTERVAL", "2"))
+    # 任务租约 (秒): 执行中的任务超过租约未完成 (例如进程崩溃) 时会被重新领取
+    PROVISIONING_JOB_LEASE: int = int(os.getenv("PROVISIONING_JOB_LEASE", "600"))
+    # 每个任务最多执行的次数 (含首次)；失败后等待 PROVISIONING_RETRY_BACKOFF * 2^(已执行次数-1) 秒重新排队
+    PROVISIONING_MAX_ATTEMPTS: int = int(os.getenv("PROVISIONING_MAX_ATTEMPTS", "3"))
+    PROVISIONING_RETRY_BACKOFF: float = float(os.getenv("PROVISIONING_RETRY_BACKOFF", "5"))
+
+    # --- 导出 ---
+    # 流式导出时每批从服务端游标读取的行数
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+    # --- 批量读取 ---
+    # GET /api/v1/users/batch 单次请求允许的最大 id 个数
+    PRODUCT_MULTI_GET_MAX_IDS: int = int(os.getenv("PRODUCT_MULTI_GET_MAX_IDS", "500"))
+
+    # --- 跨租户扇出查询 (core/fanout.py) ---
+    # 并发执行的查询数 (也是扇出查询独立连接池的大小)、union 模式下每条 UNION ALL 语句包含的 schema 数、单条语句超时 (毫秒)
+    FANOUT_CONCURRENCY: int = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+    FANOUT_UNION_BATCH_SIZE: int = int(os.getenv("FANOUT_UNION_BATCH_SIZE", "100"))
+    FANOUT_STATEMENT_TIMEOUT_MS: int = int(os.getenv("FANOUT_STATEMENT_TIMEOUT_MS", "30000"))
+
+    # --- 导入 ---
+    # 批量导入时每批校验并写入 COPY 的行数，以及响应中最多返回的错误条数
+    IMPORT_BATCH_SIZE: int = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+    IMPORT_MAX_ERRORS: int = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+    # --- 单行写入合并 ---
+    # 开启后并发的 POST /api/v1/users/ 按租户合并: 等待至多 MAX_DELAY 秒或凑满 MAX_SIZE 行后
+    # 用一条多行 INSERT ... RETURNING 写入并单独提交 (不再参与请求自身的事务)
+    PRODUCT_WRITE_BATCHING: bool = os.getenv("PRODUCT_WRITE_BATCHING", "false").lower() in ("1", "true", "yes")
+    PRODUCT_WRITE_BATCH_MAX_SIZE: int = int(os.getenv("PRODUCT_WRITE_BATCH_MAX_SIZE", "100"))
+    PRODUCT_WRITE_BATCH_MAX_DELAY: float = float(os.getenv("PRODUCT_WRITE_BATCH_MAX_DELAY", "0.005"))
+    # 同时执行的批次数上限 (每个批次占用一个连接)，应小于 DB_POOL_SIZE + DB_MAX_OVERFLOW
+    PRODUCT_WRITE_BATCH_MAX_CONCURRENCY: int = int(os.getenv("PRODUCT_WRITE_BATCH_MAX_CONCURRENCY", "4"))
+
+    @property
+    def shard_urls(self) -> dict[str, str]:
+        return parse_shard_urls(self.DATABASE_URL, self.DATABASE_SHARDS)
+
+    @property
+    def replica_urls(self) -> list[str]:
+        return [url.strip() for url in self.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+
 
 settings = Settings()
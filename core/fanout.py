@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+跨租户的扇出查询 (平台级报表)。
+
+对 public.tenants 中每个活跃租户的 schema 执行同一条参数化查询，结果按租户逐条产出:
+
+* parallel: 每个 schema 单独执行，最多 concurrency 个并发；
+* union: 每 union_batch_size 个 schema 拼成一条 UNION ALL 语句，批次之间同样受 concurrency 限制。
+  一个批次失败 (例如某个 schema 缺表) 时退回为逐个 schema 执行，只有出错的租户会被标记为失败。
+
+查询中用 {schema} 表示租户 schema (会被替换为加引号的标识符)，用 :name 表示绑定参数。
+每条查询都在只读事务中执行，并受 FANOUT_STATEMENT_TIMEOUT_MS 限制；
+在租户所在的分片上执行 (union 批次只包含同一分片的 schema)，每个分片使用独立的引擎/连接池
+(大小等于 concurrency)，不会占用处理 API 请求的连接。
+共享 schema 中的租户 (core/tenancy.py) 总是单独执行: {schema} 指向共享 schema，并以 app.tenant_id 与受 RLS 约束的角色限定为该租户的行。
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Literal, Optional, Sequence
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from core.config import settings
+from core.shards import DEFAULT_SHARD, UnknownShardError
+from core.tenancy import TENANCY_SHARED, TENANT_ID_SETTING
+
+logger = logging.getLogger(__name__)
+
+FanoutMode = Literal["parallel", "union"]
+
+SCHEMA_PLACEHOLDER = "{schema}"
+
+# 管理接口可以执行的预定义报表
+REPORTS: dict[str, str] = {
+    "product_count": "SELECT count(*) AS products FROM {schema}.products",
+    "product_price_stats": (
+        "SELECT count(*) AS products, min(price) AS min_price, max(price) AS max_price, avg(price) AS avg_price "
+        "FROM {schema}.products"
+    ),
+    "products_above_price": "SELECT count(*) AS products FROM {schema}.products WHERE price > :min_price",
+    "order_volume": "SELECT count(*) AS orders, coalesce(sum(quantity), 0) AS quantity FROM {schema}.orders",
+    "user_count": "SELECT count(*) AS users FROM {schema}.users",
+}
+
+
+def _quote_ident(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def render_for_schema(sql: str, schema_name: str) -> str:
+    return sql.replace(SCHEMA_PLACEHOLDER, _quote_ident(schema_name))
+
+
+def missing_params(sql: str, params: dict) -> list[str]:
+    """查询中用到但 params 没有提供的绑定参数名"""
+    return sorted(set(text(sql).compile().params) - set(params))
+
+
+@dataclass
+class TenantTarget:
+    tenant_id: int
+    schema_name: str
+    shard: str = DEFAULT_SHARD
+    shared: bool = False
+
+    @property
+    def data_schema(self) -> str:
+        return settings.SHARED_TENANT_SCHEMA if self.shared else self.schema_name
+
+
+@dataclass
+class TenantResult:
+    tenant_id: int
+    schema_name: str
+    ok: bool
+    rows: list[dict] = field(default_factory=list)
+    duration: float = 0.0
+    error: Optional[str] = None
+    shard: str = DEFAULT_SHARD
+
+    def as_dict(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "schema_name": self.schema_name,
+            "shard": self.shard,
+            "ok": self.ok,
+            "rows": self.rows,
+            "duration_ms": round(self.duration * 1000, 2),
+            "error": self.error,
+        }
+
+
+@dataclass
+class FanoutSummary:
+    tenants: int = 0
+    succeeded: int = 0
+    failed: list[str] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    def add(self, result: TenantResult) -> None:
+        self.tenants += 1
+        if result.ok:
+            self.succeeded += 1
+        else:
+            self.failed.append(result.schema_name)
+
+    def as_dict(self) -> dict:
+        return {
+            "tenants": self.tenants,
+            "succeeded": self.succeeded,
+            "failed": sorted(self.failed),
+            "wall_time_s": round(time.perf_counter() - self.started, 3),
+        }
+
+
+class TenantFanout:
+    def __init__(self, concurrency: int, union_batch_size: int, statement_timeout_ms: int):
+        self.concurrency = max(concurrency, 1)
+        self.union_batch_size = max(union_batch_size, 1)
+        self.statement_timeout_ms = statement_timeout_ms
+        self._engines: dict[str, AsyncEngine] = {}
+
+    def engine(self, shard: str = DEFAULT_SHARD) -> AsyncEngine:
+        engine = self._engines.get(shard)
+        if engine is None:
+            url = settings.shard_urls.get(shard)
+            if url is None:
+                raise UnknownShardError(f"Unknown shard '{shard}'")
+            engine = self._engines[shard] = create_async_engine(url, pool_size=self.concurrency, max_overflow=0, pool_pre_ping=True)
+        return engine
+
+    async def close(self) -> None:
+        for engine in self._engines.values():
+            await engine.dispose()
+        self._engines.clear()
+
+    async def active_tenants(self, tenant_ids: Optional[Sequence[int]] = None) -> list[TenantTarget]:
+        """活跃租户 (public.tenants 位于 default 分片)，按 id 排序；tenant_ids 为 None 时取全部，否则只取其中的租户 (空列表即没有租户)"""
+        sql = "SELECT id, schema_name, shard, tenancy FROM public.tenants WHERE is_active = true"
+        params = {}
+        if tenant_ids is not None:
+            if not tenant_ids:
+                return []
+            sql += " AND id = ANY(:tenant_ids)"
+            params["tenant_ids"] = list(tenant_ids)
+        async with self.engine().connect() as connection:
+            result = await connection.execute(text(sql + " ORDER BY id"), params)
+            return [TenantTarget(row.id, row.schema_name, row.shard, row.tenancy == TENANCY_SHARED) for row in result]
+
+    async def run(
+        self,
+        sql: str,
+        params: Optional[dict] = None,
+        mode: FanoutMode = "parallel",
+        tenant_ids: Optional[Sequence[int]] = None,
+    ) -> AsyncIterator[TenantResult]:
+        """按完成顺序逐个产出每个租户的结果。调用方提前停止迭代时，未完成的查询会被取消。"""
+        params = params or {}
+        if mode == "union" and SCHEMA_PLACEHOLDER not in sql:
+            raise ValueError("union mode requires the query to reference {schema}")
+        tenants = await self.active_tenants(tenant_ids)
+        if mode == "union":
+            by_shard: dict[str, list[TenantTarget]] = {}
+            for tenant in tenants:
+                if not tenant.shared:
+                    by_shard.setdefault(tenant.shard, []).append(tenant)
+            groups = [
+                shard_tenants[i:i + self.union_batch_size]
+                for shard_tenants in by_shard.values()
+                for i in range(0, len(shard_tenants), self.union_batch_size)
+            ]
+            groups += [[tenant] for tenant in tenants if tenant.shared]
+        else:
+            groups = [[tenant] for tenant in tenants]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_group(group: list[TenantTarget]) -> list[TenantResult]:
+            async with semaphore:
+                if len(group) == 1:
+                    return [await self._run_single(sql, params, group[0])]
+                return await self._run_union(sql, params, group)
+
+        tasks = [asyncio.create_task(run_group(group)) for group in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for result in await next_done:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _begin_read_only(self, connection: AsyncConnection) -> None:
+        await connection.execute(text("SET TRANSACTION READ ONLY"))
+        await connection.execute(select(func.set_config("statement_timeout", str(self.statement_timeout_ms), True)))
+
+    async def _run_single(self, sql: str, params: dict, tenant: TenantTarget) -> TenantResult:
+        started = time.perf_counter()
+        try:
+            async with self.engine(tenant.shard).connect() as connection:
+                await self._begin_read_only(connection)
+                # 查询没有使用 {schema} 时依靠 search_path 访问租户的表
+                await connection.execute(select(func.set_config("search_path", f"{_quote_ident(tenant.data_schema)}, public", True)))
+                if tenant.shared:
+                    await connection.execute(select(
+                        func.set_config(TENANT_ID_SETTING, str(tenant.tenant_id), True),
+                        func.set_config("role", settings.SHARED_TENANT_ROLE, True),
+                    ))
+                result = await connection.execute(text(render_for_schema(sql, tenant.data_schema)), params)
+                rows = [dict(row._mapping) for row in result]
+        except Exception as e:
+            return TenantResult(
+                tenant.tenant_id, tenant.schema_name, False,
+                duration=time.perf_counter() - started, error=f"{type(e).__name__}: {e}", shard=tenant.shard,
+            )
+        return TenantResult(tenant.tenant_id, tenant.schema_name, True, rows, time.perf_counter() - started, shard=tenant.shard)
+
+    async def _run_union(self, sql: str, params: dict, group: list[TenantTarget]) -> list[TenantResult]:
+        """group 中的租户都位于同一个分片"""
+        started = time.perf_counter()
+        selects = [
+            f"(SELECT CAST(:_fanout_s{i} AS text) AS _fanout_schema, _fanout_q.* FROM ({render_for_schema(sql, tenant.schema_name)}) AS _fanout_q)"
+            for i, tenant in enumerate(group)
+        ]
+        union_params = dict(params, **{f"_fanout_s{i}": tenant.schema_name for i, tenant in enumerate(group)})
+        try:
+            async with self.engine(group[0].shard).connect() as connection:
+                await self._begin_read_only(connection)
+                result = await connection.execute(text(" UNION ALL ".join(selects)), union_params)
+                rows_by_schema: dict[str, list[dict]] = {}
+                for row in result:
+                    values = dict(row._mapping)
+                    rows_by_schema.setdefault(values.pop("_fanout_schema"), []).append(values)
+        except Exception as e:
+            logger.warning(f"Fan-out batch of {len(group)} schemas failed, retrying schema by schema: {e}")
+            # 逐个执行以保持在本批次占用的并发额度之内
+            return [await self._run_single(sql, params, tenant) for tenant in group]
+        # 批次内各 schema 共享一条语句，耗时按批次平均计入
+        duration = (time.perf_counter() - started) / len(group)
+        return [
+            TenantResult(tenant.tenant_id, tenant.schema_name, True, rows_by_schema.get(tenant.schema_name, []), duration, shard=tenant.shard)
+            for tenant in group
+        ]
+
+
+tenant_fanout = TenantFanout(
+    concurrency=settings.FANOUT_CONCURRENCY,
+    union_batch_size=settings.FANOUT_UNION_BATCH_SIZE,
+    statement_timeout_ms=settings.FANOUT_STATEMENT_TIMEOUT_MS,
+)
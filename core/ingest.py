@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+把流式上传的 NDJSON / CSV 请求体分批解析、校验，不把整个请求体读入内存。
+
+解析器产出记录批次，每条记录为 (行号, 数据, 错误)：NDJSON 的数据是原始的一行字节，
+CSV 的数据是 {列名: 值}；解析阶段就失败的记录数据为 None、错误为说明文字。
+validate_batch 用 pydantic 校验一个批次，返回合法的模型对象和逐行的错误。
+"""
+import csv
+from typing import AsyncIterator, Optional, Sequence, Type
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+Record = tuple[int, object, Optional[str]]
+
+
+async def iter_line_groups(chunks: AsyncIterator[bytes]) -> AsyncIterator[list[bytes]]:
+    """按 \\n 切分字节流，每个数据块产出一组完整的行 (跨块的半行留到下一块)"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        if b"\n" not in chunk:
+            continue
+        *lines, buffer = buffer.split(b"\n")
+        yield lines
+    if buffer:
+        yield [buffer]
+
+
+async def iter_ndjson_batches(chunks: AsyncIterator[bytes], batch_size: int) -> AsyncIterator[list[Record]]:
+    batch: list[Record] = []
+    line_no = 0
+    async for lines in iter_line_groups(chunks):
+        for line in lines:
+            line_no += 1
+            if not line.strip():
+                continue
+            batch.append((line_no, line, None))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def iter_csv_batches(chunks: AsyncIterator[bytes], batch_size: int) -> AsyncIterator[list[Record]]:
+    """
+    第一行为表头。引号内可以包含换行: 一条记录中的 '"' 个数为奇数时说明引号尚未闭合，继续拼接下一行。
+    空字段视为未提供 (可选字段取默认值，必填字段报缺失)。
+    """
+    header: Optional[list[str]] = None
+    pending: list[str] = []
+    batch: list[Record] = []
+    start_line = line_no = 0
+    async for lines in iter_line_groups(chunks):
+        for raw_line in lines:
+            line_no += 1
+            try:
+                line = raw_line.decode("utf-8").rstrip("\r")
+            except UnicodeDecodeError as e:
+                batch.append((line_no, None, f"Invalid UTF-8: {e}"))
+                continue
+            if not pending:
+                start_line = line_no
+                if not line.strip():
+                    continue
+            pending.append(line)
+            text = "\n".join(pending)
+            if text.count('"') % 2:
+                continue
+            pending = []
+            try:
+                values = next(csv.reader([text]))
+            except csv.Error as e:
+                batch.append((start_line, None, f"Invalid CSV: {e}"))
+                continue
+            if header is None:
+                header = [name.strip() for name in values]
+            elif len(values) != len(header):
+                batch.append((start_line, None, f"Expected {len(header)} fields, got {len(values)}"))
+            else:
+                batch.append((start_line, {name: value for name, value in zip(header, values) if value != ""}, None))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if pending:
+        batch.append((start_line, None, "Unterminated quoted field"))
+    if batch:
+        yield batch
+
+
+def _format_errors(error: ValidationError, skip_loc: int = 0) -> dict[int, list[str]]:
+    """把 ValidationError 按 loc 的第一项 (批次中的下标) 分组为可读的错误信息"""
+    messages: dict[int, list[str]] = {}
+    for err in error.errors():
+        index, loc = (err["loc"][0], err["loc"][1:]) if skip_loc else (0, err["loc"])
+        messages.setdefault(index, []).append(f"{'.'.join(map(str, loc)) or 'row'}: {err['msg']}")
+    return messages
+
+
+def validate_batch(model: Type[BaseModel], batch: Sequence[Record]) -> tuple[list[BaseModel], list[tuple[int, list[str]]]]:
+    """
+    校验一个批次，返回 (合法的模型对象, 按行号排序的 [(行号, 错误信息), ...])。
+    整批一次交给 pydantic-core 校验 (NDJSON 直接在 pydantic-core 中解析 JSON)；
+    只有批次中存在不合法的行时才退回到逐行定位错误。
+    """
+    adapter = _list_adapter(model)
+    errors = [(line, [error]) for line, _, error in batch if error is not None]
+    records = [(line, data) for line, data, error in batch if error is None]
+    if not records:
+        return [], errors
+    is_json = isinstance(records[0][1], bytes)
+    try:
+        if not is_json:
+            return adapter.validate_python([data for _, data in records]), errors
+        valid = adapter.validate_json(b"[" + b",".join(data for _, data in records) + b"]")
+        # 某一行本身含有 "{...},{...}" 时拼接后的数组仍然合法，但与行不再一一对应
+        if len(valid) == len(records):
+            return valid, errors
+    except ValidationError as e:
+        if not is_json:
+            # 错误的 loc[0] 就是批次中的下标，剩余的行再整体校验一次
+            messages = _format_errors(e, skip_loc=1)
+            errors.extend((records[index][0], messages[index]) for index in sorted(messages))
+            valid = adapter.validate_python([data for index, (_, data) in enumerate(records) if index not in messages])
+            return valid, sorted(errors)
+    # 一行 JSON 损坏时整个数组都无法解析，只能逐行校验
+    valid = []
+    for line, data in records:
+        try:
+            valid.append(model.model_validate_json(data))
+        except ValidationError as line_error:
+            errors.append((line, _format_errors(line_error)[0]))
+    return valid, errors
+
+
+_adapters: dict[type, TypeAdapter] = {}
+
+
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(list[model])
+    return adapter
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的租户开通任务执行器。
+
+任务保存在 public.provisioning_jobs 中，PROVISIONING_WORKERS 个工作协程以 FOR UPDATE SKIP LOCKED 领取任务，
+多个应用进程可以同时运行而不会重复执行同一个任务。
+
+* 任务使用独立的引擎/连接池 (大小等于工作协程数)，不会占用处理 API 请求的连接；
+  租户位于其他分片时，schema 在该分片的数据库中创建 (模板也取自该分片)。
+* 模板 schema 不可用、需要回放 Alembic 迁移时，迁移在子进程中执行 (Alembic 的 context 是进程级全局对象，
+  且迁移是同步阻塞的)，不会阻塞事件循环。
+* 执行期间由心跳协程每隔三分之一个租约续约一次，耗时较长的迁移不会因租约到期被其他工作协程重复领取。
+* 失败时删除本次创建的 schema，任务按指数退避重新排队，执行 max_attempts 次仍失败才标记为 failed。
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from models.public import Tenant
+
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from core.config import settings
+from core.provisioning import provision_tenant_schema, quote_ident, schema_exists
+from core.shards import DEFAULT_SHARD, UnknownShardError
+from core.tenancy import TENANCY_SHARED
+from core.tenant_cache import tenant_cache
+from crud import crud_provisioning_job
+
+logger = logging.getLogger(__name__)
+
+
+def _migrate_schema_in_subprocess(schema_name: str, shard: str):
+    # 在子进程中导入，避免 API 进程加载 Alembic 迁移环境
+    from run_migrations import migrate_schema
+
+    return migrate_schema(schema_name, shard=shard)
+
+
+class ProvisioningWorkerPool:
+    def __init__(self, workers: int, poll_interval: float, lease_seconds: int, max_attempts: int = 3, retry_backoff: float = 5.0):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_backoff = retry_backoff
+        self._engine = None
+        self._session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+        # 其他分片上建 schema 用的引擎 (按需创建)；任务表始终在 default 分片
+        self._shard_engines: dict[str, AsyncEngine] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+        self.running = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        if self.workers <= 0 or self.started:
+            return
+        # 每个工作协程在执行任务的同时还可能有一个续约连接
+        self._engine = create_async_engine(settings.DATABASE_URL, pool_size=self.workers, max_overflow=self.workers, pool_pre_ping=True)
+        self._session_factory = async_sessionmaker(bind=self._engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"provisioning-worker-{i}") for i in range(self.workers)]
+        logger.info(f"Started {self.workers} provisioning workers")
+
+    async def stop(self) -> None:
+        """停止工作协程；执行到一半的任务保持 running，租约到期后会被重新领取"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+        for shard_engine in self._shard_engines.values():
+            await shard_engine.dispose()
+        self._shard_engines.clear()
+
+    def notify(self) -> None:
+        """有新任务提交后唤醒空闲的工作协程 (任务记录必须已提交)"""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            try:
+                claimed = await self._run_next_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Provisioning worker {index} error: {e}", exc_info=True)
+                claimed = False
+            if claimed:
+                continue
+            # 没有可执行的任务: 等待新任务通知或轮询间隔到期
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _run_next_job(self) -> bool:
+        async with self._session_factory() as db:
+            async with db.begin():
+                claimed = await crud_provisioning_job.claim_next_job(db, self.lease_seconds)
+        if claimed is None:
+            return False
+
+        job, tenant = claimed
+        self.running += 1
+        try:
+            heartbeat = asyncio.create_task(self._heartbeat(job.id), name=f"provisioning-lease-{job.id}")
+            try:
+                await self._provision(job.id, tenant)
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+        except Exception as e:
+            await self._record_failure(job.id, job.attempts, tenant, f"{type(e).__name__}: {e}")
+        else:
+            self.succeeded += 1
+        finally:
+            self.running -= 1
+        return True
+
+    async def _heartbeat(self, job_id: int) -> None:
+        """任务执行期间定期续约；任务已不再由本协程持有时停止续约"""
+        interval = max(self.lease_seconds / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with self._session_factory() as db:
+                    async with db.begin():
+                        renewed = await crud_provisioning_job.renew_lease(db, job_id, self.lease_seconds)
+            except Exception as e:
+                # 下一次心跳仍在租约内，暂不放弃
+                logger.warning(f"Provisioning job<id:{job_id}>: failed to renew lease: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Provisioning job<id:{job_id}>: job is no longer running, stop renewing its lease")
+                return
+
+    async def _record_failure(self, job_id: int, attempts: int, tenant: Tenant, error: str) -> None:
+        """未达到 max_attempts 时按指数退避重新排队，否则标记为 failed (租户保持未激活)"""
+        retry = attempts < self.max_attempts
+        delay = self.retry_backoff * 2 ** (attempts - 1)
+        async with self._session_factory() as db:
+            async with db.begin():
+                if retry:
+                    await crud_provisioning_job.requeue_job(db, job_id, error, delay)
+                else:
+                    await crud_provisioning_job.finish_job(db, job_id, error=error)
+        if retry:
+            logger.warning(f"Provisioning job<id:{job_id}> for schema '{tenant.schema_name}' failed "
+                           f"(attempt {attempts}/{self.max_attempts}), retrying in {delay:g}s: {error}")
+            self.retried += 1
+        else:
+            logger.error(f"Provisioning job<id:{job_id}> for schema '{tenant.schema_name}' failed after {attempts} attempts: {error}")
+            self.failed += 1
+
+    def _shard_session(self, shard: str) -> AsyncSession:
+        """连接到租户所在分片的 session"""
+        if shard == DEFAULT_SHARD:
+            return self._session_factory()
+        engine = self._shard_engines.get(shard)
+        if engine is None:
+            url = settings.shard_urls.get(shard)
+            if url is None:
+                raise UnknownShardError(f"Unknown shard '{shard}'")
+            engine = self._shard_engines[shard] = create_async_engine(url, pool_size=self.workers, max_overflow=0, pool_pre_ping=True)
+        return self._session_factory(bind=engine)
+
+    async def _set_step(self, job_id: int, step: str) -> None:
+        async with self._session_factory() as db:
+            async with db.begin():
+                await crud_provisioning_job.set_step(db, job_id, step, self.lease_seconds)
+
+    async def _provision(self, job_id: int, tenant: Tenant) -> None:
+        # 本次新建的 schema 在失败时删除 (租户未激活，不会有数据)，重试时可以从头开始 (例如重新从模板克隆)
+        created_schema = False
+        try:
+            # 1. 创建 schema (模板可用时直接克隆到 head)；共享租户不建 schema，只确认共享 schema 已由 run_migrations.py 创建
+            await self._set_step(job_id, "creating_schema")
+            async with self._shard_session(tenant.shard) as db:
+                async with db.begin():
+                    if tenant.tenancy == TENANCY_SHARED:
+                        if not await schema_exists(db, settings.SHARED_TENANT_SCHEMA):
+                            raise RuntimeError(f"Shared schema '{settings.SHARED_TENANT_SCHEMA}' does not exist on shard "
+                                               f"'{tenant.shard}'; run run_migrations.py first")
+                        cloned = True
+                    else:
+                        existed = await schema_exists(db, tenant.schema_name)
+                        cloned = await provision_tenant_schema(db, tenant.schema_name)
+                        created_schema = not existed
+
+            # 2. 无法克隆时在子进程中回放迁移
+            if not cloned:
+                await self._set_step(job_id, "migrating")
+                if self._executor is None:
+                    # spawn: 不把事件循环、连接池等状态 fork 进子进程
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, _migrate_schema_in_subprocess, tenant.schema_name, tenant.shard)
+                if not result.ok:
+                    raise RuntimeError(f"Migration failed: {result.error}")
+
+            # 3. 激活租户并完成任务 (同一事务)
+            await self._set_step(job_id, "activating")
+            async with self._session_factory() as db:
+                async with db.begin():
+                    await db.execute(update(Tenant).where(Tenant.id == tenant.id).values(is_active=True))
+                    await crud_provisioning_job.finish_job(db, job_id)
+                    await tenant_cache.invalidate_on_commit(db, tenant.id)
+        except Exception:
+            # created_schema 只在建 schema 的事务提交后才为 True (事务回滚时 schema 随之撤销)
+            if created_schema:
+                await self._drop_schema(tenant)
+            raise
+        logger.info(f"Provisioning job<id:{job_id}>: tenant '{tenant.schema_name}' is active")
+
+    async def _drop_schema(self, tenant: Tenant) -> None:
+        try:
+            async with self._shard_session(tenant.shard) as db:
+                async with db.begin():
+                    await db.execute(text(f"DROP SCHEMA IF EXISTS {quote_ident(tenant.schema_name)} CASCADE"))
+        except Exception as e:
+            # 删除失败不影响重试: 下次执行时 schema 已存在，退回为对其回放迁移
+            logger.error(f"Failed to drop partially provisioned schema '{tenant.schema_name}': {e}")
+        else:
+            logger.info(f"Dropped partially provisioned schema '{tenant.schema_name}'")
+
+
+provisioning_workers = ProvisioningWorkerPool(
+    workers=settings.PROVISIONING_WORKERS,
+    poll_interval=settings.PROVISIONING_POLL_INTERVAL,
+    lease_seconds=settings.PROVISIONING_JOB_LEASE,
+    max_attempts=settings.PROVISIONING_MAX_ATTEMPTS,
+    retry_backoff=settings.PROVISIONING_RETRY_BACKOFF,
+)
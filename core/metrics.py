@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+按租户统计的请求与数据库指标，以 Prometheus 文本格式导出 (GET /metrics)。
+
+每个请求由 middlewares.metrics.MetricsMiddleware 记录: 解析出的租户、状态码、耗时，
+以及请求期间执行的 SQL 语句数、数据库耗时和连接池取连接的等待时间
+(后两者通过 contextvar 由 SQLAlchemy 的游标事件和 core.pool 中的连接池累加到当前请求上)。
+
+租户标签的基数是有界的: 最多跟踪 METRICS_TRACKED_TENANTS 个租户的明细，超出时请求数最少的租户被并入 "other" (用最小堆挑选，不必扫描全部租户)；
+导出时只有请求数最多的 METRICS_TOP_TENANTS 个租户使用自己的标签，其余都合并为 tenant="other"。
+租户进出前 N 名时，其序列会出现/消失，"other" 的计数可能随之回落 (Prometheus 将其视为计数器重置)。
+"""
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.config import settings
+
+# 没有解析出租户的请求 (公共路径、租户不存在等)
+NO_TENANT = "none"
+OTHER_TENANTS = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+@dataclass
+class RequestMetrics:
+    """当前请求累计的数据库指标"""
+    statements: int = 0
+    db_time: float = 0.0
+    pool_wait: float = 0.0
+
+
+current_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request_metrics", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for index, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.sum += other.sum
+        self.count += other.count
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+
+
+class TenantSeries:
+    def __init__(self):
+        self.status: dict[str, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.pool_wait = 0.0
+
+    @property
+    def requests(self) -> int:
+        return self.latency.count
+
+    def merge(self, other: "TenantSeries") -> None:
+        for status, count in other.status.items():
+            self.status[status] = self.status.get(status, 0) + count
+        self.latency.merge(other.latency)
+        self.db_time.merge(other.db_time)
+        self.statements.merge(other.statements)
+        self.pool_wait += other.pool_wait
+
+
+class MetricsRegistry:
+    def __init__(self, top_tenants: int, tracked_tenants: int):
+        self.top_tenants = max(top_tenants, 0)
+        self.tracked_tenants = max(tracked_tenants, self.top_tenants)
+        self._tenants: dict[str, TenantSeries] = {}
+        # 淘汰候选的最小堆，每个被跟踪的租户一个条目 (入堆时的请求数, 序号, 租户)。请求数只增不减，堆中的值是下界，
+        # 淘汰时把过期的条目按当前请求数重新入堆，直到堆顶准确: 均摊 O(log n)，不必每次扫描全部租户
+        self._eviction_heap: list[tuple[int, int, str]] = []
+        self._sequence = itertools.count()
+        # 被挤出跟踪范围的租户的累计值
+        self._evicted = TenantSeries()
+        self.pool_wait = Histogram(LATENCY_BUCKETS)
+
+    def observe_request(self, tenant: str, status_code: int, duration: float, request: RequestMetrics) -> None:
+        series = self._tenants.get(tenant)
+        if series is None:
+            if len(self._tenants) >= self.tracked_tenants:
+                self._evict_one()
+            series = self._tenants[tenant] = TenantSeries()
+            heapq.heappush(self._eviction_heap, (0, next(self._sequence), tenant))
+        status = f"{status_code // 100}xx"
+        series.status[status] = series.status.get(status, 0) + 1
+        series.latency.observe(duration)
+        series.db_time.observe(request.db_time)
+        series.statements.observe(request.statements)
+        series.pool_wait += request.pool_wait
+
+    def _evict_one(self) -> None:
+        """淘汰请求数最少的租户"""
+        while True:
+            requests, _, tenant = self._eviction_heap[0]
+            current = self._tenants[tenant].requests
+            if current == requests:
+                break
+            heapq.heapreplace(self._eviction_heap, (current, next(self._sequence), tenant))
+        heapq.heappop(self._eviction_heap)
+        self._evicted.merge(self._tenants.pop(tenant))
+
+    def observe_pool_wait(self, seconds: float) -> None:
+        self.pool_wait.observe(seconds)
+        request = current_request_metrics.get()
+        if request is not None:
+            request.pool_wait += seconds
+
+    def snapshot(self) -> dict[str, TenantSeries]:
+        """前 N 名租户各自一个序列，其余合并为 other"""
+        ranked = sorted(self._tenants.items(), key=lambda item: item[1].requests, reverse=True)
+        series = dict(ranked[:self.top_tenants])
+        other = TenantSeries()
+        other.merge(self._evicted)
+        for _, rest in ranked[self.top_tenants:]:
+            other.merge(rest)
+        if other.requests:
+            series[OTHER_TENANTS] = other
+        return series
+
+    def render(self) -> str:
+        snapshot = self.snapshot()
+        lines: list[str] = []
+        _header(lines, "tenant_http_requests_total", "counter", "HTTP requests by tenant and status class")
+        for tenant, series in snapshot.items():
+            for status, count in sorted(series.status.items()):
+                lines.append(f"tenant_http_requests_total{_labels(tenant=tenant, status=status)} {count}")
+        _histograms(lines, "tenant_http_request_duration_seconds", "Request latency by tenant",
+                    ((tenant, series.latency) for tenant, series in snapshot.items()))
+        _histograms(lines, "tenant_db_time_seconds", "Time spent executing SQL statements per request",
+                    ((tenant, series.db_time) for tenant, series in snapshot.items()))
+        _histograms(lines, "tenant_db_statements", "SQL statements executed per request",
+                    ((tenant, series.statements) for tenant, series in snapshot.items()))
+        _header(lines, "tenant_db_statements_total", "counter", "SQL statements executed by tenant")
+        for tenant, series in snapshot.items():
+            lines.append(f"tenant_db_statements_total{_labels(tenant=tenant)} {_number(series.statements.sum)}")
+        _header(lines, "tenant_db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection by tenant")
+        for tenant, series in snapshot.items():
+            lines.append(f"tenant_db_pool_wait_seconds_total{_labels(tenant=tenant)} {_number(series.pool_wait)}")
+        _histograms(lines, "db_pool_checkout_wait_seconds", "Time spent getting a connection from the pool (including new connections)",
+                    [(None, self.pool_wait)])
+        return "\n".join(lines) + "\n"
+
+
+def render_gauge(name: str, help_text: str, samples: Iterable[tuple[dict, float]]) -> str:
+    lines: list[str] = []
+    _header(lines, name, "gauge", help_text)
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(**labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _header(lines: list[str], name: str, kind: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _histograms(lines: list[str], name: str, help_text: str, histograms: Iterable[tuple[Optional[str], Histogram]]) -> None:
+    _header(lines, name, "histogram", help_text)
+    for tenant, histogram in histograms:
+        base = {"tenant": tenant} if tenant is not None else {}
+        cumulative = 0
+        for upper, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**base, le=_number(upper))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(**base, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**base)} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(**base)} {histogram.count}")
+
+
+_LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value).translate(_LABEL_ESCAPES)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- SQL 语句计数与耗时: 对所有引擎生效，只记录在请求上下文中执行的语句 ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request_metrics.get() is not None:
+        conn.info.setdefault("metrics_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = current_request_metrics.get()
+    started = conn.info.get("metrics_query_started")
+    if request is None or not started:
+        return
+    request.statements += 1
+    request.db_time += time.perf_counter() - started.pop()
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # 出错的语句不会触发 after_cursor_execute，丢弃其开始时间
+    connection = exception_context.connection
+    if connection is not None and current_request_metrics.get() is not None:
+        started = connection.info.get("metrics_query_started")
+        if started:
+            started.pop()
+
+
+metrics_registry = MetricsRegistry(
+    top_tenants=settings.METRICS_TOP_TENANTS,
+    tracked_tenants=settings.METRICS_TRACKED_TENANTS,
+)
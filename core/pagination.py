@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+基于键集 (keyset) 的游标分页。
+
+游标是对 "排序方式 + 上一页最后一行的排序键" 的 base64 编码，客户端只需原样传回。
+下一页以 WHERE (排序键) > (游标中的值) ORDER BY 排序键 LIMIT n 查询，可以直接利用索引定位，
+不像 OFFSET 那样需要扫描并丢弃前面所有的行，翻到第 N 页与第 1 页的代价相同。
+"""
+import base64
+import binascii
+import json
+from typing import Any, Optional, Sequence
+
+from fastapi import Request, Response
+from sqlalchemy import Select, tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    payload = json.dumps({"s": sort, "k": list(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> list[Any]:
+    """解析游标，返回排序键的值；游标无效或与当前排序方式不符时抛出 InvalidCursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        cursor_sort, values = payload["s"], payload["k"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if cursor_sort != sort or not isinstance(values, list):
+        raise InvalidCursor(f"Cursor was not issued for sort '{sort}'")
+    return values
+
+
+def apply_keyset(stmt: Select, columns: Sequence, after: Optional[Sequence[Any]], limit: int) -> Select:
+    """按 columns 排序 (最后一列必须唯一，通常是主键)，只返回排在 after 之后的 limit 行"""
+    if after is not None:
+        if len(after) != len(columns) or not all(
+            isinstance(value, column.type.python_type) and not isinstance(value, bool) for column, value in zip(columns, after)
+        ):
+            raise InvalidCursor("Invalid cursor")
+        if len(columns) == 1:
+            stmt = stmt.where(columns[0] > after[0])
+        else:
+            stmt = stmt.where(tuple_(*columns) > tuple_(*after))
+    return stmt.order_by(*columns).limit(limit)
+
+
+def next_cursor(rows: Sequence[Any], attributes: Sequence[str], sort: str, limit: int) -> Optional[str]:
+    """本页已满时返回指向下一页的游标，否则 (已是最后一页) 返回 None"""
+    if limit <= 0 or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(sort, [getattr(last, attribute) for attribute in attributes])
+
+
+def set_next_page_headers(request: Request, response: Response, cursor: Optional[str]) -> None:
+    """
+    通过响应头返回下一页游标，响应体仍然是列表，保持与旧客户端兼容:
+    X-Next-Cursor: <cursor>，以及 Link: <下一页 URL>; rel="next"
+    """
+    if cursor is None:
+        return
+    url = request.url.remove_query_params("skip").include_query_params(cursor=cursor)
+    response.headers["X-Next-Cursor"] = cursor
+    response.headers["Link"] = f'<{url}>; rel="next"'
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.concurrency import await_only
+from sqlalchemy.util.queue import Empty, Full, QueueCommon
+
+from core.metrics import metrics_registry
+
+# 连接 info 字典中记录的 "该连接会话级 search_path 当前绑定的租户 schema"。
+# info 随底层 DBAPI 连接存在，连接失效重建时会被 SQLAlchemy 清空。
+SEARCH_PATH_INFO_KEY = "tenant_search_path"
+# 本事务中已执行、尚未提交的会话级 search_path: 只有所在连接的事务提交后才写入 SEARCH_PATH_INFO_KEY
+# (会话级 SET 是事务性的，回滚时会恢复为原值)
+PENDING_SEARCH_PATH_INFO_KEY = "tenant_search_path_pending"
+
+# 即将从连接池取连接的调用方所需要的租户 schema (由 core.db.bind_tenant_schema 设置)
+requested_tenant_schema: ContextVar[Optional[str]] = ContextVar("requested_tenant_schema", default=None)
+
+
+class AffinityStats:
+    """租户亲和连接池的统计计数，用于调优 pool_size 等参数"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        # 取连接时: 空闲连接中找到了已绑定所需 schema 的连接 / 没找到
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        # 绑定时: 连接已绑定所需 schema，跳过 SET / 需要重新 SET
+        self.search_path_skipped = 0
+        self.search_path_set = 0
+
+    def as_dict(self) -> dict:
+        checkouts = self.affinity_hits + self.affinity_misses
+        binds = self.search_path_skipped + self.search_path_set
+        return {
+            "affinity_hits": self.affinity_hits,
+            "affinity_misses": self.affinity_misses,
+            "affinity_hit_rate": round(self.affinity_hits / checkouts, 4) if checkouts else 0.0,
+            "search_path_skipped": self.search_path_skipped,
+            "search_path_set": self.search_path_set,
+            "search_path_skip_rate": round(self.search_path_skipped / binds, 4) if binds else 0.0,
+        }
+
+
+affinity_stats = AffinityStats()
+
+
+class _TenantAffinityQueue(QueueCommon):
+    """
+    连接池的空闲连接队列: 优先返回已绑定到所需租户 schema 的空闲连接；找不到时退化为普通的 FIFO/LIFO 行为。
+
+    空闲连接保存在自己的 deque 中，并按归还时已绑定的 schema 建立索引，不依赖 asyncio.Queue 的内部结构。
+    等待连接的协程与 asyncio.Queue 一样: 归还连接时唤醒一个等待者，被唤醒的协程重新检查是否有空闲连接。
+    空闲连接数不超过 pool_size，从 deque 中移除指定连接的线性代价可以忽略。
+    """
+
+    def __init__(self, maxsize: int = 0, use_lifo: bool = False):
+        self.maxsize = maxsize
+        self.use_lifo = use_lifo
+        self._idle: deque = deque()
+        self._idle_by_schema: dict[str, list] = {}
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def empty(self) -> bool:
+        return not self._idle
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._idle)
+
+    def qsize(self) -> int:
+        return len(self._idle)
+
+    def put_nowait(self, item) -> None:
+        if self.full():
+            raise Full()
+        self._idle.append(item)
+        schema_name = item.info.get(SEARCH_PATH_INFO_KEY)
+        if schema_name is not None:
+            self._idle_by_schema.setdefault(schema_name, []).append(item)
+        self._wakeup_next()
+
+    def put(self, item, block: bool = True, timeout: Optional[float] = None) -> None:
+        # 连接池只做非阻塞的归还；超出容量的连接由连接池关闭
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        schema_name = requested_tenant_schema.get()
+        if schema_name is not None:
+            record = self._take_bound_to(schema_name)
+            if record is not None:
+                affinity_stats.affinity_hits += 1
+                return record
+            affinity_stats.affinity_misses += 1
+        if not self._idle:
+            raise Empty()
+        record = self._idle.pop() if self.use_lifo else self._idle.popleft()
+        self._unindex(record)
+        return record
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        if block and not self._idle:
+            await_only(self._wait_for_idle(timeout))
+        return self.get_nowait()
+
+    def _take_bound_to(self, schema_name: str):
+        records = self._idle_by_schema.get(schema_name)
+        while records:
+            record = records.pop() if self.use_lifo else records.pop(0)
+            if record.info.get(SEARCH_PATH_INFO_KEY) != schema_name:
+                continue
+            try:
+                self._idle.remove(record)
+            except ValueError:
+                continue
+            return record
+        return None
+
+    def _unindex(self, record) -> None:
+        records = self._idle_by_schema.get(record.info.get(SEARCH_PATH_INFO_KEY))
+        if records and record in records:
+            records.remove(record)
+
+    def _wakeup_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def _wait_for_idle(self, timeout: Optional[float]) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self._idle:
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                if deadline is None:
+                    await waiter
+                else:
+                    await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                self._discard_waiter(waiter)
+                raise Empty()
+            except BaseException:
+                self._discard_waiter(waiter)
+                raise
+
+    def _discard_waiter(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            # 已被唤醒却不再取连接 (超时或被取消): 把唤醒转交给下一个等待者
+            if self._idle:
+                self._wakeup_next()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """记录每次取连接的等待时间 (包括新建连接) 到 core.metrics"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics_registry.observe_pool_wait(time.perf_counter() - started)
+
+
+class TenantAffinityPool(TimedQueuePool):
+    """在 AsyncAdaptedQueuePool 的基础上增加租户亲和: 同一租户的请求尽量复用同一批后端连接，
+    减少 search_path 切换以及 PostgreSQL 后端 catalog/计划缓存的抖动。"""
+
+    _queue_class = _TenantAffinityQueue
+
+    def _do_return_conn(self, record) -> None:
+        # 归还前未提交的事务已被回滚 (reset on return)，其中的 SET 随之撤销
+        record.info.pop(PENDING_SEARCH_PATH_INFO_KEY, None)
+        super()._do_return_conn(record)
+
+
+# --- 绑定记录的维护: 以实际提交/回滚的连接为准 ---
+@event.listens_for(Engine, "commit")
+def _confirm_search_path(conn):
+    pending = conn.info.pop(PENDING_SEARCH_PATH_INFO_KEY, None)
+    if pending is not None:
+        conn.info[SEARCH_PATH_INFO_KEY] = pending
+
+
+@event.listens_for(Engine, "rollback")
+def _discard_pending_search_path(conn):
+    conn.info.pop(PENDING_SEARCH_PATH_INFO_KEY, None)
+
+
+@event.listens_for(Engine, "rollback_savepoint")
+def _forget_search_path_on_savepoint_rollback(conn, name, context):
+    # 无法确定 SET 是否在保存点之后执行: 清除记录，下次绑定时重新 SET
+    _forget_search_path(conn.info)
+
+
+@event.listens_for(Engine, "handle_error")
+def _forget_search_path_on_error(exception_context):
+    # 包括提交失败 (commit 事件已先行写入绑定记录)
+    connection = exception_context.connection
+    if connection is not None and not connection.closed and not connection.invalidated:
+        _forget_search_path(connection.info)
+
+
+def _forget_search_path(info: dict) -> None:
+    info.pop(PENDING_SEARCH_PATH_INFO_KEY, None)
+    info.pop(SEARCH_PATH_INFO_KEY, None)
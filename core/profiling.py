@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 性能剖析 (PROFILE_SQL=true 时由 middlewares.profiling.ProfilingMiddleware 启用)。
+
+基于 SQLAlchemy 的游标事件，为每个请求记录每条语句的指纹 (去掉字面量与参数后的规范化文本的哈希)、耗时与行数:
+
+* 慢查询日志: 耗时超过 PROFILE_SLOW_QUERY_MS 的语句连同租户 schema、路由、行数一起记录 WARNING；
+  按 PROFILE_EXPLAIN_SAMPLE_RATE 抽样，对慢的 SELECT 在同一连接上再执行一次 EXPLAIN (ANALYZE, BUFFERS) 并附在日志中
+  (ANALYZE 会真正再执行一遍查询；在保存点中执行，失败不会影响请求的事务)。
+* N+1 检测: 同一指纹在一个请求中执行超过 PROFILE_REPEAT_THRESHOLD 次时记录 WARNING。
+* 查询预算: 路由 ("GET /api/v1/users/") 的语句数超过 PROFILE_QUERY_BUDGETS 中的配置 (未配置时为 PROFILE_QUERY_BUDGET，
+  0 表示不限制) 时，PROFILE_QUERY_BUDGET_MODE=log 记录 WARNING；=raise 时超出预算的那条语句抛出 QueryBudgetExceeded，
+  测试中请求会以 500 失败 (TestClient 默认直接抛出该异常)，用于在 CI 中拦截查询数的回归。
+* 聚合: 按指纹累计执行次数、总耗时与最大耗时 (最多 PROFILE_MAX_FINGERPRINTS 个)，见 GET /admin/stats 的 sql_profile。
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_BUDGET_MODES = ("log", "raise")
+# 日志中语句文本的最大长度
+MAX_LOGGED_STATEMENT = 2000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_VALUE_LISTS = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def normalize_statement(statement: str) -> str:
+    """去掉字面量与参数、合并多行 VALUES 与 IN 列表，同一形状的语句得到相同的文本"""
+    text = _STRING_LITERAL.sub("?", statement)
+    text = _PARAMETER.sub("?", text)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = _VALUE_LISTS.sub(r"\1, ...", text)
+    text = _IN_LIST.sub("IN (...)", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def parse_budgets(spec: str) -> dict[str, int]:
+    """逗号分隔的 "METHOD /path=N"，path 为路由模板 (例如 GET /api/v1/users/{item_id}=2)"""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, sep, value = item.rpartition("=")
+        if not sep or not route.strip():
+            raise ValueError(f"Invalid query budget '{item}', expected 'METHOD /path=N'")
+        budgets[route.strip()] = int(value)
+    return budgets
+
+
+@dataclass
+class QueryRecord:
+    fingerprint: str
+    normalized: str
+    duration: float
+    rowcount: int
+
+
+@dataclass
+class RequestProfile:
+    method: str
+    scope: dict
+    queries: list[QueryRecord] = field(default_factory=list)
+    fingerprint_counts: dict[str, int] = field(default_factory=dict)
+    budget_reported: bool = False
+    repeats_reported: set[str] = field(default_factory=set)
+
+    @property
+    def route(self) -> str:
+        """路由模板 (路由匹配之前为请求路径)"""
+        route = self.scope.get("route")
+        return f"{self.method} {getattr(route, 'path', None) or self.scope.get('path', '')}"
+
+    @property
+    def routed(self) -> bool:
+        # FastAPI 在路由匹配后写入 scope["route"] (较旧的版本只有 endpoint)
+        return "route" in self.scope or "endpoint" in self.scope
+
+    @property
+    def tenant_schema(self) -> Optional[str]:
+        return self.scope.get("state", {}).get("tenant_schema")
+
+    @property
+    def db_time(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+class FingerprintStats:
+    def __init__(self, normalized: str):
+        self.normalized = normalized
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+
+
+class SqlProfiler:
+    def __init__(
+        self,
+        slow_query_ms: float,
+        explain_sample_rate: float,
+        repeat_threshold: int,
+        default_budget: int,
+        budgets: dict[str, int],
+        budget_mode: str,
+        max_fingerprints: int,
+    ):
+        if budget_mode not in PROFILE_BUDGET_MODES:
+            raise ValueError(f"PROFILE_QUERY_BUDGET_MODE must be one of {PROFILE_BUDGET_MODES}, got '{budget_mode}'")
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.repeat_threshold = repeat_threshold
+        self.default_budget = default_budget
+        self.budgets = budgets
+        self.budget_mode = budget_mode
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints: dict[str, FingerprintStats] = {}
+        self._normalized_cache: dict[str, tuple[str, str]] = {}
+
+        self.requests = 0
+        self.slow_queries = 0
+        self.explained = 0
+        self.budget_violations = 0
+        self.repeat_warnings = 0
+
+    def budget_for(self, route: str) -> int:
+        return self.budgets.get(route, self.default_budget)
+
+    def _fingerprint(self, statement: str) -> tuple[str, str]:
+        # 语句文本来自 SQLAlchemy 的编译缓存，种类有限；缓存规范化结果避免每次执行都跑正则
+        cached = self._normalized_cache.get(statement)
+        if cached is None:
+            normalized = normalize_statement(statement)
+            cached = (fingerprint(normalized), normalized)
+            if len(self._normalized_cache) < 10000:
+                self._normalized_cache[statement] = cached
+        return cached
+
+    def before_statement(self, profile: RequestProfile) -> None:
+        """语句执行前检查查询预算 (raise 模式下超出预算的语句不会执行)"""
+        if not profile.routed:
+            return
+        budget = self.budget_for(profile.route)
+        if budget and len(profile.queries) >= budget and self.budget_mode == "raise":
+            self._report_budget(profile, budget)
+            raise QueryBudgetExceeded(
+                f"{profile.route} exceeded its query budget of {budget} statements "
+                f"(executed: {', '.join(f'{fp}x{count}' for fp, count in profile.fingerprint_counts.items())})"
+            )
+
+    def after_statement(self, profile: RequestProfile, statement: str, duration: float, rowcount: int, explain) -> None:
+        fp, normalized = self._fingerprint(statement)
+        profile.queries.append(QueryRecord(fp, normalized, duration, rowcount))
+        count = profile.fingerprint_counts[fp] = profile.fingerprint_counts.get(fp, 0) + 1
+        self._aggregate(fp, normalized, duration, rowcount)
+
+        if duration >= self.slow_query_seconds:
+            self.slow_queries += 1
+            plan = None
+            if explain is not None and self.explain_sample_rate > 0 and random.random() < self.explain_sample_rate:
+                plan = explain()
+                if plan is not None:
+                    self.explained += 1
+            logger.warning(
+                f"Slow query {duration * 1000:.1f}ms rows={rowcount} fingerprint={fp} "
+                f"route='{profile.route}' tenant_schema={profile.tenant_schema}: {statement[:MAX_LOGGED_STATEMENT]}"
+                + (f"\n{plan}" if plan else "")
+            )
+        if self.repeat_threshold and count == self.repeat_threshold and fp not in profile.repeats_reported:
+            profile.repeats_reported.add(fp)
+            self.repeat_warnings += 1
+            logger.warning(
+                f"Possible N+1: fingerprint {fp} executed {count} times in one request "
+                f"(route='{profile.route}', tenant_schema={profile.tenant_schema}): {normalized[:MAX_LOGGED_STATEMENT]}"
+            )
+
+    def finish_request(self, profile: RequestProfile) -> None:
+        self.requests += 1
+        budget = self.budget_for(profile.route)
+        if budget and len(profile.queries) > budget:
+            self._report_budget(profile, budget)
+
+    def _report_budget(self, profile: RequestProfile, budget: int) -> None:
+        if profile.budget_reported:
+            return
+        profile.budget_reported = True
+        self.budget_violations += 1
+        top = sorted(profile.fingerprint_counts.items(), key=lambda item: item[1], reverse=True)[:5]
+        logger.warning(
+            f"Query budget exceeded: {profile.route} (tenant_schema={profile.tenant_schema}) "
+            f"executed {len(profile.queries)} statements, budget {budget}; most frequent: "
+            + ", ".join(f"{fp}x{count}" for fp, count in top)
+        )
+
+    def _aggregate(self, fp: str, normalized: str, duration: float, rowcount: int) -> None:
+        stats = self._fingerprints.get(fp)
+        if stats is None:
+            if len(self._fingerprints) >= self.max_fingerprints:
+                return
+            stats = self._fingerprints[fp] = FingerprintStats(normalized)
+        stats.calls += 1
+        stats.total_time += duration
+        stats.max_time = max(stats.max_time, duration)
+        stats.rows += max(rowcount, 0)
+
+    def stats(self, top: int = 20) -> dict:
+        ranked = sorted(self._fingerprints.items(), key=lambda item: item[1].total_time, reverse=True)[:top]
+        return {
+            "enabled": settings.PROFILE_SQL,
+            "requests": self.requests,
+            "slow_queries": self.slow_queries,
+            "explained": self.explained,
+            "budget_violations": self.budget_violations,
+            "repeat_warnings": self.repeat_warnings,
+            "fingerprints": len(self._fingerprints),
+            "top_by_total_time": [
+                {
+                    "fingerprint": fp,
+                    "statement": stats.normalized[:500],
+                    "calls": stats.calls,
+                    "total_ms": round(stats.total_time * 1000, 2),
+                    "avg_ms": round(stats.total_time * 1000 / stats.calls, 3),
+                    "max_ms": round(stats.max_time * 1000, 2),
+                    "rows": stats.rows,
+                }
+                for fp, stats in ranked
+            ],
+        }
+
+
+def _explain(conn, statement: str, parameters, context) -> Optional[str]:
+    """在保存点中对 SELECT 执行 EXPLAIN (ANALYZE, BUFFERS)，任何失败都只返回 None"""
+    if context is None or context.execution_options.get("stream_results") or not statement.lstrip()[:6].upper() == "SELECT":
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_profiling_explain")
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT sql_profiling_explain")
+            logger.debug(f"EXPLAIN failed: {e}")
+            return None
+        cursor.execute("RELEASE SAVEPOINT sql_profiling_explain")
+        return plan
+    except Exception as e:
+        # 例如不在事务中 (autocommit) 时无法使用保存点
+        logger.debug(f"EXPLAIN skipped: {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None:
+        return
+    sql_profiler.before_statement(profile)
+    conn.info.setdefault("profiling_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    started = conn.info.get("profiling_query_started")
+    if profile is None or not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    explain = None if executemany else (lambda: _explain(conn, statement, parameters, context))
+    sql_profiler.after_statement(profile, statement, duration, cursor.rowcount, explain)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and current_profile.get() is not None:
+        started = connection.info.get("profiling_query_started")
+        if started:
+            started.pop()
+
+
+sql_profiler = SqlProfiler(
+    slow_query_ms=settings.PROFILE_SLOW_QUERY_MS,
+    explain_sample_rate=settings.PROFILE_EXPLAIN_SAMPLE_RATE,
+    repeat_threshold=settings.PROFILE_REPEAT_THRESHOLD,
+    default_budget=settings.PROFILE_QUERY_BUDGET,
+    budgets=parse_budgets(settings.PROFILE_QUERY_BUDGETS),
+    budget_mode=settings.PROFILE_QUERY_BUDGET_MODE,
+    max_fingerprints=settings.PROFILE_MAX_FINGERPRINTS,
+)
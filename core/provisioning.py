@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+租户 schema 开通: 从一个保持在 head 的模板 schema 克隆出新租户的表结构。
+
+与逐个回放 migrations-tenants/versions 中的迁移相比，克隆只需要读取一次模板的 catalog，
+然后以一条多语句 DDL 在当前事务中完成建表，耗时基本不随迁移链的长度增长。
+模板 schema 由 run_migrations.py 与租户 schema 一起迁移到 head。
+"""
+import logging
+import os
+from functools import lru_cache
+
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TENANTS_ALEMBIC_INI = os.path.join(BASE_DIR, "alembic-tenants.ini")
+
+
+def quote_ident(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+@lru_cache(maxsize=1)
+def tenant_head_revision() -> str:
+    """租户迁移链的 head (有多个 head 时以 ',' 连接)，进程内只解析一次迁移脚本"""
+    config = Config(TENANTS_ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(BASE_DIR, config.get_main_option("script_location")))
+    return ",".join(sorted(ScriptDirectory.from_config(config).get_heads()))
+
+
+async def get_schema_revision(db: AsyncSession, schema_name: str) -> str | None:
+    """schema 当前的 alembic 版本；schema 或 alembic_version 表不存在时返回 None"""
+    exists = await db.scalar(select(func.to_regclass(f"{quote_ident(schema_name)}.alembic_version")))
+    if exists is None:
+        return None
+    rows = await db.execute(text(f"SELECT version_num FROM {quote_ident(schema_name)}.alembic_version"))
+    return ",".join(sorted(row[0] for row in rows)) or None
+
+
+async def schema_exists(db: AsyncSession, schema_name: str) -> bool:
+    result = await db.execute(text("SELECT 1 FROM pg_catalog.pg_namespace WHERE nspname = :name"), {"name": schema_name})
+    return result.first() is not None
+
+
+# --- 读取模板 catalog 的查询 (执行时 search_path 只包含模板 schema，pg_get_* 输出的对象名不带 schema) ---
+_TABLES_SQL = text("""
+    SELECT c.relname
+    FROM pg_catalog.pg_class c
+    WHERE c.relnamespace = CAST(:template AS regnamespace) AND c.relkind = 'r'
+    ORDER BY c.oid
+""")
+
+_UNSUPPORTED_OBJECTS_SQL = text("""
+    SELECT c.relname FROM pg_catalog.pg_class c
+    WHERE c.relnamespace = CAST(:template AS regnamespace) AND c.relkind NOT IN ('r', 'S', 'i')
+    UNION ALL
+    SELECT t.typname FROM pg_catalog.pg_type t
+    WHERE t.typnamespace = CAST(:template AS regnamespace) AND t.typtype IN ('e', 'd', 'r', 'm')
+    UNION ALL
+    SELECT p.proname FROM pg_catalog.pg_proc p
+    WHERE p.pronamespace = CAST(:template AS regnamespace)
+""")
+
+_SEQUENCES_SQL = text("""
+    SELECT seq.relname AS sequencename, pg_catalog.format_type(s.seqtypid, NULL) AS data_type,
+           s.seqstart AS start_value, s.seqmin AS min_value, s.seqmax AS max_value, s.seqincrement AS increment_by,
+           s.seqcycle AS cycle, s.seqcache AS cache_size,
+           owner.relname AS owner_table, a.attname AS owner_column, COALESCE(a.attidentity <> '', false) AS is_identity
+    FROM pg_catalog.pg_sequence s
+    JOIN pg_catalog.pg_class seq ON seq.oid = s.seqrelid
+    LEFT JOIN pg_catalog.pg_depend d
+        ON d.classid = 'pg_catalog.pg_class'::regclass AND d.objid = seq.oid AND d.deptype IN ('a', 'i')
+        AND d.refclassid = 'pg_catalog.pg_class'::regclass
+    LEFT JOIN pg_catalog.pg_class owner ON owner.oid = d.refobjid
+    LEFT JOIN pg_catalog.pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE seq.relnamespace = CAST(:template AS regnamespace)
+    ORDER BY seq.oid
+""")
+
+_DEFAULTS_SQL = text("""
+    SELECT c.relname, a.attname, pg_catalog.pg_get_expr(ad.adbin, ad.adrelid)
+    FROM pg_catalog.pg_attrdef ad
+    JOIN pg_catalog.pg_class c ON c.oid = ad.adrelid
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = ad.adrelid AND a.attnum = ad.adnum
+    WHERE c.relnamespace = CAST(:template AS regnamespace) AND c.relkind = 'r' AND a.attgenerated = ''
+    ORDER BY c.oid, a.attnum
+""")
+
+_CONSTRAINTS_SQL = text("""
+    SELECT c.relname, con.conname, con.contype, pg_catalog.pg_get_constraintdef(con.oid)
+    FROM pg_catalog.pg_constraint con
+    JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+    WHERE c.relnamespace = CAST(:template AS regnamespace) AND c.relkind = 'r' AND con.contype IN ('p', 'u', 'x', 'f')
+    ORDER BY con.contype = 'f', c.oid, con.oid
+""")
+
+# 不属于约束的索引 (主键/唯一/排斥约束的索引随约束一起创建)。
+# pg_get_indexdef 总是带上表所在的 schema，这里直接替换为目标 schema
+_INDEXES_SQL = text("""
+    SELECT replace(pg_catalog.pg_get_indexdef(i.indexrelid),
+                   ' ON ' || quote_ident(:template_name) || '.', ' ON ' || quote_ident(:target_name) || '.')
+    FROM pg_catalog.pg_index i
+    JOIN pg_catalog.pg_class c ON c.oid = i.indrelid
+    WHERE c.relnamespace = CAST(:template AS regnamespace) AND c.relkind = 'r'
+      AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_constraint con WHERE con.conindid = i.indexrelid AND con.conrelid = i.indrelid)
+    ORDER BY c.oid, i.indexrelid
+""")
+
+
+async def _set_local_search_path(db: AsyncSession, search_path: str) -> None:
+    await db.execute(select(func.set_config("search_path", search_path, True)))
+
+
+async def clone_schema(db: AsyncSession, template_schema: str, schema_name: str) -> int:
+    """
+    在 db 当前事务中以 template_schema 为模板创建 schema_name，返回克隆的表数量。
+
+    复制表 (列、NOT NULL/CHECK、identity、注释)、序列、列默认值、主键/唯一/外键约束、
+    其他索引 (保留原名，后续迁移中的 drop_index 等操作仍然适用) 以及 alembic_version 中的版本号；
+    不复制业务数据。模板中存在视图、函数、自定义类型等对象时抛出 ValueError。
+    事务结束前 search_path 保持为 public。
+    """
+    template = quote_ident(template_schema)
+    target = quote_ident(schema_name)
+    # regnamespace 按标识符解析 schema 名，需要带引号
+    params = {"template": template}
+
+    unsupported = [row[0] for row in await db.execute(_UNSUPPORTED_OBJECTS_SQL, params)]
+    if unsupported:
+        raise ValueError(f"Template schema '{template_schema}' contains objects that cannot be cloned: {', '.join(unsupported)}")
+
+    await _set_local_search_path(db, template)
+    try:
+        tables = [row[0] for row in await db.execute(_TABLES_SQL, params)]
+        sequences = (await db.execute(_SEQUENCES_SQL, params)).all()
+        defaults = (await db.execute(_DEFAULTS_SQL, params)).all()
+        constraints = (await db.execute(_CONSTRAINTS_SQL, params)).all()
+        indexes = [row[0] for row in await db.execute(_INDEXES_SQL, {**params, "template_name": template_schema, "target_name": schema_name})]
+        has_version_table = "alembic_version" in tables
+    finally:
+        await _set_local_search_path(db, "public")
+
+    statements = [f"CREATE SCHEMA {target}", f"SET LOCAL search_path TO {target}"]
+    # identity 列的序列随 LIKE ... INCLUDING IDENTITY 自动创建
+    sequences = [seq for seq in sequences if not seq.is_identity]
+    for seq in sequences:
+        statements.append(
+            f"CREATE SEQUENCE {quote_ident(seq.sequencename)} AS {seq.data_type} INCREMENT BY {seq.increment_by} "
+            f"MINVALUE {seq.min_value} MAXVALUE {seq.max_value} START WITH {seq.start_value} CACHE {seq.cache_size} "
+            f"{'CYCLE' if seq.cycle else 'NO CYCLE'}"
+        )
+    for table in tables:
+        statements.append(
+            f"CREATE TABLE {quote_ident(table)} (LIKE {template}.{quote_ident(table)} INCLUDING ALL EXCLUDING DEFAULTS EXCLUDING INDEXES)"
+        )
+    for table, column, expression in defaults:
+        statements.append(f"ALTER TABLE {quote_ident(table)} ALTER COLUMN {quote_ident(column)} SET DEFAULT {expression}")
+    for seq in sequences:
+        if seq.owner_table is not None:
+            statements.append(
+                f"ALTER SEQUENCE {quote_ident(seq.sequencename)} OWNED BY {quote_ident(seq.owner_table)}.{quote_ident(seq.owner_column)}"
+            )
+    # 先建主键/唯一约束和普通索引，外键 (排在最后) 依赖被引用列上的唯一索引
+    statements.extend(indexes)
+    for table, name, _, definition in constraints:
+        statements.append(f"ALTER TABLE {quote_ident(table)} ADD CONSTRAINT {quote_ident(name)} {definition}")
+    if has_version_table:
+        statements.append(f"INSERT INTO alembic_version SELECT * FROM {template}.alembic_version")
+    statements.append("SET LOCAL search_path TO public")
+
+    # 整个 DDL 脚本一次发送 (简单查询协议支持多语句)，与调用方的其他操作处于同一事务
+    connection = await db.connection()
+    await connection.exec_driver_sql(";\n".join(statements))
+    return len(tables)
+
+
+async def provision_tenant_schema(db: AsyncSession, schema_name: str) -> bool:
+    """
+    为新租户创建 schema。
+
+    配置了 TENANT_TEMPLATE_SCHEMA 且模板已迁移到 head 时，从模板克隆出完整的表结构并返回 True；
+    否则 (未配置模板、模板落后于 head、目标 schema 已存在或模板无法克隆) 只创建空 schema，
+    返回 False，此时仍需为该 schema 运行迁移。
+    """
+    template_schema = settings.TENANT_TEMPLATE_SCHEMA
+    if template_schema and not await schema_exists(db, schema_name):
+        template_revision = await get_schema_revision(db, template_schema)
+        head = tenant_head_revision()
+        if template_revision == head:
+            try:
+                # 克隆失败时只回滚到保存点，退回到创建空 schema
+                async with db.begin_nested():
+                    table_count = await clone_schema(db, template_schema, schema_name)
+                logger.info(f"Schema '{schema_name}' cloned from template '{template_schema}' at revision {head} ({table_count} tables).")
+                return True
+            except ValueError as e:
+                logger.warning(f"Cannot clone template schema: {e}")
+        else:
+            logger.warning(
+                f"Template schema '{template_schema}' is at revision {template_revision or '<none>'}, expected {head}; "
+                f"run run_migrations.py to bring it to head."
+            )
+
+    await db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {quote_ident(schema_name)};"))
+    logger.info(f"Schema '{schema_name}' created or already exists.")
+    return False
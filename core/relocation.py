@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+在线迁移租户: 把租户 schema 从当前分片搬到另一个分片 (数据库)，期间租户保持可读写，只在最后短暂冻结写入。
+
+1. 在源 schema 的每张表上安装变更捕获触发器，把被修改行的主键记入源库的 public.tenant_relocation_changes；
+2. 在目标分片上创建同名 schema (优先从模板克隆，否则回放迁移)，要求与源 schema 处于同一 alembic 版本；
+3. 在一个 REPEATABLE READ 快照中按外键依赖顺序逐表 COPY (binary) 到目标库，数据边读边写，不落地；
+4. 追赶: 反复取出变更日志中的主键，从源库读取这些行的当前值，按捕获顺序在目标库 upsert 或删除，直到剩余变更足够少；
+5. 冻结: 以 EXCLUSIVE 模式锁住源表 (读不受影响，写入等待)，处理最后一批变更并同步序列，
+   把捕获触发器换成拒绝写入的触发器，在控制库中把 public.tenants.shard 改为目标分片并 NOTIFY 各应用进程
+   失效租户缓存，最后释放锁。等待中的写入随后因拒绝触发器失败，重试时已路由到目标分片。
+
+限制: 每张表必须有单列主键；TRUNCATE 不会被捕获 (迁移期间不要对租户表执行 TRUNCATE)。
+源 schema 默认保留 (写入被拒绝)，确认无误后可以删除。
+"""
+import asyncio
+import graphlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from models.public import Tenant
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
+
+from core.config import settings
+from core.provisioning import (
+    get_schema_revision,
+    provision_tenant_schema,
+    quote_ident,
+    schema_exists,
+)
+from core.shards import DEFAULT_SHARD, UnknownShardError
+from core.tenancy import TENANCY_SHARED
+from core.tenant_cache import INVALIDATION_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+CHANGES_TABLE = "public.tenant_relocation_changes"
+CAPTURE_TRIGGER = "tenant_relocation_capture"
+REJECT_TRIGGER = "tenant_relocation_reject"
+# 每次从变更日志取出的条目数
+CATCH_UP_BATCH_SIZE = 10000
+
+_SETUP_STATEMENTS = (
+    f"""CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+        id bigserial PRIMARY KEY,
+        schema_name text NOT NULL,
+        table_name text NOT NULL,
+        pk text NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS ix_tenant_relocation_changes_schema_name ON {CHANGES_TABLE} (schema_name, id)",
+    f"""CREATE OR REPLACE FUNCTION public.{CAPTURE_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        -- TG_ARGV[0] 为表的主键列名；UPDATE 同时记录新旧主键 (主键可能被修改)
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO {CHANGES_TABLE} (schema_name, table_name, pk) VALUES (TG_TABLE_SCHEMA, TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0]);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO {CHANGES_TABLE} (schema_name, table_name, pk) VALUES (TG_TABLE_SCHEMA, TG_TABLE_NAME, to_jsonb(NEW) ->> TG_ARGV[0]);
+        END IF;
+        RETURN NULL;
+    END $$""",
+    f"""CREATE OR REPLACE FUNCTION public.{REJECT_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        RAISE EXCEPTION 'tenant schema % has been relocated to another shard', TG_TABLE_SCHEMA
+            USING ERRCODE = 'read_only_sql_transaction';
+    END $$""",
+)
+
+_TABLES_SQL = text("""
+    SELECT c.oid, c.relname,
+           (SELECT array_agg(a.attname ORDER BY a.attnum) FROM pg_catalog.pg_attribute a
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = '') AS columns,
+           (SELECT array_agg(a.attname) FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = ANY(con.conkey)
+            WHERE con.conrelid = c.oid AND con.contype = 'p') AS pk_columns,
+           (SELECT pg_catalog.format_type(a.atttypid, a.atttypmod) FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+            WHERE con.conrelid = c.oid AND con.contype = 'p') AS pk_type,
+           (SELECT array_agg(DISTINCT con.confrelid::oid) FROM pg_catalog.pg_constraint con
+            WHERE con.conrelid = c.oid AND con.contype = 'f' AND con.confrelid <> c.oid) AS parents
+    FROM pg_catalog.pg_class c
+    WHERE c.relnamespace = CAST(:schema AS regnamespace) AND c.relkind = 'r' AND c.relname <> 'alembic_version'
+""")
+
+_SEQUENCES_SQL = text("""
+    SELECT c.relname FROM pg_catalog.pg_class c
+    WHERE c.relnamespace = CAST(:schema AS regnamespace) AND c.relkind = 'S'
+""")
+
+
+class RelocationError(Exception):
+    pass
+
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: list[str]
+    pk: str
+    pk_type: str
+
+
+@dataclass
+class RelocationReport:
+    tenant_id: int
+    schema_name: str
+    source_shard: str
+    target_shard: str
+    tables: int = 0
+    rows_copied: int = 0
+    bytes_copied: int = 0
+    copy_seconds: float = 0.0
+    catch_up_passes: int = 0
+    rows_caught_up: int = 0
+    freeze_seconds: float = 0.0
+    total_seconds: float = 0.0
+    per_table: dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "schema_name": self.schema_name,
+            "source_shard": self.source_shard,
+            "target_shard": self.target_shard,
+            "tables": self.tables,
+            "rows_copied": self.rows_copied,
+            "bytes_copied": self.bytes_copied,
+            "copy_seconds": round(self.copy_seconds, 3),
+            "rows_per_sec": round(self.rows_copied / self.copy_seconds, 1) if self.copy_seconds else 0.0,
+            "mb_per_sec": round(self.bytes_copied / 1024 / 1024 / self.copy_seconds, 2) if self.copy_seconds else 0.0,
+            "catch_up_passes": self.catch_up_passes,
+            "rows_caught_up": self.rows_caught_up,
+            "write_freeze_ms": round(self.freeze_seconds * 1000, 1),
+            "total_seconds": round(self.total_seconds, 3),
+            "per_table": self.per_table,
+        }
+
+
+def _qualified(schema_name: str, table_name: str) -> str:
+    return f"{quote_ident(schema_name)}.{quote_ident(table_name)}"
+
+
+async def load_tables(connection: AsyncConnection, schema_name: str) -> list[TableInfo]:
+    """schema 中需要复制的表 (不含 alembic_version)，按外键依赖排序: 被引用的表在前"""
+    rows = (await connection.execute(_TABLES_SQL, {"schema": quote_ident(schema_name)})).all()
+    names = {row.oid: row.relname for row in rows}
+    sorter = graphlib.TopologicalSorter()
+    tables: dict[str, TableInfo] = {}
+    for row in rows:
+        if not row.pk_columns or len(row.pk_columns) != 1:
+            raise RelocationError(f"Table '{row.relname}' has no single-column primary key")
+        tables[row.relname] = TableInfo(row.relname, list(row.columns), row.pk_columns[0], row.pk_type)
+        sorter.add(row.relname, *(names[parent] for parent in row.parents or () if parent in names))
+    return [tables[name] for name in sorter.static_order()]
+
+
+class TenantRelocator:
+    def __init__(
+        self,
+        tenant_id: int,
+        target_shard: str,
+        catch_up_threshold: int = 100,
+        max_catch_up_passes: int = 20,
+        lock_timeout_ms: int = 5000,
+    ):
+        self.tenant_id = tenant_id
+        self.target_shard = target_shard
+        # 剩余变更少于该行数时进入冻结阶段
+        self.catch_up_threshold = catch_up_threshold
+        self.max_catch_up_passes = max_catch_up_passes
+        self.lock_timeout_ms = lock_timeout_ms
+        self._engines: dict[str, AsyncEngine] = {}
+
+    def _engine(self, shard: str) -> AsyncEngine:
+        engine = self._engines.get(shard)
+        if engine is None:
+            url = settings.shard_urls.get(shard)
+            if url is None:
+                raise UnknownShardError(f"Unknown shard '{shard}'")
+            engine = self._engines[shard] = create_async_engine(url, pool_size=2, max_overflow=2, pool_pre_ping=True)
+        return engine
+
+    async def close(self) -> None:
+        for engine in self._engines.values():
+            await engine.dispose()
+        self._engines.clear()
+
+    async def run(self) -> RelocationReport:
+        started = time.perf_counter()
+        async with AsyncSession(self._engine(DEFAULT_SHARD)) as control:
+            tenant = await control.get(Tenant, self.tenant_id)
+        if tenant is None:
+            raise RelocationError(f"Tenant<id:{self.tenant_id}> not found")
+        if tenant.tenancy == TENANCY_SHARED:
+            raise RelocationError(f"Tenant<id:{self.tenant_id}> lives in the shared schema; only dedicated schemas can be relocated")
+        if tenant.shard == self.target_shard:
+            raise RelocationError(f"Tenant<id:{self.tenant_id}> is already on shard '{self.target_shard}'")
+        self._engine(self.target_shard)  # 尽早发现未配置的分片
+        report = RelocationReport(tenant.id, tenant.schema_name, tenant.shard, self.target_shard)
+        source, target = self._engine(tenant.shard), self._engine(self.target_shard)
+
+        async with source.connect() as connection:
+            tables = await load_tables(connection, tenant.schema_name)
+        report.tables = len(tables)
+
+        await self._create_target_schema(tenant.schema_name, tenant.shard)
+        try:
+            await self._install_capture(source, tenant.schema_name, tables)
+            await self._copy_snapshot(source, target, tenant.schema_name, tables, report)
+            await self._catch_up(source, target, tenant.schema_name, tables, report)
+            await self._freeze_and_switch(source, target, tenant.schema_name, tables, report)
+        except BaseException:
+            logger.error(f"Relocation of tenant<id:{tenant.id}> failed, rolling back")
+            await asyncio.shield(self._abort(source, target, tenant.schema_name, tables))
+            raise
+        report.total_seconds = time.perf_counter() - started
+        return report
+
+    async def _create_target_schema(self, schema_name: str, source_shard: str) -> None:
+        async with AsyncSession(self._engine(source_shard)) as db:
+            source_revision = await get_schema_revision(db, schema_name)
+        async with AsyncSession(self._engine(self.target_shard)) as db:
+            if await schema_exists(db, schema_name):
+                raise RelocationError(f"Schema '{schema_name}' already exists on shard '{self.target_shard}'")
+            cloned = await provision_tenant_schema(db, schema_name)
+            await db.commit()
+        if not cloned:
+            from run_migrations import migrate_schema
+
+            result = await asyncio.to_thread(migrate_schema, schema_name, source_revision or "head", self.target_shard)
+            if not result.ok:
+                await self._drop_target_schema(self._engine(self.target_shard), schema_name)
+                raise RelocationError(f"Migrating '{schema_name}' on shard '{self.target_shard}' failed: {result.error}")
+        async with AsyncSession(self._engine(self.target_shard)) as db:
+            target_revision = await get_schema_revision(db, schema_name)
+        if target_revision != source_revision:
+            await self._drop_target_schema(self._engine(self.target_shard), schema_name)
+            raise RelocationError(
+                f"Schema '{schema_name}' is at revision {source_revision} but the target was created at {target_revision}; "
+                f"run run_migrations.py first"
+            )
+
+    async def _install_capture(self, source: AsyncEngine, schema_name: str, tables: list[TableInfo]) -> None:
+        # CREATE TRIGGER 会等待正在写入的事务结束；之后提交的写入都会被记录，快照之外的修改不会遗漏
+        async with source.begin() as connection:
+            for statement in _SETUP_STATEMENTS:
+                await connection.exec_driver_sql(statement)
+            for table in tables:
+                await connection.exec_driver_sql(
+                    f"CREATE TRIGGER {CAPTURE_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON {_qualified(schema_name, table.name)} "
+                    f"FOR EACH ROW EXECUTE FUNCTION public.{CAPTURE_TRIGGER}('{table.pk}')"
+                )
+
+    async def _copy_snapshot(
+        self, source: AsyncEngine, target: AsyncEngine, schema_name: str, tables: list[TableInfo], report: RelocationReport
+    ) -> None:
+        started = time.perf_counter()
+        async with source.connect() as src, target.connect() as dst:
+            await src.execution_options(isolation_level="REPEATABLE READ")
+            await src.execute(text("SET TRANSACTION READ ONLY"))
+            src_raw = (await src.get_raw_connection()).driver_connection
+            dst_raw = (await dst.get_raw_connection()).driver_connection
+            for table in tables:
+                name = _qualified(schema_name, table.name)
+                columns = ", ".join(quote_ident(column) for column in table.columns)
+                table_started = time.perf_counter()
+                async with src_raw.cursor() as src_cursor, dst_raw.cursor() as dst_cursor:
+                    async with src_cursor.copy(f"COPY {name} ({columns}) TO STDOUT (FORMAT binary)") as copy_out:
+                        async with dst_cursor.copy(f"COPY {name} ({columns}) FROM STDIN (FORMAT binary)") as copy_in:
+                            async for data in copy_out:
+                                report.bytes_copied += len(data)
+                                await copy_in.write(data)
+                    rows = dst_cursor.rowcount
+                report.rows_copied += rows
+                report.per_table[table.name] = rows
+                logger.info(f"Copied {rows} rows of {name} in {time.perf_counter() - table_started:.2f}s")
+            await dst.commit()
+            await src.rollback()
+        report.copy_seconds = time.perf_counter() - started
+
+    async def _sync_changes(
+        self, src: AsyncConnection, dst: AsyncConnection, schema_name: str, tables: list[TableInfo], limit: Optional[int]
+    ) -> int:
+        """
+        取出变更日志中的主键 (limit 为 None 时取出全部)，按源库当前值在目标库 upsert 或删除，
+        并删除已处理的日志条目。返回处理的不同主键数。调用方负责提交两边的事务。
+
+        按捕获顺序回放: 每个主键在其最后一条日志的位置上处理一次，连续的同表同类操作合并为一条语句。
+        这样删除先于复用其唯一值 (例如 users.email) 的插入，被引用的行也先于引用它的行写入。
+        """
+        sql = f"SELECT id, table_name, pk FROM {CHANGES_TABLE} WHERE schema_name = :schema_name ORDER BY id"
+        params = {"schema_name": schema_name}
+        if limit is not None:
+            sql += " LIMIT :limit"
+            params["limit"] = limit
+        entries = (await src.execute(text(sql), params)).all()
+        if not entries:
+            return 0
+        # (表名, 主键) -> 最后一条日志的 id; entries 按 id 升序，后出现的覆盖先出现的
+        last_change: dict[tuple[str, str], int] = {}
+        for entry_id, table_name, pk in entries:
+            last_change[(table_name, pk)] = entry_id
+        changed: dict[str, set[str]] = {}
+        for table_name, pk in last_change:
+            changed.setdefault(table_name, set()).add(pk)
+
+        by_name = {table.name: table for table in tables}
+        current: dict[str, dict[str, tuple]] = {}
+        for table_name, keys in changed.items():
+            table = by_name[table_name]
+            columns = ", ".join(quote_ident(column) for column in table.columns)
+            key_filter = f"{quote_ident(table.pk)} = ANY(CAST(:keys AS {table.pk_type}[]))"
+            rows = (await src.execute(
+                text(f"SELECT {columns} FROM {_qualified(schema_name, table.name)} WHERE {key_filter}"), {"keys": list(keys)}
+            )).all()
+            pk_index = table.columns.index(table.pk)
+            current[table_name] = {str(row[pk_index]): tuple(row) for row in rows}
+
+        # 把按最后一次修改排序的主键切成 (表, 是否仍存在) 相同的连续段
+        runs: list[tuple[str, bool, list[str]]] = []
+        for table_name, pk in sorted(last_change, key=last_change.__getitem__):
+            present = pk in current[table_name]
+            if runs and runs[-1][0] == table_name and runs[-1][1] == present:
+                runs[-1][2].append(pk)
+            else:
+                runs.append((table_name, present, [pk]))
+        for table_name, present, keys in runs:
+            table = by_name[table_name]
+            name = _qualified(schema_name, table.name)
+            if present:
+                await self._upsert_rows(dst, name, table, [current[table_name][key] for key in keys])
+            else:
+                await dst.execute(
+                    text(f"DELETE FROM {name} WHERE {quote_ident(table.pk)} = ANY(CAST(:keys AS {table.pk_type}[]))"),
+                    {"keys": keys},
+                )
+        # 按 id 删除已处理的条目: 序号较小但提交较晚的条目留到下一轮
+        await src.execute(text(f"DELETE FROM {CHANGES_TABLE} WHERE id = ANY(:ids)"), {"ids": [entry.id for entry in entries]})
+        return len(last_change)
+
+    async def _upsert_rows(self, dst: AsyncConnection, name: str, table: TableInfo, rows: list[tuple]) -> None:
+        columns = ", ".join(quote_ident(column) for column in table.columns)
+        placeholders = ", ".join(f":p{i}" for i in range(len(table.columns)))
+        updates = ", ".join(
+            f"{quote_ident(column)} = EXCLUDED.{quote_ident(column)}" for column in table.columns if column != table.pk
+        )
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        await dst.execute(
+            text(f"INSERT INTO {name} ({columns}) OVERRIDING SYSTEM VALUE VALUES ({placeholders}) "
+                 f"ON CONFLICT ({quote_ident(table.pk)}) {conflict}"),
+            [{f"p{i}": value for i, value in enumerate(row)} for row in rows],
+        )
+
+    async def _catch_up(
+        self, source: AsyncEngine, target: AsyncEngine, schema_name: str, tables: list[TableInfo], report: RelocationReport
+    ) -> None:
+        for _ in range(self.max_catch_up_passes):
+            synced = 0
+            while True:
+                async with source.begin() as src, target.begin() as dst:
+                    count = await self._sync_changes(src, dst, schema_name, tables, CATCH_UP_BATCH_SIZE)
+                synced += count
+                if count < CATCH_UP_BATCH_SIZE:
+                    break
+            report.catch_up_passes += 1
+            report.rows_caught_up += synced
+            logger.info(f"Catch-up pass {report.catch_up_passes}: {synced} changed rows")
+            if synced < self.catch_up_threshold:
+                return
+        logger.warning(f"Still behind after {self.max_catch_up_passes} catch-up passes, freezing anyway")
+
+    async def _freeze_and_switch(
+        self, source: AsyncEngine, target: AsyncEngine, schema_name: str, tables: list[TableInfo], report: RelocationReport
+    ) -> None:
+        names = ", ".join(_qualified(schema_name, table.name) for table in tables)
+        async with source.connect() as src:
+            await src.execute(select(func.set_config("lock_timeout", f"{self.lock_timeout_ms}ms", True)))
+            # EXCLUSIVE 锁: 读取照常进行，写入在锁释放前等待
+            await src.exec_driver_sql(f"LOCK TABLE {names} IN EXCLUSIVE MODE")
+            frozen = time.perf_counter()
+            try:
+                async with target.begin() as dst:
+                    report.rows_caught_up += await self._sync_changes(src, dst, schema_name, tables, None)
+                    await self._sync_sequences(src, dst, schema_name)
+                for table in tables:
+                    name = _qualified(schema_name, table.name)
+                    await src.exec_driver_sql(f"DROP TRIGGER {CAPTURE_TRIGGER} ON {name}")
+                    await src.exec_driver_sql(
+                        f"CREATE TRIGGER {REJECT_TRIGGER} BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON {name} "
+                        f"FOR EACH STATEMENT EXECUTE FUNCTION public.{REJECT_TRIGGER}()"
+                    )
+                async with self._engine(DEFAULT_SHARD).begin() as control:
+                    await control.execute(update(Tenant).where(Tenant.id == self.tenant_id).values(shard=self.target_shard))
+                    # 各应用进程的 TenantCache 监听该通道并失效对应租户 (pg_notify 在提交时才发出)
+                    await control.execute(select(func.pg_notify(INVALIDATION_CHANNEL, str(self.tenant_id))))
+            except BaseException:
+                await src.rollback()
+                raise
+            try:
+                await src.commit()
+            except Exception as e:
+                # 路由已经切换到目标分片，只是源 schema 没有装上拒绝写入的触发器
+                logger.error(f"Tenant<id:{self.tenant_id}> was switched but the source schema could not be sealed: {e}")
+            report.freeze_seconds = time.perf_counter() - frozen
+        logger.info(f"Tenant<id:{self.tenant_id}> now served from shard '{self.target_shard}' "
+                    f"(writes frozen for {report.freeze_seconds * 1000:.0f}ms)")
+
+    async def _sync_sequences(self, src: AsyncConnection, dst: AsyncConnection, schema_name: str) -> None:
+        for (sequence,) in (await src.execute(_SEQUENCES_SQL, {"schema": quote_ident(schema_name)})).all():
+            name = _qualified(schema_name, sequence)
+            last_value, is_called = (await src.execute(text(f"SELECT last_value, is_called FROM {name}"))).one()
+            await dst.execute(select(func.setval(name, last_value, is_called)))
+
+    async def _abort(self, source: AsyncEngine, target: AsyncEngine, schema_name: str, tables: list[TableInfo]) -> None:
+        """撤销未完成的迁移: 移除源表上的捕获触发器与变更日志，删除目标 schema"""
+        try:
+            async with source.begin() as connection:
+                for table in tables:
+                    await connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {CAPTURE_TRIGGER} ON {_qualified(schema_name, table.name)}")
+                await connection.execute(text(f"DELETE FROM {CHANGES_TABLE} WHERE schema_name = :schema_name"), {"schema_name": schema_name})
+        except Exception as e:
+            logger.error(f"Could not remove capture triggers from '{schema_name}': {e}")
+        await self._drop_target_schema(target, schema_name)
+
+    async def _drop_target_schema(self, target: AsyncEngine, schema_name: str) -> None:
+        try:
+            async with target.begin() as connection:
+                await connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {quote_ident(schema_name)} CASCADE")
+        except Exception as e:
+            logger.error(f"Could not drop '{schema_name}' on shard '{self.target_shard}': {e}")
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Iterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        # 在此时间 (time.monotonic()) 之前视为不可用，不再分配读请求
+        self.unhealthy_until = 0.0
+        self.last_error: Optional[str] = None
+        self.routed = 0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.unhealthy_until <= time.monotonic()
+
+
+class ReplicaRouter:
+    """
+    只读会话的路由: 在可用的只读副本之间轮询，副本连接失败时标记为不可用 retry_interval 秒，
+    没有可用副本时回退到主库。
+    """
+
+    def __init__(self, primary: AsyncEngine, replicas: list[Replica], retry_interval: float):
+        self.primary = primary
+        self.replicas = replicas
+        self.retry_interval = retry_interval
+        self._next = 0
+        self.primary_fallbacks = 0
+
+    def candidates(self) -> Iterator[tuple[AsyncEngine, Optional[Replica]]]:
+        """按轮询顺序依次给出可用的副本，最后是主库 (副本为 None)"""
+        count = len(self.replicas)
+        start = self._next
+        self._next = (self._next + 1) % count if count else 0
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.healthy:
+                replica.routed += 1
+                yield replica.engine, replica
+        if count:
+            self.primary_fallbacks += 1
+        yield self.primary, None
+
+    def mark_unhealthy(self, replica: Replica, error: BaseException) -> None:
+        replica.unhealthy_until = time.monotonic() + self.retry_interval
+        replica.last_error = f"{type(error).__name__}: {error}"
+        replica.failures += 1
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "routed": replica.routed,
+                    "failures": replica.failures,
+                    "last_error": replica.last_error,
+                }
+                for replica in self.replicas
+            ],
+            "primary_fallbacks": self.primary_fallbacks,
+        }
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+租户分片: 租户 schema 可以分布在多个 PostgreSQL 数据库 (分片) 中。
+
+* 默认分片 (DEFAULT_SHARD) 就是 DATABASE_URL，同时存放 public.tenants 等全局表 (控制面)；
+* 其他分片由 DATABASE_SHARDS 配置 (name=url,name=url)，只存放租户 schema (及模板 schema)；
+* public.tenants.shard 记录每个租户所在的分片。
+
+本模块不创建引擎，也被 run_migrations.py (同步引擎) 使用。
+"""
+from typing import Generic, TypeVar
+
+DEFAULT_SHARD = "default"
+
+EngineT = TypeVar("EngineT")
+
+
+class UnknownShardError(KeyError):
+    pass
+
+
+def parse_shard_urls(default_url: str, spec: str) -> dict[str, str]:
+    """解析 DATABASE_SHARDS ("name=url,name=url")，返回包含默认分片在内的 {分片名: 连接串}"""
+    urls = {DEFAULT_SHARD: default_url}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        name, url = name.strip(), url.strip()
+        if not sep or not name or not url:
+            raise ValueError(f"Invalid DATABASE_SHARDS entry '{entry}', expected name=url")
+        if name in urls:
+            raise ValueError(f"Duplicate shard name '{name}' in DATABASE_SHARDS")
+        urls[name] = url
+    return urls
+
+
+class ShardRegistry(Generic[EngineT]):
+    """分片名 -> 引擎"""
+
+    def __init__(self, engines: dict[str, EngineT]):
+        self.engines = engines
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.engines)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.engines
+
+    def engine(self, name: str) -> EngineT:
+        try:
+            return self.engines[name]
+        except KeyError:
+            raise UnknownShardError(f"Unknown shard '{name}'") from None
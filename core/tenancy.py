@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+租户的数据存放方式 (public.tenants.tenancy):
+
+* schema: 独享一个 schema (默认)，可以任意迁移、搬迁 (relocate_tenant.py)；
+* shared: 与其他小租户共用所在分片上的 SHARED_TENANT_SCHEMA。该 schema 的每张表多一列 tenant_id，
+  由行级安全策略 (RLS) 限定为当前租户的行，插入时 tenant_id 取自会话设置，
+  因此 crud_user 等代码与独享 schema 时完全相同。
+
+共享租户不新建 schema，不会增加 pg_catalog 中的表、索引和序列。会话绑定见 core.db.bind_tenant_schema:
+除 search_path 外还以 SET LOCAL 设置 app.tenant_id 与 role (SHARED_TENANT_ROLE)；
+切换到非超级用户角色后 RLS 才会生效 (超级用户与 BYPASSRLS 角色不受 RLS 限制)。
+"""
+from typing import Optional
+
+from models.public import Tenant
+
+from core.config import settings
+
+TENANCY_SCHEMA = "schema"
+TENANCY_SHARED = "shared"
+TENANCY_MODES = (TENANCY_SCHEMA, TENANCY_SHARED)
+
+# 共享 schema 中 RLS 策略与 tenant_id 列默认值读取的会话设置
+TENANT_ID_SETTING = "app.tenant_id"
+
+
+def tenant_data_schema(tenant: Tenant) -> str:
+    """租户数据所在的 schema"""
+    return settings.SHARED_TENANT_SCHEMA if tenant.tenancy == TENANCY_SHARED else tenant.schema_name
+
+
+def tenant_row_scope(tenant: Tenant) -> Optional[int]:
+    """共享租户返回需要限定的 tenant_id，独享 schema 的租户返回 None"""
+    return tenant.id if tenant.tenancy == TENANCY_SHARED else None
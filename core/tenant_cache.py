@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from models.public import Tenant
+
+import psycopg
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 修改 public.tenants 的事务 (租户的创建、更新与激活、relocate_tenant.py 等) 通过该通道 NOTIFY 租户 id
+INVALIDATION_CHANNEL = "tenant_cache_invalidation"
+
+
+class TenantCache:
+    """
+    进程内的租户注册表缓存 (有界 LRU + TTL)。
+
+    * 正向条目: 活跃租户的 id -> Tenant (session 关闭后脱离的只读快照)。
+    * 负向条目: 不存在或未激活的租户 id -> None, 使用更短的 TTL,
+      避免客户端伪造大量 X-Tenant-ID 时每个请求都打到 public.tenants。
+      负向条目保存在单独的、更小的 LRU 中 (negative_max_size)，大量随机 id 只会互相淘汰，不会挤掉活跃租户。
+    * 同一个 id 的并发未命中只会触发一次数据库查询 (single-flight)。
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float, negative_max_size: Optional[int] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # 未指定时为 max_size 的十分之一
+        self.negative_max_size = max_size // 10 if negative_max_size is None else negative_max_size
+        self._entries: OrderedDict[int, tuple[float, Optional[Tenant]]] = OrderedDict()
+        self._negative: OrderedDict[int, float] = OrderedDict()
+        self._inflight: dict[int, asyncio.Future] = {}
+        # 每次失效都会递增, 用于丢弃在失效期间完成的、可能已过期的加载结果
+        self._generation = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.negative_evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def lookup(self, tenant_id: int) -> tuple[bool, Optional[Tenant]]:
+        """返回 (是否命中, 租户)。命中负向条目时返回 (True, None)。"""
+        entry = self._entries.get(tenant_id)
+        if entry is not None:
+            expires_at, tenant = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(tenant_id)
+                self.hits += 1
+                return True, tenant
+            del self._entries[tenant_id]
+            self.expirations += 1
+        else:
+            expires_at = self._negative.get(tenant_id)
+            if expires_at is not None:
+                if expires_at > time.monotonic():
+                    self._negative.move_to_end(tenant_id)
+                    self.negative_hits += 1
+                    return True, None
+                del self._negative[tenant_id]
+                self.expirations += 1
+        self.misses += 1
+        return False, None
+
+    def store(self, tenant_id: int, tenant: Optional[Tenant]) -> None:
+        if not self.enabled:
+            return
+        if tenant is None:
+            self._store_negative(tenant_id)
+            return
+        self._negative.pop(tenant_id, None)
+        self._entries[tenant_id] = (time.monotonic() + self.ttl, tenant)
+        self._entries.move_to_end(tenant_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _store_negative(self, tenant_id: int) -> None:
+        if self.negative_ttl <= 0 or self.negative_max_size <= 0:
+            return
+        self._entries.pop(tenant_id, None)
+        self._negative[tenant_id] = time.monotonic() + self.negative_ttl
+        self._negative.move_to_end(tenant_id)
+        while len(self._negative) > self.negative_max_size:
+            self._negative.popitem(last=False)
+            self.negative_evictions += 1
+
+    async def get_or_load(
+        self, tenant_id: int, loader: Callable[[int], Awaitable[Optional[Tenant]]]
+    ) -> Optional[Tenant]:
+        """先查缓存, 未命中时调用 loader 加载并写回缓存。"""
+        if self.enabled:
+            found, tenant = self.lookup(tenant_id)
+            if found:
+                return tenant
+        inflight = self._inflight.get(tenant_id)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # 正在加载的请求被取消了, 由当前调用者自己重新加载
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[tenant_id] = future
+        generation = self._generation
+        try:
+            tenant = await loader(tenant_id)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(tenant)
+            if generation == self._generation:
+                self.store(tenant_id, tenant)
+            return tenant
+        finally:
+            self._inflight.pop(tenant_id, None)
+
+    async def get_or_load_in_session(
+        self,
+        tenant_id: int,
+        session_factory: Callable[[], AsyncSession],
+        loader: Callable[[AsyncSession, int], Awaitable[Optional[Tenant]]],
+    ) -> tuple[Optional[Tenant], Optional[AsyncSession]]:
+        """
+        与 get_or_load 相同 (single-flight、失效期间的结果不写回)，但 loader 在一个新 session 中执行:
+        实际执行了加载的调用者得到该 session (由调用方负责关闭)，命中缓存或等待其他调用者加载时为 None。
+        """
+        session: Optional[AsyncSession] = None
+
+        async def load(tenant_id: int) -> Optional[Tenant]:
+            nonlocal session
+            session = session_factory()
+            return await loader(session, tenant_id)
+
+        try:
+            tenant = await self.get_or_load(tenant_id, load)
+        except BaseException:
+            if session is not None:
+                await session.close()
+            raise
+        return tenant, session
+
+    def invalidate(self, tenant_id: int) -> None:
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(tenant_id, None)
+        self._negative.pop(tenant_id, None)
+
+    async def invalidate_on_commit(self, db: AsyncSession, tenant_id: int) -> None:
+        """
+        立即失效, 并在 db 所在事务提交后再失效一次:
+        防止其他请求在提交前读到旧数据并重新写回缓存。
+        同一事务中 NOTIFY INVALIDATION_CHANNEL，其他进程的缓存在提交时随之失效 (事务回滚则不会发出)。
+        """
+        self.invalidate(tenant_id)
+        await db.execute(select(func.pg_notify(INVALIDATION_CHANNEL, str(tenant_id))))
+        event.listen(db.sync_session, "after_commit", lambda session: self.invalidate(tenant_id), once=True)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._negative.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "negative_size": len(self._negative),
+            "negative_max_size": self.negative_max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "negative_evictions": self.negative_evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class InvalidationListener:
+    """
+    LISTEN INVALIDATION_CHANNEL，收到租户 id 时失效本进程缓存中的对应条目。
+    连接断开后每 retry_interval 秒重连一次；重连成功时清空缓存，因为断开期间的通知已经丢失。
+    """
+
+    def __init__(self, cache: TenantCache, database_url: str, retry_interval: float = 5.0):
+        self.cache = cache
+        self.database_url = database_url
+        self.retry_interval = retry_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        # LISTEN 需要一条独占的长连接，直接使用 psycopg 而不是占用连接池
+        dsn = make_url(self.database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        connected_before = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as connection:
+                    await connection.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+                    if connected_before:
+                        self.cache.clear()
+                    connected_before = True
+                    async for notify in connection.notifies():
+                        try:
+                            self.cache.invalidate(int(notify.payload))
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed tenant cache invalidation: {notify.payload!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Tenant cache invalidation listener disconnected: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+
+tenant_cache = TenantCache(
+    max_size=settings.TENANT_CACHE_MAX_SIZE,
+    ttl=settings.TENANT_CACHE_TTL,
+    negative_ttl=settings.TENANT_CACHE_NEGATIVE_TTL,
+    negative_max_size=settings.TENANT_CACHE_NEGATIVE_MAX_SIZE,
+)
+
+tenant_cache_listener = InvalidationListener(tenant_cache, settings.DATABASE_URL)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+单行写入合并 (write coalescing)。
+
+突发流量下同一租户会同时到达大量单行 INSERT，每个请求各占一个连接执行 INSERT + refresh。
+开启 PRODUCT_WRITE_BATCHING 后，同一租户在 max_delay 秒内到达的写入被合并为一批
+(凑满 max_batch_size 时立即执行)，用一条多行 INSERT ... RETURNING 写入并提交，
+再把各自的行交还给对应的调用者。
+
+* 每批使用独立的 session 并单独提交，不参与调用者请求的事务。
+* 调用者在批次开始执行前取消 (例如客户端断开) 时，其记录不会被写入；执行开始后取消不影响写入。
+* 整批失败时逐行重试一次，使一条坏数据不会连累同批次的其他调用者；
+  重试在同一个 session 中依次执行 (每行一个保存点)，不会为每行各占一个连接。
+* 同时执行的批次数不超过 max_concurrency，其余批次排队等待，避免突发流量耗尽连接池。
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, Hashable, Optional, Sequence, TypeVar
+
+from models.tenant import Product
+
+from core.config import settings
+from core.db import tenant_session
+from crud import crud_user
+from schemas.user import ProductCreate
+
+logger = logging.getLogger(__name__)
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+# 批次大小分布统计的桶上界 (最后一个桶收纳更大的批次)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class WriteBatcher(Generic[ItemT, ResultT]):
+    """
+    按 key (租户所在的分片、schema 与共享 schema 中的 tenant_id) 合并写入。flush(key, items) 必须返回与 items 一一对应的结果列表。
+    retry(key, items) 在整批失败后逐行写入，返回与 items 一一对应的结果或异常；未提供时依次对每行调用 flush。
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Hashable, Sequence[ItemT]], Awaitable[Sequence[ResultT]]],
+        max_batch_size: int,
+        max_delay: float,
+        max_concurrency: int = 4,
+        retry: Optional[Callable[[Hashable, Sequence[ItemT]], Awaitable[Sequence[ResultT | Exception]]]] = None,
+    ):
+        self.flush = flush
+        self.retry = retry or self._retry_sequentially
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_delay = max_delay
+        self.max_concurrency = max(max_concurrency, 1)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._pending: dict[Hashable, list[tuple[ItemT, asyncio.Future]]] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self._running: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.rows = 0
+        self.flushed_full = 0
+        self.flushed_on_delay = 0
+        self.failed_batches = 0
+        self.retried_rows = 0
+        self.cancelled_rows = 0
+        self.max_batch_seen = 0
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    async def submit(self, key: Hashable, item: ItemT) -> ResultT:
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_batch_size:
+            self.flushed_full += 1
+            self._dispatch(key)
+        elif len(pending) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_delay, self._dispatch_on_delay, key)
+        return await future
+
+    def _dispatch_on_delay(self, key: Hashable) -> None:
+        self.flushed_on_delay += 1
+        self._dispatch(key)
+
+    def _dispatch(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        task = asyncio.create_task(self._run(key, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, batch: list[tuple[ItemT, asyncio.Future]]) -> None:
+        async with self._slots:
+            # 排队期间取消的调用者不再写入
+            live = [(item, future) for item, future in batch if not future.done()]
+            self.cancelled_rows += len(batch) - len(live)
+            if not live:
+                return
+            self._record_batch(len(live))
+            try:
+                results = await self.flush(key, [item for item, _ in live])
+            except Exception as e:
+                self.failed_batches += 1
+                if len(live) == 1:
+                    _resolve(live[0][1], exception=e)
+                    return
+                logger.warning(f"Batched write of {len(live)} rows into {key} failed, retrying row by row: {e}")
+                self.retried_rows += len(live)
+                try:
+                    results = await self.retry(key, [item for item, _ in live])
+                except Exception as retry_error:
+                    results = [retry_error] * len(live)
+            for (_, future), result in zip(live, results):
+                if isinstance(result, Exception):
+                    _resolve(future, exception=result)
+                else:
+                    _resolve(future, result=result)
+
+    async def _retry_sequentially(self, key: Hashable, items: Sequence[ItemT]) -> list[ResultT | Exception]:
+        results: list[ResultT | Exception] = []
+        for item in items:
+            try:
+                (result,) = await self.flush(key, [item])
+            except Exception as e:
+                result = e
+            results.append(result)
+        return results
+
+    def _record_batch(self, size: int) -> None:
+        self.batches += 1
+        self.rows += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        for index, upper in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= upper:
+                self._histogram[index] += 1
+                break
+        else:
+            self._histogram[-1] += 1
+
+    async def drain(self) -> None:
+        """立即执行所有等待中的批次并等待执行中的批次完成 (应用关闭时调用)"""
+        for key in list(self._pending):
+            self._dispatch(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> dict:
+        labels = [f"<={upper}" for upper in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+        return {
+            "enabled": settings.PRODUCT_WRITE_BATCHING,
+            "max_batch_size": self.max_batch_size,
+            "max_delay": self.max_delay,
+            "max_concurrency": self.max_concurrency,
+            "running_batches": len(self._running),
+            "pending_rows": sum(len(pending) for pending in self._pending.values()),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "batch_size_histogram": dict(zip(labels, self._histogram)),
+            "flushed_full": self.flushed_full,
+            "flushed_on_delay": self.flushed_on_delay,
+            "failed_batches": self.failed_batches,
+            "retried_rows": self.retried_rows,
+            "cancelled_rows": self.cancelled_rows,
+        }
+
+
+def _resolve(future: asyncio.Future, result=None, exception: BaseException | None = None) -> None:
+    # 调用者可能已经取消了等待
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+async def _insert_products(key: tuple[str, str, Optional[int]], items: Sequence[ProductCreate]) -> list[Product]:
+    shard, schema_name, row_scope = key
+    async with tenant_session(schema_name, shard, row_scope) as session:
+        products = await crud_user.create_items(session, items)
+        await session.commit()
+    return products
+
+
+async def _insert_products_one_by_one(
+    key: tuple[str, str, Optional[int]], items: Sequence[ProductCreate]
+) -> list[Product | Exception]:
+    """在一个 session 中逐行写入，每行一个保存点: 失败的行只回滚自己，其余的行一起提交"""
+    shard, schema_name, row_scope = key
+    results: list[Product | Exception] = []
+    async with tenant_session(schema_name, shard, row_scope) as session:
+        for item in items:
+            try:
+                async with session.begin_nested():
+                    (product,) = await crud_user.create_items(session, [item])
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(product)
+        await session.commit()
+    return results
+
+
+product_write_batcher: WriteBatcher[ProductCreate, Product] = WriteBatcher(
+    _insert_products,
+    max_batch_size=settings.PRODUCT_WRITE_BATCH_MAX_SIZE,
+    max_delay=settings.PRODUCT_WRITE_BATCH_MAX_DELAY,
+    max_concurrency=settings.PRODUCT_WRITE_BATCH_MAX_CONCURRENCY,
+    retry=_insert_products_one_by_one,
+)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from models.public import ProvisioningJob, Tenant
+
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+async def create_job(db: AsyncSession, tenant: Tenant) -> ProvisioningJob:
+    job = ProvisioningJob(tenant_id=tenant.id, status=JOB_PENDING, step="queued", attempts=0)
+    db.add(job)
+    await db.flush()
+    await db.refresh(job)
+    return job
+
+
+async def create_jobs_bulk(db: AsyncSession, tenants: list[Tenant]) -> list[ProvisioningJob]:
+    """为一批租户各创建一个开通任务 (一条多行 INSERT)，返回顺序与 tenants 一致"""
+    if not tenants:
+        return []
+    rows = [{"tenant_id": tenant.id, "status": JOB_PENDING, "step": "queued", "attempts": 0} for tenant in tenants]
+    result = await db.scalars(insert(ProvisioningJob).returning(ProvisioningJob, sort_by_parameter_order=True), rows)
+    return list(result)
+
+
+async def get_job(db: AsyncSession, job_id: int) -> ProvisioningJob | None:
+    result = await db.execute(select(ProvisioningJob).where(ProvisioningJob.id == job_id))
+    return result.scalar_one_or_none()
+
+
+async def claim_next_job(db: AsyncSession, lease_seconds: int) -> tuple[ProvisioningJob, Tenant] | None:
+    """
+    领取一个待执行的任务 (或租约已过期的执行中任务) 并标记为 running。
+    重新排队的任务在退避时间 (locked_until) 到达之前不会被领取。
+    FOR UPDATE SKIP LOCKED 让多个工作协程/进程可以并发领取而互不阻塞。
+    """
+    candidate = (
+        select(ProvisioningJob.id)
+        .where(or_(
+            (ProvisioningJob.status == JOB_PENDING)
+            & (ProvisioningJob.locked_until.is_(None) | (ProvisioningJob.locked_until <= func.now())),
+            (ProvisioningJob.status == JOB_RUNNING) & (ProvisioningJob.locked_until < func.now()),
+        ))
+        .order_by(ProvisioningJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(ProvisioningJob)
+        .where(ProvisioningJob.id == candidate)
+        .values(
+            status=JOB_RUNNING,
+            attempts=ProvisioningJob.attempts + 1,
+            error=None,
+            started_at=func.now(),
+            locked_until=func.now() + timedelta(seconds=lease_seconds),
+        )
+        .returning(ProvisioningJob)
+    )
+    job = (await db.execute(stmt)).scalar_one_or_none()
+    if job is None:
+        return None
+    tenant = (await db.execute(select(Tenant).where(Tenant.id == job.tenant_id))).scalar_one()
+    return job, tenant
+
+
+async def set_step(db: AsyncSession, job_id: int, step: str, lease_seconds: int) -> None:
+    """更新进度并续约"""
+    await db.execute(
+        update(ProvisioningJob)
+        .where(ProvisioningJob.id == job_id)
+        .values(step=step, locked_until=func.now() + timedelta(seconds=lease_seconds))
+    )
+
+
+async def renew_lease(db: AsyncSession, job_id: int, lease_seconds: int) -> bool:
+    """续约执行中的任务；任务已不再是 running (例如租约过期后被其他工作协程领取并完成) 时返回 False"""
+    result = await db.execute(
+        update(ProvisioningJob)
+        .where(ProvisioningJob.id == job_id, ProvisioningJob.status == JOB_RUNNING)
+        .values(locked_until=func.now() + timedelta(seconds=lease_seconds))
+    )
+    return result.rowcount > 0
+
+
+async def requeue_job(db: AsyncSession, job_id: int, error: str, delay_seconds: float) -> None:
+    """失败的任务重新排队，delay_seconds 秒后才能再次被领取；error 保留本次失败的原因"""
+    await db.execute(
+        update(ProvisioningJob)
+        .where(ProvisioningJob.id == job_id)
+        .values(
+            status=JOB_PENDING,
+            step="queued",
+            error=error,
+            locked_until=func.now() + timedelta(seconds=delay_seconds),
+        )
+    )
+
+
+async def finish_job(db: AsyncSession, job_id: int, error: str | None = None) -> None:
+    await db.execute(
+        update(ProvisioningJob)
+        .where(ProvisioningJob.id == job_id)
+        .values(
+            status=JOB_FAILED if error else JOB_SUCCEEDED,
+            step="done" if error is None else ProvisioningJob.step,
+            error=error,
+            locked_until=None,
+            finished_at=func.now(),
+        )
+    )
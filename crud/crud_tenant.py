@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
+import heapq
 import logging
 
 from models.public import Tenant
 
-from fastapi import HTTPException
-from sqlalchemy import select, text
+from sqlalchemy import ARRAY, String, any_, bindparam, func, insert, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from core.config import settings
+from core.pagination import apply_keyset
+from core.shards import DEFAULT_SHARD
+from core.tenant_cache import tenant_cache
 from schemas.tenant import TenantCreate, TenantUpdate
 
 logger = logging.getLogger(__name__)
@@ -27,44 +31,85 @@ async def get_tenant_by_subdomain(db: AsyncSession, subdomain: str) -> Tenant |
     return result.scalar_one_or_none()
 
 
-async def create_tenant(db: AsyncSession, tenant_in: TenantCreate) -> Tenant:
+async def place_tenants(db: AsyncSession, shards: list[str], count: int) -> list[str]:
+    """
+    为 count 个新租户选择分片: 每次放到当前租户数最少的分片 (按 shards 中的顺序打破平局)。
+    租户数按 public.tenants 中的全部记录 (含未激活的) 统计，一次查询。
+    """
+    result = await db.execute(
+        select(Tenant.shard, func.count()).where(Tenant.shard == any_(bindparam("shards", shards, type_=ARRAY(String)))).group_by(Tenant.shard)
+    )
+    loads = dict.fromkeys(shards, 0)
+    loads.update({shard: total for shard, total in result})
+    heap = [(load, index, shard) for index, (shard, load) in enumerate(loads.items())]
+    heapq.heapify(heap)
+    placements = []
+    for _ in range(count):
+        load, index, shard = heapq.heappop(heap)
+        placements.append(shard)
+        heapq.heappush(heap, (load + 1, index, shard))
+    return placements
+
+
+async def create_tenant(db: AsyncSession, tenant_in: TenantCreate, shard: str = DEFAULT_SHARD) -> Tenant:
+    """
+    在 public.tenants 中创建租户记录 (未激活)，租户 schema (或共享 schema 中的数据) 位于 shard 分片。
+    schema 的创建与迁移由开通任务 (core/jobs.py) 在后台完成，完成后租户才会被激活。
+    """
     if not tenant_in.schema_name:
         raise ValueError("Schema name must be provided or generated before creating tenant object")
 
-    # 1. 创建数据库 Schema (如果不存在)
-    try:
-        # 使用 text 防止 ORM 尝试解释为表名
-        # 重要: 确保 schema_name 经过了严格验证，防止 SQL 注入
-        await db.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{tenant_in.schema_name}";'))
-        logger.info(f"Schema '{tenant_in.schema_name}' created or already exists.")
-    except Exception as e:
-        logger.error(f"Failed to create schema '{tenant_in.schema_name}': {e}")
-        # 可能需要根据错误类型决定是否继续。如果 schema 已存在可能没问题。
-        # 如果是权限问题等，则应抛出异常。
-        # 这里假设 schema 已存在是可接受的，但创建失败是严重错误
-        if "already exists" not in str(e).lower():
-            raise HTTPException(status_code=500, detail=f"Database schema creation failed for {tenant_in.schema_name}") from e
-
-    # 2. 在 public.tenants 表中创建记录
     db_tenant = Tenant(
         name=tenant_in.name,
         schema_name=tenant_in.schema_name,
         subdomain=tenant_in.subdomain,
-        is_active=True  # 通常新租户是活跃的
+        shard=shard,
+        tenancy=tenant_in.tenancy or settings.DEFAULT_TENANCY,
+        is_active=False  # schema 开通完成后由后台任务激活
     )
     db.add(db_tenant)
     await db.flush()  # 刷新以获取 ID 或处理唯一约束冲突
     await db.refresh(db_tenant)
+    # 清除该 id 可能存在的负向缓存条目 (例如之前被探测过的 id)
+    await tenant_cache.invalidate_on_commit(db, db_tenant.id)
     logger.info(f"Tenant record created for {db_tenant.name} with schema {db_tenant.schema_name}")
+    return db_tenant
 
-    # 3. **关键**: 运行 Alembic 迁移以在新 Schema 中创建表
-    #    这一步通常在 API 请求之外异步执行，或者通过独立的管理脚本完成
-    #    因为运行迁移可能耗时较长，不适合放在 API 请求处理中
-    #    这里只是注释说明需要这一步
-    #    run_alembic_migration_for_schema(tenant_in.schema_name)
-    logger.warning(f"ACTION REQUIRED: Run migrations for new schema '{tenant_in.schema_name}' using Alembic.")
 
-    return db_tenant
+async def find_conflicts(db: AsyncSession, tenants_in: list[TenantCreate]) -> list[tuple[str, str, str | None]]:
+    """一次查询找出与这批租户的 name / schema_name / subdomain 冲突的已有租户，返回 (name, schema_name, subdomain) 列表"""
+    names = [tenant_in.name for tenant_in in tenants_in]
+    schema_names = [tenant_in.schema_name for tenant_in in tenants_in]
+    subdomains = [tenant_in.subdomain for tenant_in in tenants_in if tenant_in.subdomain]
+    stmt = select(Tenant.name, Tenant.schema_name, Tenant.subdomain).where(or_(
+        Tenant.name == any_(bindparam("names", names, type_=ARRAY(String))),
+        Tenant.schema_name == any_(bindparam("schema_names", schema_names, type_=ARRAY(String))),
+        Tenant.subdomain == any_(bindparam("subdomains", subdomains, type_=ARRAY(String))),
+    ))
+    result = await db.execute(stmt)
+    return [tuple(row) for row in result]
+
+
+async def create_tenants_bulk(db: AsyncSession, tenants_in: list[TenantCreate], shards: list[str]) -> list[Tenant]:
+    """
+    以一条多行 INSERT ... RETURNING 创建一批租户记录 (未激活)，返回顺序与 tenants_in 一致；shards 为各租户所在的分片。
+    调用方负责事先排除冲突的条目。新 id 不会命中负向缓存: 租户在激活时才会失效缓存并可访问。
+    """
+    rows = [
+        {
+            "name": tenant_in.name,
+            "schema_name": tenant_in.schema_name,
+            "subdomain": tenant_in.subdomain,
+            "shard": shard,
+            "tenancy": tenant_in.tenancy or settings.DEFAULT_TENANCY,
+            "is_active": False,
+        }
+        for tenant_in, shard in zip(tenants_in, shards)
+    ]
+    result = await db.scalars(insert(Tenant).returning(Tenant, sort_by_parameter_order=True), rows)
+    tenants = list(result)
+    logger.info(f"{len(tenants)} tenant records created in bulk")
+    return tenants
 
 
 async def update_tenant(db: AsyncSession, db_tenant: Tenant, tenant_in: TenantUpdate) -> Tenant:
@@ -74,9 +119,14 @@ async def update_tenant(db: AsyncSession, db_tenant: Tenant, tenant_in: TenantUp
     db.add(db_tenant)
     await db.flush()
     await db.refresh(db_tenant)
+    await tenant_cache.invalidate_on_commit(db, db_tenant.id)
     return db_tenant
 
 
-async def get_tenants(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[Tenant]:
-    result = await db.execute(select(Tenant).offset(skip).limit(limit))
+async def get_tenants(db: AsyncSession, skip: int = 0, limit: int = 100, after: list | None = None) -> list[Tenant]:
+    """按 id 排序；after 为游标中的 id 时使用键集分页 (忽略 skip)，否则使用 OFFSET 分页"""
+    stmt = apply_keyset(select(Tenant), [Tenant.id], after, limit)
+    if after is None and skip:
+        stmt = stmt.offset(skip)
+    result = await db.execute(stmt)
     return result.scalars().all()
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Sequence
+
 from models.tenant import Product  # 导入租户模型
 
-from sqlalchemy import select
+from psycopg import sql as psycopg_sql
+from sqlalchemy import Integer, Row, Select, any_, bindparam, insert, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from core.pagination import apply_keyset
 from schemas.user import ProductCreate
 
 
@@ -15,11 +21,130 @@ async def create_item(db: AsyncSession, item: ProductCreate) -> Product:
     return db_item
 
 
-async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[Product]:
-    result = await db.execute(select(Product).offset(skip).limit(limit))
+async def create_items(db: AsyncSession, items: Sequence[ProductCreate]) -> list[Product]:
+    """
+    用一条多行 INSERT ... RETURNING 写入 items，返回的 Product 与 items 一一对应 (按参数顺序)。
+    """
+    if not items:
+        return []
+    result = await db.scalars(
+        insert(Product).returning(Product, sort_by_parameter_order=True),
+        [item.model_dump() for item in items],
+    )
+    return list(result.all())
+
+
+# 列表支持的排序方式: 排序键 (最后一列为主键，保证顺序稳定且唯一)
+PRODUCT_SORT_KEYS = {
+    "id": ("id",),
+    "name": ("name", "id"),
+}
+
+
+# 列表接口返回的列，顺序与 ProductInDB 的字段顺序一致 (响应 JSON 的键顺序不变)
+PRODUCT_RESPONSE_COLUMNS = (Product.name, Product.description, Product.price, Product.id)
+
+
+def _page(stmt: Select, skip: int, limit: int, sort: str, after: list | None) -> Select:
+    """after 为游标中的排序键时使用键集分页 (忽略 skip)，否则使用 OFFSET 分页"""
+    columns = [getattr(Product, key) for key in PRODUCT_SORT_KEYS[sort]]
+    stmt = apply_keyset(stmt, columns, after, limit)
+    if after is None and skip:
+        stmt = stmt.offset(skip)
+    return stmt
+
+
+async def get_items(
+    db: AsyncSession, skip: int = 0, limit: int = 100, sort: str = "id", after: list | None = None
+) -> list[Product]:
+    """after 为游标中的排序键时使用键集分页 (忽略 skip)，否则使用 OFFSET 分页"""
+    result = await db.execute(_page(select(Product), skip, limit, sort, after))
     return result.scalars().all()
 
 
+async def get_item_rows(
+    db: AsyncSession, skip: int = 0, limit: int = 100, sort: str = "id", after: list | None = None
+) -> Sequence[Row]:
+    """
+    与 get_items 相同的分页，但只查询 PRODUCT_RESPONSE_COLUMNS 并返回 Row:
+    不构造 ORM 对象、不进入 identity map，供列表接口直接序列化。
+    """
+    result = await db.execute(_page(select(*PRODUCT_RESPONSE_COLUMNS), skip, limit, sort, after))
+    return result.all()
+
+
+async def iter_item_batches(db: AsyncSession, batch_size: int = 1000) -> AsyncIterator[Sequence[Row]]:
+    """
+    按 id 顺序以服务端游标分批读取全部 products，每批最多 batch_size 行。
+    只有在调用方取下一批时才会从数据库拉取，内存占用与表大小无关。
+    """
+    stmt = (
+        select(Product.id, Product.name, Product.description, Product.price)
+        .order_by(Product.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(stmt)
+    try:
+        async for partition in result.partitions():
+            yield partition
+    finally:
+        await result.close()
+
+
+@asynccontextmanager
+async def copy_items(
+    db: AsyncSession, schema_name: str, use_insert: bool = False
+) -> AsyncIterator[Callable[[Sequence[ProductCreate]], Awaitable[None]]]:
+    """
+    在 db 当前事务中打开一个 COPY products FROM STDIN，产出一个写入函数: await write(items)。
+    COPY 在上下文退出时结束；整个导入只有一条 COPY 语句，行数据随写入流式发送给数据库。
+    表名显式带上 schema，不依赖 search_path / schema_translate_map (COPY 是驱动层的原生语句)。
+    use_insert=True 时每批改用一条多行 INSERT (启用了行级安全的共享 schema 不支持 COPY FROM)。
+    """
+    if use_insert:
+        async def insert_batch(items: Sequence[ProductCreate]) -> None:
+            if items:
+                await db.execute(insert(Product), [item.model_dump() for item in items])
+
+        yield insert_batch
+        return
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    statement = psycopg_sql.SQL("COPY {}.{} (name, description, price) FROM STDIN").format(
+        psycopg_sql.Identifier(schema_name), psycopg_sql.Identifier(Product.__tablename__)
+    )
+    async with raw_connection.driver_connection.cursor() as cursor:
+        async with cursor.copy(statement) as copy:
+            async def write(items: Sequence[ProductCreate]) -> None:
+                # 整批编码为 COPY 文本格式后一次写入，避免逐行调用 write_row 的开销
+                if items:
+                    await copy.write("".join(
+                        f"{_copy_text(item.name)}\t{_copy_text(item.description)}\t{item.price!r}\n" for item in items
+                    ).encode())
+
+            yield write
+
+
+_COPY_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_text(value: str | None) -> str:
+    """COPY 文本格式的字段: NULL 写作 \\N，反斜杠、制表符和换行需要转义"""
+    return "\\N" if value is None else value.translate(_COPY_TEXT_ESCAPES)
+
+
 async def get_item(db: AsyncSession, item_id: int) -> Product | None:
     result = await db.execute(select(Product).where(Product.id == item_id))
     return result.scalar_one_or_none()
+
+
+async def get_items_by_ids(db: AsyncSession, ids: Sequence[int]) -> dict[int, Product]:
+    """
+    一条 WHERE id = ANY(:ids) 查询取回 ids 对应的 products，返回 {id: Product} (不存在的 id 不在其中)。
+    整个数组作为一个绑定参数传入，无论 id 个数多少都是同一条语句。
+    """
+    if not ids:
+        return {}
+    stmt = select(Product).where(Product.id == any_(bindparam("ids", list(ids), type_=ARRAY(Integer))))
+    result = await db.execute(stmt)
+    return {item.id: item for item in result.scalars()}
@@ -0,0 +1,4 @@
+#!/bin/bash
+# 允许只读副本 (infra.yml 中的 db_replica) 通过流复制连接主库
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
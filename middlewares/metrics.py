@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.metrics import NO_TENANT, RequestMetrics, current_request_metrics, metrics_registry
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件，记录每个请求的耗时、状态码以及请求期间的 SQL 语句数、数据库耗时和取连接等待时间 (core/metrics.py)。
+    必须位于 TenantMiddleware 外层: 租户查询本身的数据库开销也计入请求，租户从 scope["state"]["tenant_info"] 读取。
+    耗时计算到响应体发送完毕 (流式响应包含整个传输过程)。
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = current_request_metrics.set(request)
+        status_code = 500  # 应用在发送响应头之前抛出异常
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request_metrics.reset(token)
+            tenant = scope.get("state", {}).get("tenant_info")
+            metrics_registry.observe_request(
+                str(tenant.id) if tenant is not None else NO_TENANT, status_code, time.perf_counter() - started, request
+            )
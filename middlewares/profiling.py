@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.profiling import RequestProfile, current_profile, sql_profiler
+
+
+class ProfilingMiddleware:
+    """
+    纯 ASGI 中间件，为每个请求开启 SQL 剖析 (core/profiling.py)。
+    必须位于 TenantMiddleware 外层: 租户查询也计入查询预算；路由与租户 schema 在语句执行时从 scope 中读取。
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(method=scope["method"], scope=scope)
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_profile.reset(token)
+            sql_profiler.finish_request(profile)
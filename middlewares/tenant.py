@@ -4,57 +4,182 @@ import logging
 from models.public import Tenant
 
 from fastapi import Request, status
-from sqlalchemy import select
+from sqlalchemy import String, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from core.db import AsyncSessionFactory
+from core.config import settings
+from core.db import AsyncSessionFactory, bind_tenant_schema, uses_schema_translate_map
+from core.shards import DEFAULT_SHARD
+from core.tenancy import TENANCY_SHARED, tenant_data_schema, tenant_row_scope
+from core.tenant_cache import tenant_cache
 
 logger = logging.getLogger(__name__)
 
+# 对于特殊路径（如管理API、静态文件、根路径等）可能不需要租户上下文
+# 这里简化处理，所有路径都需要有效租户，除了根路径或特定管理路径
+PUBLIC_PATH_PREFIXES = ("/api/v1/admin",)
+PUBLIC_PATHS = frozenset({"/", "/docs", "/openapi.json", "/metrics"})
 
-class TenantMiddleware(BaseHTTPMiddleware):
 
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        # 对于特殊路径（如管理API、静态文件、根路径等）可能不需要租户上下文
-        # 这里简化处理，所有路径都需要有效租户，除了根路径或特定管理路径
-        path = request.url.path
-        if path.startswith("/api/v1/admin/tenants") or path == "/" or path == "/docs" or path == "/openapi.json":
+def is_public_path(path: str) -> bool:
+    return path in PUBLIC_PATHS or path.startswith(PUBLIC_PATH_PREFIXES)
+
+
+async def _load_active_tenant(tenant_id: int) -> Tenant | None:
+    """缓存未命中时, 使用独立的 Session 查询 public.tenants，避免 search_path 干扰"""
+    session: AsyncSession = AsyncSessionFactory()
+    try:
+        stmt = select(Tenant).where(Tenant.id == tenant_id, Tenant.is_active == True)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+    finally:
+        await session.close()
+
+
+async def _load_and_bind_tenant(session: AsyncSession, tenant_id: int) -> Tenant | None:
+    """
+    在 session 的事务中完成租户查询并绑定租户 schema。
+    search_path 模式下一次往返完成: set_config(..., true) 等价于 SET LOCAL，只对返回了行 (即活跃租户) 的情况生效。
+    """
+    stmt = select(Tenant).where(Tenant.id == tenant_id, Tenant.is_active == True)
+    if not uses_schema_translate_map():
+        search_path = func.quote_ident(Tenant.schema_name, type_=String).concat(", public")
+        stmt = stmt.add_columns(func.set_config("search_path", search_path, True))
+    row = (await session.execute(stmt)).first()
+    if row is None:
+        return None
+    tenant = row[0]
+    if uses_schema_translate_map() or tenant.tenancy == TENANCY_SHARED:
+        # 共享租户还需要限定 tenant_id 与角色 (上面按 schema_name 设置的 search_path 被覆盖)
+        await bind_tenant_schema(session, tenant_data_schema(tenant), tenant_row_scope(tenant))
+    # 租户对象会被放进进程级缓存，与本请求的 session 解除关联
+    session.expunge(tenant)
+    return tenant
+
+
+async def resolve_tenant(
+    raw_tenant_id: str | None, bind_session: bool = False
+) -> tuple[Tenant | None, AsyncSession | None, Response | None]:
+    """
+    根据 X-Tenant-ID 解析租户，返回 (tenant, session, error_response)。
+
+    error_response 不为 None 时应直接以该响应结束请求。
+    bind_session=True 且缓存未命中时，租户查询在一个新 session 中完成，并顺带绑定好租户 schema，
+    该 session 随结果返回，由调用方负责关闭；缓存命中 (或同一租户的并发请求正在加载) 时 session 为 None。
+    """
+    if not raw_tenant_id:
+        # 如果没有提供租户 ID，返回 403 Forbidden
+        return None, None, Response("Forbidden: Missing X-Tenant-ID header", status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        tenant_id = int(raw_tenant_id)
+    except ValueError:
+        return None, None, Response("Bad Request: Invalid X-Tenant-ID header", status_code=status.HTTP_400_BAD_REQUEST)
+
+    session: AsyncSession | None = None
+    try:
+        if bind_session:
+            tenant, session = await tenant_cache.get_or_load_in_session(tenant_id, AsyncSessionFactory, _load_and_bind_tenant)
+        else:
+            tenant = await tenant_cache.get_or_load(tenant_id, _load_active_tenant)
+    except Exception as e:
+        logger.error(f"Error querying tenant<id:{tenant_id}>: {e}")
+        return None, None, Response(f"Internal Server Error: Could not query tenant<id:{tenant_id}>", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if tenant and session is not None and tenant.shard != DEFAULT_SHARD:
+        # 租户查询在控制库 (default 分片) 上完成，租户 schema 位于其他分片: 该 session 不能复用
+        await session.close()
+        session = None
+
+    if not tenant:
+        if session is not None:
+            await session.close()
+        logger.warning(f"Tenant<id:{tenant_id}> not found")
+        # 如果没有匹配的、活跃的租户，返回 404 或 403
+        # 这里返回 404 更符合资源未找到的语义
+        return None, None, Response(f"Tenant<id:{tenant_id}> not found", status_code=status.HTTP_404_NOT_FOUND)
+    return tenant, session, None
+
+
+class TenantMiddleware:
+    """
+    纯 ASGI 实现的租户中间件。
+
+    与 BaseHTTPMiddleware 不同，这里不会为每个请求额外创建任务和内存流，
+    receive/send 原样传给下游应用，流式响应也不会被缓冲。
+    租户信息写入 scope["state"]，下游通过 request.state.tenant_schema / tenant_shard / tenant_row_scope / tenant_info 读取
+    (tenant_schema 为租户数据所在的 schema，共享租户为共享 schema，此时 tenant_row_scope 为租户 id)。
+    开启 DB_REQUEST_SCOPED_SESSION 时，租户查询所用的 session 也写入 scope["state"]["db_session"]。
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        if is_public_path(scope["path"]):
             # 管理接口或公共接口，不需要租户 schema，或者使用默认public
-            request.state.tenant_schema = "public"
-            request.state.tenant_info = None
-            response = await call_next(request)
-            return response
+            state["tenant_schema"] = "public"
+            state["tenant_shard"] = DEFAULT_SHARD
+            state["tenant_row_scope"] = None
+            state["tenant_info"] = None
+            await self.app(scope, receive, send)
+            return
+
+        raw_tenant_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-tenant-id":
+                raw_tenant_id = value.decode("latin-1")
+                break
 
-        tenant_id = request.headers.get("X-Tenant-ID", None)
-        if not tenant_id:
-            # 如果没有提供租户 ID，返回 403 Forbidden
-            return Response("Forbidden: Missing X-Tenant-ID header", status_code=status.HTTP_403_FORBIDDEN)
-        tenant_id = int(tenant_id)
+        tenant, session, error_response = await resolve_tenant(raw_tenant_id, bind_session=settings.DB_REQUEST_SCOPED_SESSION)
+        if error_response is not None:
+            await error_response(scope, receive, send)
+            return
 
-        tenant: Tenant | None = None
-        # 使用独立的 Session 查询 public.tenants，避免 search_path 干扰
-        session: AsyncSession = AsyncSessionFactory()
+        state["tenant_schema"] = tenant_data_schema(tenant)
+        state["tenant_shard"] = tenant.shard
+        state["tenant_row_scope"] = tenant_row_scope(tenant)
+        state["tenant_info"] = tenant  # 存储整个对象供后续使用
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+
+        # 请求级会话: 已绑定租户 schema 的 session 交给 get_db 复用，响应结束后统一关闭
+        state["db_session"] = session
         try:
-            stmt = select(Tenant).where(Tenant.id == tenant_id, Tenant.is_active == True)
-            result = await session.execute(stmt)
-            tenant = result.scalar_one_or_none()
-        except Exception as e:
-            logger.error(f"Error querying tenant<id:{tenant_id}>: {e}")
-            return Response(f"Internal Server Error: Could not query tenant<id:{tenant_id}>", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            await self.app(scope, receive, send)
         finally:
             await session.close()
 
-        if tenant:
-            request.state.tenant_schema = tenant.schema_name
-            request.state.tenant_info = tenant  # 存储整个对象供后续使用
+
+class BaseHTTPTenantMiddleware(BaseHTTPMiddleware):
+    """基于 BaseHTTPMiddleware 的旧实现，仅保留用于性能对比 (见 benchmarks/bench_middleware.py)"""
+
+    async def dispatch(
+        self, request: Request, call_next: RequestResponseEndpoint
+    ) -> Response:
+        if is_public_path(request.url.path):
+            request.state.tenant_schema = "public"
+            request.state.tenant_shard = DEFAULT_SHARD
+            request.state.tenant_row_scope = None
+            request.state.tenant_info = None
             response = await call_next(request)
             return response
-        else:
-            logger.warning(f"Tenant<id:{tenant_id}> not found")
-            # 如果没有匹配的、活跃的租户，返回 404 或 403
-            # 这里返回 404 更符合资源未找到的语义
-            return Response(f"Tenant<id:{tenant_id}> not found", status_code=status.HTTP_404_NOT_FOUND)
+
+        tenant, _, error_response = await resolve_tenant(request.headers.get("X-Tenant-ID", None))
+        if error_response is not None:
+            return error_response
+
+        request.state.tenant_schema = tenant_data_schema(tenant)
+        request.state.tenant_shard = tenant.shard
+        request.state.tenant_row_scope = tenant_row_scope(tenant)
+        request.state.tenant_info = tenant
+        response = await call_next(request)
+        return response
@@ -14,13 +14,17 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 
 config = context.config
-if config.config_file_name is not None:
+# 由 run_migrations.py 在进程内调用时不重新配置日志 (fileConfig 会禁用调用方已有的 logger)
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic')
 
 
 def get_schema_name_from_context() -> str:
-    """Get schema name from -x argument"""
+    """Get schema name from config attributes (in-process runner) or -x argument"""
+    schema_name = config.attributes.get('schema_name')
+    if schema_name:
+        return schema_name
     return context.get_x_argument(as_dictionary=True).get('schema_name', 'public')
 
 
@@ -53,6 +57,21 @@ def include_object(object, name, type_, reflected, compare_to):
         return True
 
 
+def run_migrations_with_connection(connection, schema_name, target_metadata) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        version_table_schema=schema_name,
+        include_schemas=True,
+        include_name=include_name,
+        include_object=include_object,
+        compare_type=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 def run_migrations_online() -> None:
     """Run migrations in 'online' mode.
 
@@ -66,6 +85,20 @@ def run_migrations_online() -> None:
     
     logger.info(f"Running migrations under schema: '{schema_name}'")
 
+    if schema_name == 'public':
+        target_metadata = Tenant.metadata
+    else:
+        target_metadata = User.metadata
+
+    # run_migrations.py 在进程内执行迁移时会传入一个可复用的连接
+    connection = config.attributes.get('connection', None)
+    if connection is not None:
+        # 会话级设置 search_path 并立即提交，使 Alembic 自行管理迁移事务
+        connection.exec_driver_sql(f'SET search_path TO "{schema_name}"')
+        connection.commit()
+        run_migrations_with_connection(connection, schema_name, target_metadata)
+        return
+
     # --- 设置 search_path ---
     # PostgreSQL 的连接选项通过 'options' 参数传递，格式是 '-c <parameter>=<value>'
     search_path_option = f"-c search_path={schema_name}"
@@ -76,24 +109,8 @@ def run_migrations_online() -> None:
         connect_args={'options': search_path_option}
     )
 
-    if schema_name == 'public':
-        target_metadata = Tenant.metadata
-    else:
-        target_metadata = User.metadata
-    
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=target_metadata,
-            version_table_schema=schema_name,
-            include_schemas=True,
-            include_name=include_name,
-            include_object=include_object,
-            compare_type=True,
-        )
-
-        with context.begin_transaction():
-            context.run_migrations()
+        run_migrations_with_connection(connection, schema_name, target_metadata)
 
 
 run_migrations_online()
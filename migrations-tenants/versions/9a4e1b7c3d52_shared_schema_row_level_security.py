@@ -0,0 +1,116 @@
+"""shared schema row level security
+
+Only changes the shared schema (SHARED_TENANT_SCHEMA) that small tenants are
+pooled in: every table gets a tenant_id column filled from the app.tenant_id
+session setting, uniqueness and foreign keys are scoped to the tenant, and
+row level security restricts the SHARED_TENANT_ROLE role to the current
+tenant's rows. For dedicated tenant schemas (and the template) this revision
+is a no-op.
+
+Revision ID: 9a4e1b7c3d52
+Revises: 3975d850b8e5
+Create Date: 2025-05-27 11:05:37.219846
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4e1b7c3d52'
+down_revision: Union[str, None] = '3975d850b8e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+# 只修改共享 schema，对独享 schema 是空操作 (benchmarks/bench_migrations.py 的 --start-revision previous 会跳过它)
+SHARED_SCHEMA_ONLY = True
+
+SHARED_TENANT_SCHEMA = os.getenv("SHARED_TENANT_SCHEMA", "tenant_shared")
+SHARED_TENANT_ROLE = os.getenv("SHARED_TENANT_ROLE", "tenant_shared_rw")
+TABLES = ("products", "users", "orders", "companies")
+# current_setting(..., true) 在未设置时返回 NULL，插入因 NOT NULL 约束失败而不会写入错误的租户
+CURRENT_TENANT_ID = "current_setting('app.tenant_id', true)::integer"
+
+
+def _is_shared_schema() -> bool:
+    return op.get_context().version_table_schema == SHARED_TENANT_SCHEMA
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _is_shared_schema():
+        return
+    for table in TABLES:
+        op.add_column(table, sa.Column('tenant_id', sa.Integer(), server_default=sa.text(CURRENT_TENANT_ID), nullable=False))
+
+    # 唯一性、常用排序与外键都限定在租户内
+    op.drop_index('ix_users_email', table_name='users')
+    op.create_index('ix_users_tenant_id_email', 'users', ['tenant_id', 'email'], unique=True)
+    op.create_index('ix_users_tenant_id_name', 'users', ['tenant_id', 'name'], unique=False)
+    op.create_index('ix_products_tenant_id_name', 'products', ['tenant_id', 'name', 'id'], unique=False)
+    op.create_index('ix_companies_tenant_id_name', 'companies', ['tenant_id', 'name'], unique=False)
+    op.create_unique_constraint('uq_products_tenant_id_id', 'products', ['tenant_id', 'id'])
+    op.create_unique_constraint('uq_users_tenant_id_id', 'users', ['tenant_id', 'id'])
+    op.create_unique_constraint('uq_orders_tenant_id_id', 'orders', ['tenant_id', 'id'])
+    op.create_unique_constraint('uq_companies_tenant_id_id', 'companies', ['tenant_id', 'id'])
+    op.drop_constraint('fk_orders_product_id_products', 'orders', type_='foreignkey')
+    op.drop_constraint('fk_orders_owner_id_users', 'orders', type_='foreignkey')
+    op.create_foreign_key('fk_orders_tenant_id_products', 'orders', 'products', ['tenant_id', 'product_id'], ['tenant_id', 'id'])
+    op.create_foreign_key('fk_orders_tenant_id_users', 'orders', 'users', ['tenant_id', 'owner_id'], ['tenant_id', 'id'])
+
+    schema = '"{}"'.format(SHARED_TENANT_SCHEMA.replace('"', '""'))
+    role = '"{}"'.format(SHARED_TENANT_ROLE.replace('"', '""'))
+    # 角色是集群级对象，多个分片位于同一实例时可能已经存在
+    op.execute(
+        f"DO $$ BEGIN IF NOT EXISTS (SELECT FROM pg_catalog.pg_roles WHERE rolname = '{SHARED_TENANT_ROLE}') "
+        f"THEN CREATE ROLE {role} NOLOGIN; END IF; END $$"
+    )
+    # 应用的数据库用户需要是该角色的成员才能 SET ROLE
+    op.execute(f"GRANT {role} TO CURRENT_USER")
+    op.execute(f"GRANT USAGE ON SCHEMA {schema} TO {role}")
+    op.execute(f"GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA {schema} TO {role}")
+    op.execute(f"GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA {schema} TO {role}")
+    op.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA {schema} GRANT SELECT, INSERT, UPDATE, DELETE ON TABLES TO {role}")
+    op.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA {schema} GRANT USAGE, SELECT ON SEQUENCES TO {role}")
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY")
+        op.execute(f"ALTER TABLE {table} FORCE ROW LEVEL SECURITY")
+        op.execute(
+            f"CREATE POLICY tenant_isolation ON {table} "
+            f"USING (tenant_id = {CURRENT_TENANT_ID}) WITH CHECK (tenant_id = {CURRENT_TENANT_ID})"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _is_shared_schema():
+        return
+    schema = '"{}"'.format(SHARED_TENANT_SCHEMA.replace('"', '""'))
+    role = '"{}"'.format(SHARED_TENANT_ROLE.replace('"', '""'))
+    for table in TABLES:
+        op.execute(f"DROP POLICY IF EXISTS tenant_isolation ON {table}")
+        op.execute(f"ALTER TABLE {table} NO FORCE ROW LEVEL SECURITY")
+        op.execute(f"ALTER TABLE {table} DISABLE ROW LEVEL SECURITY")
+    op.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA {schema} REVOKE USAGE, SELECT ON SEQUENCES FROM {role}")
+    op.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA {schema} REVOKE SELECT, INSERT, UPDATE, DELETE ON TABLES FROM {role}")
+    op.execute(f"REVOKE ALL ON ALL SEQUENCES IN SCHEMA {schema} FROM {role}")
+    op.execute(f"REVOKE ALL ON ALL TABLES IN SCHEMA {schema} FROM {role}")
+    op.execute(f"REVOKE USAGE ON SCHEMA {schema} FROM {role}")
+
+    op.drop_constraint('fk_orders_tenant_id_users', 'orders', type_='foreignkey')
+    op.drop_constraint('fk_orders_tenant_id_products', 'orders', type_='foreignkey')
+    op.create_foreign_key(op.f('fk_orders_owner_id_users'), 'orders', 'users', ['owner_id'], ['id'])
+    op.create_foreign_key(op.f('fk_orders_product_id_products'), 'orders', 'products', ['product_id'], ['id'])
+    op.drop_constraint('uq_companies_tenant_id_id', 'companies', type_='unique')
+    op.drop_constraint('uq_orders_tenant_id_id', 'orders', type_='unique')
+    op.drop_constraint('uq_users_tenant_id_id', 'users', type_='unique')
+    op.drop_constraint('uq_products_tenant_id_id', 'products', type_='unique')
+    op.drop_index('ix_companies_tenant_id_name', table_name='companies')
+    op.drop_index('ix_products_tenant_id_name', table_name='products')
+    op.drop_index('ix_users_tenant_id_name', table_name='users')
+    op.drop_index('ix_users_tenant_id_email', table_name='users')
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    for table in TABLES:
+        op.drop_column(table, 'tenant_id')
@@ -16,7 +16,38 @@ class Tenant(Base):
     schema_name: sqlalchemy_orm.Mapped[str] = sqlalchemy_orm.mapped_column(sqlalchemy.String(63), nullable=False, unique=True, index=True)
     subdomain: sqlalchemy_orm.Mapped[Optional[str]] = sqlalchemy_orm.mapped_column(sqlalchemy.String(100), unique=True, index=True)
     is_active: sqlalchemy_orm.Mapped[bool] = sqlalchemy_orm.mapped_column(sqlalchemy.Boolean, default=True)
+    # 租户 schema 所在的分片 (见 core/shards.py)
+    shard: sqlalchemy_orm.Mapped[str] = sqlalchemy_orm.mapped_column(sqlalchemy.String(32), nullable=False, server_default="default", index=True)
+    # 数据存放方式: schema (独享 schema_name) 或 shared (位于分片的共享 schema 中，见 core/tenancy.py)
+    tenancy: sqlalchemy_orm.Mapped[str] = sqlalchemy_orm.mapped_column(sqlalchemy.String(16), nullable=False, server_default="schema")
     created_at: sqlalchemy_orm.Mapped[sqlalchemy.DateTime] = sqlalchemy_orm.mapped_column(sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now())
 
     def __repr__(self):
         return f"<Tenant(id={self.id}, name='{self.name}', schema='{self.schema_name}')>"
+
+
+class ProvisioningJob(Base):
+    """租户开通任务 (建 schema + 迁移 + 激活)，由 core/jobs.py 中的后台工作协程执行"""
+    __tablename__ = "provisioning_jobs"
+    __table_args__ = (
+        sqlalchemy.Index("ix_public_provisioning_jobs_status_id", "status", "id"),
+        {"schema": "public"},
+    )
+
+    id: sqlalchemy_orm.Mapped[int] = sqlalchemy_orm.mapped_column(sqlalchemy.Integer, primary_key=True, index=True)
+    tenant_id: sqlalchemy_orm.Mapped[int] = sqlalchemy_orm.mapped_column(sqlalchemy.Integer, sqlalchemy.ForeignKey("public.tenants.id", ondelete="CASCADE"), nullable=False, index=True)
+    # pending -> running -> succeeded / failed
+    status: sqlalchemy_orm.Mapped[str] = sqlalchemy_orm.mapped_column(sqlalchemy.String(20), nullable=False, default="pending")
+    # 当前进度: queued / creating_schema / migrating / activating / done
+    step: sqlalchemy_orm.Mapped[str] = sqlalchemy_orm.mapped_column(sqlalchemy.String(32), nullable=False, default="queued")
+    attempts: sqlalchemy_orm.Mapped[int] = sqlalchemy_orm.mapped_column(sqlalchemy.Integer, nullable=False, default=0)
+    error: sqlalchemy_orm.Mapped[Optional[str]] = sqlalchemy_orm.mapped_column(sqlalchemy.Text)
+    # 执行中的任务在租约到期前不会被其他工作协程领取；进程崩溃后租约到期，任务会被重新领取。
+    # 失败后重新排队的 pending 任务在该时间之前不会被领取 (重试退避)
+    locked_until: sqlalchemy_orm.Mapped[Optional[sqlalchemy.DateTime]] = sqlalchemy_orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+    created_at: sqlalchemy_orm.Mapped[sqlalchemy.DateTime] = sqlalchemy_orm.mapped_column(sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now())
+    started_at: sqlalchemy_orm.Mapped[Optional[sqlalchemy.DateTime]] = sqlalchemy_orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+    finished_at: sqlalchemy_orm.Mapped[Optional[sqlalchemy.DateTime]] = sqlalchemy_orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<ProvisioningJob(id={self.id}, tenant_id={self.tenant_id}, status='{self.status}')>"
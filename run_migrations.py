@@ -1,116 +1,390 @@
 # -*- coding: utf-8 -*-
+"""
+Migrate the public schema and every active tenant schema to the latest revision.
+
+Alembic runs in-process (no subprocess per schema). Tenant schemas are migrated
+concurrently by a pool of worker processes -- Alembic's ``context`` is a process
+global, so threads cannot be used -- and every worker keeps one database
+connection open and reuses it for all the schemas it migrates.
+
+    python run_migrations.py --workers 8
+    python run_migrations.py --plan      # only show which schemas are behind head
+
+Before migrating, every tenant's ``alembic_version`` is read with a catalog
+lookup plus a few batched UNION ALL queries, and only schemas that are not
+already at head are dispatched to the workers.
+
+The template schema (TENANT_TEMPLATE_SCHEMA, created if missing) is migrated
+together with the tenants so that new tenants can be cloned from it at head.
+So is the shared schema (SHARED_TENANT_SCHEMA) that small tenants are pooled
+in (see core/tenancy.py); those tenants have no schema of their own.
+
+With DATABASE_SHARDS configured, tenant schemas live in several databases
+(see core/shards.py). The public schema is only migrated on the default
+shard (DATABASE_URL); every shard gets its own template schema and survey,
+and the work of all shards is interleaved so they are migrated concurrently.
+
+    python run_migrations.py --shard shard2   # only migrate tenants on shard2
+"""
+import argparse
 import logging
 import os
-import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
 
-import psycopg
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from core.shards import DEFAULT_SHARD, parse_shard_urls
 
 load_dotenv()
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Shard name -> database URL; the default shard is DATABASE_URL
+SHARD_URLS = parse_shard_urls(DATABASE_URL or "", os.getenv("DATABASE_SHARDS", ""))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PUBLIC_ALEMBIC_INI = os.path.join(BASE_DIR, "alembic.ini")
+TENANTS_ALEMBIC_INI = os.path.join(BASE_DIR, "alembic-tenants.ini")
+# Schema kept at head that new tenants are cloned from (see core/provisioning.py)
+TENANT_TEMPLATE_SCHEMA = os.getenv("TENANT_TEMPLATE_SCHEMA", "tenant_template")
+# Schema shared by tenants with tenancy = 'shared' (see core/tenancy.py)
+SHARED_TENANT_SCHEMA = os.getenv("SHARED_TENANT_SCHEMA", "tenant_shared")
+# Number of schemas read per UNION ALL statement when surveying alembic_version
+SURVEY_BATCH_SIZE = 500
+
+
+@dataclass
+class MigrationResult:
+    schema_name: str
+    ok: bool
+    duration: float
+    error: Optional[str] = None
+    shard: str = DEFAULT_SHARD
+
+    @property
+    def label(self) -> str:
+        return self.schema_name if self.shard == DEFAULT_SHARD else f"{self.shard}/{self.schema_name}"
+
+
+# Engines (one per shard) owned by the current (worker) process, created lazily
+# so that they are never inherited across a fork.
+_engines: dict[str, Engine] = {}
+
+
+def get_engine(shard: str = DEFAULT_SHARD) -> Engine:
+    engine = _engines.get(shard)
+    if engine is None:
+        url = SHARD_URLS.get(shard)
+        if not url:
+            raise RuntimeError("DATABASE_URL is not set" if shard == DEFAULT_SHARD else f"Unknown shard '{shard}'")
+        # One connection per shard and worker process is enough: schemas are migrated
+        # one at a time within a worker and the connection is reused between them.
+        engine = _engines[shard] = create_engine(url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+    return engine
 
-# Simple parsing for asyncpg DSN or connection string components
-# This is basic, consider using a proper URL parser like sqlalchemy.engine.url.make_url
-conn_details = {}
-if DATABASE_URL.startswith("postgresql+psycopg://"):
-    parts = DATABASE_URL.split("://")[1]
-    user_pass, host_db = parts.split("@")
-    user, password = user_pass.split(":")
-    host_port, database = host_db.split("/")
-    if ":" in host_port:
-        host, port = host_port.split(":")
-    else:
-        host = host_port
-        port = 5432
-    conn_details = {
-        "user": user, "password": password, "dbname": database, "host": host, "port": int(port)
-    }
-else:
-    logger.error(f"Unsupported DATABASE_URL format: {DATABASE_URL}")
-    exit(1)
 
+def _dispose_engines() -> None:
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
 
-def get_active_tenant_schemas():
-    conn = None
+
+def _init_worker() -> None:
+    """Process pool initializer: never reuse connections inherited from the parent."""
+    _engines.clear()
+
+
+def make_alembic_config(schema_name: str) -> Config:
+    ini_path = PUBLIC_ALEMBIC_INI if schema_name == "public" else TENANTS_ALEMBIC_INI
+    config = Config(ini_path)
+    # Resolve script_location relative to the repository, not the current directory
+    config.set_main_option("script_location", os.path.join(BASE_DIR, config.get_main_option("script_location")))
+    config.attributes["schema_name"] = schema_name
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def migrate_schema(schema_name: str, revision: str = "head", shard: str = DEFAULT_SHARD) -> MigrationResult:
+    """Upgrade a single schema on ``shard`` in-process using this process's shared engine."""
+    started = time.perf_counter()
+    try:
+        with get_engine(shard).connect() as connection:
+            config = make_alembic_config(schema_name)
+            config.attributes["connection"] = connection
+            command.upgrade(config, revision)
+    except Exception as e:
+        return MigrationResult(schema_name, False, time.perf_counter() - started, f"{type(e).__name__}: {e}", shard)
+    return MigrationResult(schema_name, True, time.perf_counter() - started, shard=shard)
+
+
+def get_active_tenant_schemas() -> dict[str, list[str]]:
+    """Active dedicated tenant schemas grouped by shard (read from public.tenants on the default shard)."""
     try:
-        conn = psycopg.connect(**conn_details)
-        with conn.cursor() as cur:
-            cur.execute("SELECT schema_name FROM public.tenants WHERE is_active = true;")
-            rows = cur.fetchall()
-            return [row[0] for row in rows]
+        with get_engine().connect() as connection:
+            rows = connection.execute(text(
+                "SELECT shard, schema_name FROM public.tenants WHERE is_active = true AND tenancy = 'schema' ORDER BY id;"
+            ))
+            by_shard: dict[str, list[str]] = {}
+            for shard, schema_name in rows:
+                by_shard.setdefault(shard, []).append(schema_name)
+            return by_shard
     except Exception as e:
         logger.error(f"Error connecting to database or fetching tenants: {e}")
-        return []
-    finally:
-        if conn:
-            conn.close()
+        return {}
+
+
+def ensure_template_schema(shard: str = DEFAULT_SHARD) -> Optional[str]:
+    """Create the template schema on ``shard`` if it does not exist yet; returns its name (None if disabled)."""
+    return _ensure_schema(TENANT_TEMPLATE_SCHEMA, shard)
+
+
+def ensure_shared_schema(shard: str = DEFAULT_SHARD) -> Optional[str]:
+    """Create the shared tenant schema on ``shard`` if it does not exist yet; returns its name (None if disabled)."""
+    return _ensure_schema(SHARED_TENANT_SCHEMA, shard)
+
+
+def _ensure_schema(schema_name: str, shard: str) -> Optional[str]:
+    if not schema_name:
+        return None
+    with get_engine(shard).begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {_quote_ident(schema_name)}"))
+    return schema_name
+
 
+def get_head_revision(schema_name: str) -> str:
+    """Head revision of the migration chain used for ``schema_name`` (joined with ',' if branched)."""
+    script = ScriptDirectory.from_config(make_alembic_config(schema_name))
+    return ",".join(sorted(script.get_heads()))
 
-def run_alembic_for_schema(schema_name):
-    logger.info(f"--- Running migrations for schema: {schema_name} ---")
-    if schema_name == "public":
-        command = ["alembic", "-x", f"schema_name={schema_name}", "upgrade", "head"]
+
+def _quote_ident(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def survey_schema_revisions(schema_names: list[str], shard: str = DEFAULT_SHARD) -> dict[str, Optional[str]]:
+    """
+    Read the current revision of every schema without touching Alembic.
+
+    One catalog query finds which schemas have an alembic_version table, then
+    their versions are read with UNION ALL statements of SURVEY_BATCH_SIZE
+    schemas each. Schemas without the table map to None (never migrated).
+    """
+    revisions: dict[str, Optional[str]] = {schema_name: None for schema_name in schema_names}
+    with get_engine(shard).connect() as connection:
+        versioned = [row[0] for row in connection.execute(
+            text("""
+                SELECT n.nspname
+                FROM pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relname = 'alembic_version' AND c.relkind = 'r' AND n.nspname = ANY(:schemas)
+            """),
+            {"schemas": list(schema_names)},
+        )]
+        found: dict[str, list[str]] = {}
+        for start in range(0, len(versioned), SURVEY_BATCH_SIZE):
+            batch = versioned[start:start + SURVEY_BATCH_SIZE]
+            selects = [
+                f"SELECT CAST(:s{i} AS text) AS schema_name, version_num FROM {_quote_ident(schema_name)}.alembic_version"
+                for i, schema_name in enumerate(batch)
+            ]
+            params = {f"s{i}": schema_name for i, schema_name in enumerate(batch)}
+            for schema_name, version_num in connection.execute(text(" UNION ALL ".join(selects)), params):
+                found.setdefault(schema_name, []).append(version_num)
+    for schema_name, versions in found.items():
+        revisions[schema_name] = ",".join(sorted(versions))
+    return revisions
+
+
+def plan_migrations(schema_names: list[str], shard: str = DEFAULT_SHARD) -> dict[Optional[str], list[str]]:
+    """Group the schemas of one shard by their current revision."""
+    groups: dict[Optional[str], list[str]] = {}
+    for schema_name, revision in survey_schema_revisions(schema_names, shard).items():
+        groups.setdefault(revision, []).append(schema_name)
+    return groups
+
+
+def log_plan(groups: dict[Optional[str], list[str]], head: str, shard: str = DEFAULT_SHARD) -> None:
+    logger.info(f"--- Migration Plan (shard: {shard}, head: {head}) ---")
+    for revision, schemas in sorted(groups.items(), key=lambda item: (item[0] == head, -len(item[1]))):
+        label = "at head" if revision == head else ("no alembic_version" if revision is None else "behind head")
+        sample = ", ".join(schemas[:5]) + (f", ... (+{len(schemas) - 5})" if len(schemas) > 5 else "")
+        logger.info(f"  {revision or '<base>'} [{label}]: {len(schemas)} schemas: {sample}")
+
+
+def interleave_shards(schemas_by_shard: dict[str, list[str]]) -> list[tuple[str, str]]:
+    """(shard, schema) pairs taking one schema from each shard in turn, so all shards progress together."""
+    queues = [[(shard, schema_name) for schema_name in schema_names] for shard, schema_names in schemas_by_shard.items()]
+    longest = max((len(queue) for queue in queues), default=0)
+    return [queue[i] for i in range(longest) for queue in queues if i < len(queue)]
+
+
+def migrate_schemas(targets: list[tuple[str, str]], workers: int, revision: str = "head") -> list[MigrationResult]:
+    """
+    Migrate (shard, schema) targets concurrently with up to ``workers`` processes.
+    A failing schema is recorded and does not stop the others.
+    """
+    results: list[MigrationResult] = []
+    total = len(targets)
+
+    def record(result: MigrationResult) -> None:
+        results.append(result)
+        if result.ok:
+            logger.info(f"[{len(results)}/{total}] {result.label}: migrated in {result.duration:.2f}s")
+        else:
+            logger.error(f"[{len(results)}/{total}] {result.label}: FAILED after {result.duration:.2f}s: {result.error}")
+
+    if workers <= 1:
+        for shard, schema_name in targets:
+            record(migrate_schema(schema_name, revision, shard))
+        return results
+
+    # Connections opened by this process must not leak into forked workers
+    _dispose_engines()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(migrate_schema, schema_name, revision, shard): (shard, schema_name) for shard, schema_name in targets}
+        for future in as_completed(futures):
+            try:
+                record(future.result())
+            except Exception as e:  # e.g. the worker process died
+                shard, schema_name = futures[future]
+                record(MigrationResult(schema_name, False, 0.0, f"{type(e).__name__}: {e}", shard))
+    return results
+
+
+def summarize(results: list[MigrationResult], wall_time: float) -> dict:
+    durations = sorted(r.duration for r in results)
+
+    def pct(p: float) -> float:
+        return durations[min(len(durations) - 1, int(p * len(durations)))] if durations else 0.0
+
+    return {
+        "schemas": len(results),
+        "succeeded": sum(1 for r in results if r.ok),
+        "failed": sorted(r.label for r in results if not r.ok),
+        "wall_time_s": round(wall_time, 2),
+        "schema_p50_s": round(pct(0.50), 3),
+        "schema_p95_s": round(pct(0.95), 3),
+        "schema_max_s": round(durations[-1], 3) if durations else 0.0,
+    }
+
+
+def select_tenant_schemas(schemas: Optional[list[str]], shards: list[str]) -> dict[str, list[str]]:
+    """
+    Tenant schemas to consider, grouped by shard and limited to ``shards``.
+    Explicit ``schemas`` are placed on the shard recorded in public.tenants
+    (the default shard if they are not registered, e.g. the template).
+    """
+    active = get_active_tenant_schemas()
+    if schemas:
+        registered = {schema_name: shard for shard, schema_names in active.items() for schema_name in schema_names}
+        by_shard: dict[str, list[str]] = {}
+        for schema_name in schemas:
+            by_shard.setdefault(registered.get(schema_name, DEFAULT_SHARD), []).append(schema_name)
     else:
-        command = ["alembic", "-c", "./alembic-tenants.ini", "-x", f"schema_name={schema_name}", "upgrade", "head"]
-    try:
-        # Run Alembic command
-        # capture_output=True might hide Alembic's own progress output
-        result = subprocess.run(command, check=True, text=True, capture_output=True)
-        logger.info(result.stdout)
-        if result.stderr:
-            logger.info("--- Alembic stderr ---")
-            logger.info(result.stderr)
-        logger.info(f"--- Migrations for {schema_name} completed successfully ---")
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.error(f"!!! Error running migrations for schema: {schema_name} !!!")
-        logger.error(e)
-        logger.error("--- Alembic stdout ---")
-        logger.error(e.stdout)
-        logger.error("--- Alembic stderr ---")
-        logger.error(e.stderr)
-        return False
-    except FileNotFoundError:
-        logger.error("Error: 'alembic' command not found. Is your virtual environment activated and Alembic installed?")
-        return False
-
-
-def main():
+        by_shard = active
+    return {shard: by_shard[shard] for shard in shards if by_shard.get(shard)}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run Alembic migrations for the public schema and all active tenant schemas.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MIGRATION_WORKERS", os.cpu_count() or 1)),
+                        help="number of worker processes migrating tenant schemas concurrently")
+    parser.add_argument("--schema", action="append", dest="schemas",
+                        help="only migrate the given tenant schema (may be repeated)")
+    parser.add_argument("--shard", action="append", dest="shards", choices=sorted(SHARD_URLS),
+                        help="only migrate tenant schemas on the given shard (may be repeated)")
+    parser.add_argument("--plan", action="store_true",
+                        help="print the schemas grouped by current revision and exit without migrating")
+    parser.add_argument("--all", action="store_true", dest="migrate_all",
+                        help="skip the alembic_version survey and run the upgrade for every schema")
+    args = parser.parse_args(argv)
+    shards = args.shards or list(SHARD_URLS)
+
+    if args.plan:
+        schemas_by_shard = select_tenant_schemas(args.schemas, shards)
+        if not args.schemas:
+            for shard in shards:
+                schemas_by_shard.setdefault(shard, []).extend(filter(None, (TENANT_TEMPLATE_SCHEMA, SHARED_TENANT_SCHEMA)))
+            schemas_by_shard = {shard: schemas for shard, schemas in schemas_by_shard.items() if schemas}
+        log_plan(plan_migrations(["public"]), get_head_revision("public"))
+        for shard, tenant_schemas in schemas_by_shard.items():
+            log_plan(plan_migrations(tenant_schemas, shard), get_head_revision(tenant_schemas[0]), shard)
+        return 0
+
     logger.info("Starting migration process for all active tenants and public schema...")
 
     # 1. Migrate public schema first (optional, depends if public schema has changes)
+    #    public.tenants only lives on the default shard
     logger.info("Migrating 'public' schema...")
-    if not run_alembic_for_schema("public"):
-        logger.error("Halting due to error in public schema migration.")
-        return
+    public_result = migrate_schema("public")
+    if not public_result.ok:
+        logger.error(f"Halting due to error in public schema migration: {public_result.error}")
+        return 1
 
     # 2. Get active tenant schemas
     logger.info("Fetching active tenant schemas...")
-    tenant_schemas = get_active_tenant_schemas()
-    if not tenant_schemas:
+    schemas_by_shard = select_tenant_schemas(args.schemas, shards)
+    if not schemas_by_shard and not TENANT_TEMPLATE_SCHEMA and not SHARED_TENANT_SCHEMA:
         logger.error("No active tenant schemas found or error fetching them.")
-        return
-    logger.info(f"Found {len(tenant_schemas)} active tenant schemas: {tenant_schemas}")
-
-    # 3. Migrate each tenant schema
-    success_count = 0
-    failure_count = 0
-    for schema in tenant_schemas:
-        if run_alembic_for_schema(schema):
-            success_count += 1
-        else:
-            failure_count += 1
+        return 1
+    for shard, tenant_schemas in schemas_by_shard.items():
+        logger.info(f"Found {len(tenant_schemas)} active tenant schemas on shard '{shard}'")
+    if not args.schemas:
+        # Every shard keeps its own template so new tenants can be cloned wherever they are placed,
+        # and its own shared schema for the small tenants placed there
+        for shard in shards:
+            for ensure, label in ((ensure_template_schema, "template"), (ensure_shared_schema, "shared")):
+                try:
+                    schema_name = ensure(shard)
+                except Exception as e:
+                    logger.error(f"Could not create {label} schema on shard '{shard}': {e}")
+                    return 1
+                if schema_name:
+                    schemas_by_shard.setdefault(shard, []).append(schema_name)
+
+    # 3. Only dispatch schemas that are not already at head
+    if not args.migrate_all:
+        pending: dict[str, list[str]] = {}
+        for shard, tenant_schemas in schemas_by_shard.items():
+            head = get_head_revision(tenant_schemas[0])
+            groups = plan_migrations(tenant_schemas, shard)
+            log_plan(groups, head, shard)
+            behind = [schema for revision, schemas in groups.items() if revision != head for schema in schemas]
+            if behind:
+                pending[shard] = behind
+        schemas_by_shard = pending
+        if not schemas_by_shard:
+            logger.info("All tenant schemas are already at head. Nothing to do.")
+            return 0
+    targets = interleave_shards(schemas_by_shard)
+    logger.info(f"Migrating {len(targets)} tenant schemas on {len(schemas_by_shard)} shards with {args.workers} workers")
+
+    # 4. Migrate tenant schemas of all shards concurrently
+    started = time.perf_counter()
+    results = migrate_schemas(targets, args.workers)
+    summary = summarize(results, time.perf_counter() - started)
 
     logger.info("--- Migration Summary ---")
-    logger.info(f"Successfully migrated schemas: {success_count}")
-    logger.info(f"Failed schemas: {failure_count}")
-    if failure_count > 0:
+    logger.info(f"Schemas: {summary['schemas']}, succeeded: {summary['succeeded']}, failed: {len(summary['failed'])}")
+    logger.info(f"Wall time: {summary['wall_time_s']}s, per-schema p50/p95/max: "
+                f"{summary['schema_p50_s']}s / {summary['schema_p95_s']}s / {summary['schema_max_s']}s")
+    for result in sorted(results, key=lambda r: r.duration, reverse=True)[:5]:
+        logger.info(f"  slowest: {result.label} {result.duration:.2f}s")
+    if summary["failed"]:
+        logger.error(f"!!! Failed schemas: {', '.join(summary['failed'])} !!!")
         logger.error("!!! Please check the logs for errors in failed schema migrations. !!!")
     logger.info("Migration process finished.")
+    return 1 if summary["failed"] else 0
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Run a query against every active tenant schema and print one JSON line per tenant.
+
+    python run_report.py product_count
+    python run_report.py products_above_price -p min_price=100 --mode union
+    python run_report.py --sql "SELECT count(*) AS n FROM {schema}.orders WHERE quantity > :q" -p q=5
+
+The query is either one of the predefined reports (core.fanout.REPORTS) or an
+ad-hoc statement given with --sql. ``{schema}`` is replaced with the quoted
+tenant schema and ``:name`` placeholders are bound from -p name=value (values
+are parsed as JSON when possible). Every statement runs in a read-only
+transaction. Failures are reported per tenant; a summary with the wall-clock
+time is logged at the end and the exit status is 1 if any tenant failed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from typing import Optional
+
+from core.config import settings
+from core.fanout import REPORTS, FanoutSummary, TenantFanout, missing_params
+
+logger = logging.getLogger(__name__)
+
+
+def parse_param(value: str) -> tuple[str, object]:
+    name, sep, raw = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected name=value, got '{value}'")
+    try:
+        return name, json.loads(raw)
+    except ValueError:
+        return name, raw
+
+
+async def run(sql: str, params: dict, mode: str, tenant_ids: Optional[list[int]], concurrency: int) -> FanoutSummary:
+    fanout = TenantFanout(concurrency, settings.FANOUT_UNION_BATCH_SIZE, settings.FANOUT_STATEMENT_TIMEOUT_MS)
+    summary = FanoutSummary()
+    try:
+        async for result in fanout.run(sql, params, mode=mode, tenant_ids=tenant_ids):
+            summary.add(result)
+            print(json.dumps(result.as_dict(), ensure_ascii=False, default=str), flush=True)
+    finally:
+        await fanout.close()
+    return summary
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a query against every active tenant schema.")
+    parser.add_argument("report", nargs="?", choices=sorted(REPORTS), help="predefined report to run")
+    parser.add_argument("--sql", help="ad-hoc query; use {schema} for the tenant schema and :name for parameters")
+    parser.add_argument("-p", "--param", action="append", type=parse_param, default=[], help="query parameter name=value")
+    parser.add_argument("--mode", choices=("parallel", "union"), default="parallel",
+                        help="one statement per schema, or UNION ALL batches of FANOUT_UNION_BATCH_SIZE schemas")
+    parser.add_argument("--tenant", action="append", type=int, dest="tenant_ids", help="only query the given tenant id (may be repeated)")
+    parser.add_argument("--concurrency", type=int, default=settings.FANOUT_CONCURRENCY,
+                        help="number of statements executed concurrently")
+    args = parser.parse_args(argv)
+
+    if (args.report is None) == (args.sql is None):
+        parser.error("give exactly one of a report name or --sql")
+    sql = args.sql or REPORTS[args.report]
+    params = dict(args.param)
+    missing = missing_params(sql, params)
+    if missing:
+        parser.error(f"missing parameters: {', '.join(missing)}")
+
+    try:
+        summary = asyncio.run(run(sql, params, args.mode, args.tenant_ids, args.concurrency))
+    except ValueError as e:
+        parser.error(str(e))
+    result = summary.as_dict()
+    logger.info(f"Tenants: {result['tenants']}, succeeded: {result['succeeded']}, failed: {len(result['failed'])}, "
+                f"wall time: {result['wall_time_s']}s")
+    if result["failed"]:
+        logger.error(f"Failed schemas: {', '.join(result['failed'])}")
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+
+class FanoutQuery(BaseModel):
+    report: str  # core.fanout.REPORTS 中的报表名
+    params: Dict[str, Any] = Field(default_factory=dict)
+    mode: Literal["parallel", "union"] = "parallel"
+    tenant_ids: Optional[List[int]] = None  # 未提供 (null) 时对所有活跃租户执行；空列表表示不对任何租户执行
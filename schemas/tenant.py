@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import re
-from typing import Optional
+from datetime import datetime
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, Field, field_validator
 
@@ -21,13 +22,16 @@ class TenantBase(BaseModel):
 
     @field_validator('subdomain')
     def subdomain_alphanumeric(cls, v):
-        if not re.match(r'^[a-z0-9]+(?:-[a-z0-9]+)*$', v):
+        if v is not None and not re.match(r'^[a-z0-9]+(?:-[a-z0-9]+)*$', v):
             raise ValueError('Subdomain must be lowercase alphanumeric with optional hyphens')
         return v
 
 
 class TenantCreate(TenantBase):
-    pass
+    # 指定租户 schema 所在的分片；为空时放到租户数最少的分片
+    shard: Optional[str] = Field(None, min_length=1, max_length=32)
+    # schema: 独享 schema；shared: 放入分片的共享 schema (见 core/tenancy.py)；为空时使用 DEFAULT_TENANCY
+    tenancy: Optional[Literal["schema", "shared"]] = None
 
 
 class TenantUpdate(BaseModel):
@@ -39,6 +43,47 @@ class TenantInDB(TenantBase):
     id: int
     is_active: bool
     schema_name: str  # InDB 时 schema_name 必须存在
+    shard: str
+    tenancy: str
 
     class Config:
         from_attributes = True  # Pydantic V2 (旧版 orm_mode = True)
+
+
+class ProvisioningJobInDB(BaseModel):
+    id: int
+    tenant_id: int
+    status: str
+    step: str
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class TenantProvisioningAccepted(BaseModel):
+    """创建租户的异步响应: 租户记录已创建 (未激活)，schema 由后台任务开通"""
+    tenant: TenantInDB
+    job: ProvisioningJobInDB
+
+
+class TenantBulkCreate(BaseModel):
+    tenants: List[TenantCreate] = Field(..., min_length=1)
+
+
+class TenantBulkItemResult(BaseModel):
+    index: int  # 在请求 tenants 列表中的位置
+    status: str  # accepted / rejected
+    tenant: Optional[TenantInDB] = None
+    job_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class TenantBulkCreateResult(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[TenantBulkItemResult]
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -26,3 +26,23 @@ class ProductInDB(ProductBase):
 
     class Config:
         from_attributes = True
+
+
+class ProductBatchResult(BaseModel):
+    items: List[Optional[ProductInDB]]  # 与请求中的 ids 一一对应，不存在的为 null
+    missing: List[int]  # 不存在的 id (按请求顺序，去重)
+
+
+class ProductImportError(BaseModel):
+    line: int  # 记录在请求体中的起始行号 (从 1 开始)
+    errors: List[str]
+
+
+class ProductImportResult(BaseModel):
+    rows_received: int
+    rows_inserted: int
+    rows_rejected: int
+    elapsed_s: float
+    rows_per_sec: float
+    errors: List[ProductImportError]
+    errors_truncated: bool = False  # 错误超过上限时只返回前面的部分
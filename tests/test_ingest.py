@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from core.ingest import iter_csv_batches, iter_ndjson_batches, validate_batch
+from schemas.user import ProductCreate
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(batches) -> list:
+    return [batch async for batch in batches]
+
+
+async def test_ndjson_lines_split_across_chunks():
+    batches = await _collect(iter_ndjson_batches(
+        _chunks(b'{"name": "a", "price": 1}\n{"name": "b", ', b'"price": 2}\n\n{"name": "c", "price": 3}'),
+        batch_size=2,
+    ))
+    assert [[line for line, _, _ in batch] for batch in batches] == [[1, 2], [4]]
+    assert batches[0][1] == (2, b'{"name": "b", "price": 2}', None)
+
+
+async def test_csv_quoted_newline_and_errors():
+    body = (
+        b'name,description,price\n'
+        b'"multi\nline",,3.5\n'
+        b'short,1\n'
+        b'ok,"has, comma",2\n'
+        b'"unterminated,,1\n'
+    )
+    (batch,) = await _collect(iter_csv_batches(_chunks(body[:20], body[20:]), batch_size=100))
+    assert batch[0] == (2, {"name": "multi\nline", "price": "3.5"}, None)
+    assert batch[1] == (4, None, "Expected 3 fields, got 2")
+    assert batch[2] == (5, {"name": "ok", "description": "has, comma", "price": "2"}, None)
+    assert batch[3] == (6, None, "Unterminated quoted field")
+
+
+async def test_csv_invalid_utf8():
+    (batch,) = await _collect(iter_csv_batches(_chunks(b"name,price\n\xff\xfe,1\n"), batch_size=100))
+    line, data, error = batch[0]
+    assert (line, data) == (2, None)
+    assert error.startswith("Invalid UTF-8")
+
+
+def test_validate_batch_json_all_valid():
+    batch = [(1, b'{"name": "a", "price": 1}', None), (2, b'{"name": "b", "price": 2.5}', None)]
+    valid, errors = validate_batch(ProductCreate, batch)
+    assert [item.name for item in valid] == ["a", "b"]
+    assert errors == []
+
+
+def test_validate_batch_json_reports_bad_lines():
+    batch = [
+        (1, b'{"name": "a", "price": 1}', None),
+        (2, b'{"name": "b", "price": -1}', None),
+        (3, b'{"name": "c", "price": ', None),
+        (4, None, "Invalid UTF-8"),
+        (5, b'{"name": "d", "price": 4}', None),
+    ]
+    valid, errors = validate_batch(ProductCreate, batch)
+    assert [item.name for item in valid] == ["a", "d"]
+    assert [line for line, _ in sorted(errors)] == [2, 3, 4]
+    assert any(message.startswith("price:") for message in dict(errors)[2])
+
+
+def test_validate_batch_json_rejects_two_objects_on_one_line():
+    batch = [(1, b'{"name": "a", "price": 1},{"name": "b", "price": 2}', None)]
+    valid, errors = validate_batch(ProductCreate, batch)
+    assert valid == []
+    assert [line for line, _ in errors] == [1]
+
+
+def test_validate_batch_csv_reports_bad_rows():
+    batch = [
+        (2, {"name": "a", "price": "1"}, None),
+        (3, {"name": "b"}, None),
+        (4, {"name": "c", "price": "2"}, None),
+    ]
+    valid, errors = validate_batch(ProductCreate, batch)
+    assert [(item.name, item.price) for item in valid] == [("a", 1.0), ("c", 2.0)]
+    assert errors == [(3, ["price: Field required"])]
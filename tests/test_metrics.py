@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from core.metrics import OTHER_TENANTS, MetricsRegistry, RequestMetrics
+
+
+def observe(registry, tenant, times=1):
+    for _ in range(times):
+        registry.observe_request(tenant, 200, 0.01, RequestMetrics(statements=1))
+
+
+def test_evicts_least_requested_tenant():
+    registry = MetricsRegistry(top_tenants=1, tracked_tenants=3)
+    observe(registry, "a", 5)
+    observe(registry, "b", 1)
+    observe(registry, "c", 3)
+    observe(registry, "b", 3)  # b 超过 c，c 成为请求数最少的租户
+    observe(registry, "d")
+    assert set(registry._tenants) == {"a", "b", "d"}
+    # d 随后被挤出; 重新出现的 c 从零开始计数
+    observe(registry, "c")
+    assert set(registry._tenants) == {"a", "b", "c"}
+
+    snapshot = registry.snapshot()
+    assert list(snapshot) == ["a", OTHER_TENANTS]
+    assert snapshot["a"].requests == 5
+    assert snapshot[OTHER_TENANTS].requests == 4 + 3 + 1 + 1
+
+
+def test_eviction_heap_stays_bounded():
+    registry = MetricsRegistry(top_tenants=2, tracked_tenants=10)
+    for index in range(1000):
+        observe(registry, f"tenant-{index % 50}", index % 7 + 1)
+    assert len(registry._tenants) == 10
+    assert len(registry._eviction_heap) == len(registry._tenants)
+    assert sum(series.requests for series in registry.snapshot().values()) == sum(index % 7 + 1 for index in range(1000))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import base64
+
+import pytest
+
+from core.pagination import InvalidCursor, decode_cursor, encode_cursor, next_cursor
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("price", [19.9, 42])
+    assert "=" not in cursor
+    assert decode_cursor(cursor, "price") == [19.9, 42]
+
+
+def test_cursor_round_trip_unicode_values():
+    cursor = encode_cursor("name", ["运动鞋", 7])
+    assert decode_cursor(cursor, "name") == ["运动鞋", 7]
+
+
+def test_cursor_issued_for_another_sort_is_rejected():
+    cursor = encode_cursor("id", [1])
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "price")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'{"k": [1]}').decode(),
+    base64.urlsafe_b64encode(b'{"s": "id", "k": 1}').decode(),
+    base64.urlsafe_b64encode(b"[1, 2]").decode(),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "id")
+
+
+class _Row:
+    def __init__(self, id, price):
+        self.id = id
+        self.price = price
+
+
+def test_next_cursor_only_for_full_pages():
+    rows = [_Row(1, 5.0), _Row(2, 7.5)]
+    assert next_cursor(rows, ["price", "id"], "price", limit=3) is None
+    assert next_cursor(rows, ["price", "id"], "price", limit=0) is None
+    cursor = next_cursor(rows, ["price", "id"], "price", limit=2)
+    assert decode_cursor(cursor, "price") == [7.5, 2]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from core.profiling import (
+    QueryBudgetExceeded,
+    SqlProfiler,
+    normalize_statement,
+    parse_budgets,
+    sql_profiler,
+)
+from middlewares.profiling import ProfilingMiddleware
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT * FROM products WHERE id = 42", "SELECT * FROM products WHERE id = ?"),
+    ("SELECT * FROM t WHERE name = 'O''Brien' AND price > 9.5", "SELECT * FROM t WHERE name = ? AND price > ?"),
+    ("SELECT * FROM t WHERE id = %(id_1)s AND x = %s AND y = $3", "SELECT * FROM t WHERE id = ? AND x = ? AND y = ?"),
+    ("SELECT * FROM t WHERE id IN (1, 2, 3)", "SELECT * FROM t WHERE id IN (...)"),
+    ("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)", "INSERT INTO t (a, b) VALUES (?, ?), ..."),
+    ("SELECT  a\n  FROM t\n\tWHERE b = 1", "SELECT a FROM t WHERE b = ?"),
+])
+def test_normalize_statement(statement, expected):
+    assert normalize_statement(statement) == expected
+
+
+def test_normalize_statement_keeps_identifiers_with_digits():
+    assert normalize_statement('SELECT "tenant_1".products.id FROM "tenant_1".products') == \
+        'SELECT "tenant_1".products.id FROM "tenant_1".products'
+
+
+def test_parse_budgets():
+    assert parse_budgets("") == {}
+    assert parse_budgets(" GET /api/v1/users/=3, GET /api/v1/users/{item_id}=2 ,") == {
+        "GET /api/v1/users/": 3,
+        "GET /api/v1/users/{item_id}": 2,
+    }
+
+
+@pytest.mark.parametrize("spec", ["GET /api/v1/users/", "=3", "GET /api/v1/users/=many"])
+def test_parse_budgets_rejects_invalid_items(spec):
+    with pytest.raises(ValueError):
+        parse_budgets(spec)
+
+
+def test_unknown_budget_mode_is_rejected():
+    with pytest.raises(ValueError):
+        SqlProfiler(200, 0, 10, 0, {}, "fail", 100)
+
+
+@pytest.fixture
+def sqlite_app():
+    # Engine 级的游标事件对任何同步引擎都生效，用内存 SQLite 代替 PostgreSQL
+    engine = create_engine("sqlite://")
+    app = FastAPI()
+
+    @app.get("/items/{count}")
+    def run_queries(count: int):
+        with engine.connect() as connection:
+            for _ in range(count):
+                connection.execute(text("SELECT 1"))
+        return {"executed": count}
+
+    app.add_middleware(ProfilingMiddleware)
+    yield app
+    engine.dispose()
+
+
+@pytest.fixture
+def strict_budget(monkeypatch):
+    monkeypatch.setattr(sql_profiler, "budget_mode", "raise")
+    monkeypatch.setattr(sql_profiler, "default_budget", 0)
+    monkeypatch.setattr(sql_profiler, "budgets", {"GET /items/{count}": 2})
+
+
+def test_budget_raise_mode_fails_request(sqlite_app, strict_budget):
+    client = TestClient(sqlite_app)
+    assert client.get("/items/2").json() == {"executed": 2}
+    with pytest.raises(QueryBudgetExceeded, match=r"GET /items/\{count\} exceeded its query budget of 2"):
+        client.get("/items/3")
+
+
+def test_budget_raise_mode_returns_500_without_reraising(sqlite_app, strict_budget):
+    response = TestClient(sqlite_app, raise_server_exceptions=False).get("/items/5")
+    assert response.status_code == 500
+
+
+def test_budget_log_mode_only_counts_violation(sqlite_app, monkeypatch):
+    monkeypatch.setattr(sql_profiler, "budget_mode", "log")
+    monkeypatch.setattr(sql_profiler, "budgets", {"GET /items/{count}": 2})
+    monkeypatch.setattr(sql_profiler, "budget_violations", 0)
+    assert TestClient(sqlite_app).get("/items/3").status_code == 200
+    assert sql_profiler.budget_violations == 1
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+from core.relocation import CHANGES_TABLE, TableInfo, TenantRelocator
+
+Entry = namedtuple("Entry", "id table_name pk")
+
+TABLES = [
+    TableInfo("users", ["id", "email"], "id", "integer"),
+    TableInfo("orders", ["id", "user_id"], "id", "integer"),
+]
+
+
+class FakeSource:
+    """变更日志与各表当前行都在内存中"""
+
+    def __init__(self, entries, rows):
+        self.entries = entries
+        self.rows = rows
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        if sql.startswith(f"SELECT id, table_name, pk FROM {CHANGES_TABLE}"):
+            result = self.entries
+        elif sql.startswith("SELECT"):
+            table_name = sql.split(".")[-1].split()[0].strip('"')
+            result = [row for row in self.rows.get(table_name, []) if str(row[0]) in params["keys"]]
+        else:
+            result = []
+        return type("Result", (), {"all": lambda self: result})()
+
+
+class FakeTarget:
+    def __init__(self):
+        self.operations = []
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        table_name = sql.split(".")[1].split()[0].strip('"')
+        if sql.startswith("DELETE"):
+            self.operations.append(("delete", table_name, sorted(params["keys"])))
+        else:
+            self.operations.append(("upsert", table_name, [tuple(p.values()) for p in params]))
+
+
+async def test_sync_changes_replays_in_capture_order():
+    # users 1 被删除后, 新用户 3 复用了它的 email; 订单 10 改为指向用户 3
+    entries = [
+        Entry(1, "users", "2"),
+        Entry(2, "orders", "10"),
+        Entry(3, "users", "1"),
+        Entry(4, "users", "3"),
+        Entry(5, "orders", "10"),
+        Entry(6, "orders", "11"),
+    ]
+    rows = {"users": [(2, "b@example.com"), (3, "a@example.com")], "orders": [(10, 3), (11, 3)]}
+    target = FakeTarget()
+    synced = await TenantRelocator(1, "shard_b")._sync_changes(FakeSource(entries, rows), target, "tenant_a", TABLES, None)
+    assert synced == 5
+    assert target.operations == [
+        ("upsert", "users", [(2, "b@example.com")]),
+        ("delete", "users", ["1"]),
+        ("upsert", "users", [(3, "a@example.com")]),
+        ("upsert", "orders", [(10, 3), (11, 3)]),
+    ]
+
+
+async def test_sync_changes_without_entries():
+    target = FakeTarget()
+    assert await TenantRelocator(1, "shard_b")._sync_changes(FakeSource([], {}), target, "tenant_a", TABLES, 100) == 0
+    assert target.operations == []
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from core import tenant_cache as tenant_cache_module
+from core.tenant_cache import TenantCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tenant_cache_module.time, "monotonic", clock)
+    return clock
+
+
+def test_hit_miss_and_ttl(clock):
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    tenant = object()
+    assert cache.lookup(1) == (False, None)
+    cache.store(1, tenant)
+    cache.store(2, None)
+    assert cache.lookup(1) == (True, tenant)
+    assert cache.lookup(2) == (True, None)
+    clock.now += 10
+    assert cache.lookup(2) == (False, None)
+    assert cache.lookup(1) == (True, tenant)
+    clock.now += 30
+    assert cache.lookup(1) == (False, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"], stats["expirations"]) == (2, 1, 3, 2)
+
+
+def test_lru_eviction():
+    cache = TenantCache(max_size=2, ttl=30, negative_ttl=5)
+    cache.store(1, "a")
+    cache.store(2, "b")
+    cache.lookup(1)
+    cache.store(3, "c")
+    assert cache.lookup(2) == (False, None)
+    assert cache.lookup(1) == (True, "a")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_negative_entries_do_not_evict_tenants():
+    cache = TenantCache(max_size=3, ttl=30, negative_ttl=5, negative_max_size=2)
+    for tenant_id in range(3):
+        cache.store(tenant_id, f"tenant-{tenant_id}")
+    for tenant_id in range(100, 200):
+        cache.store(tenant_id, None)
+    assert all(cache.lookup(tenant_id)[0] for tenant_id in range(3))
+    assert cache.lookup(199) == (True, None)
+    assert cache.lookup(100) == (False, None)
+    stats = cache.stats()
+    assert (stats["size"], stats["negative_size"], stats["negative_evictions"]) == (3, 2, 98)
+
+
+def test_store_replaces_entry_of_the_other_kind():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    cache.store(1, None)
+    cache.store(1, "tenant")
+    assert cache.lookup(1) == (True, "tenant")
+    cache.store(1, None)
+    assert cache.lookup(1) == (True, None)
+    assert cache.stats()["size"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TenantCache(max_size=0, ttl=30, negative_ttl=5)
+    cache.store(1, "tenant")
+    assert not cache.enabled
+    assert cache.lookup(1) == (False, None)
+
+
+async def test_concurrent_misses_load_once():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    calls = []
+
+    async def loader(tenant_id):
+        calls.append(tenant_id)
+        await asyncio.sleep(0.01)
+        return f"tenant-{tenant_id}"
+
+    results = await asyncio.gather(*(cache.get_or_load(7, loader) for _ in range(5)))
+    assert results == ["tenant-7"] * 5
+    assert calls == [7]
+    assert cache.lookup(7) == (True, "tenant-7")
+
+
+async def test_load_finished_after_invalidation_is_not_stored():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+
+    async def loader(tenant_id):
+        cache.invalidate(tenant_id)
+        return "stale"
+
+    assert await cache.get_or_load(1, loader) == "stale"
+    assert cache.lookup(1) == (False, None)
+
+
+async def test_loader_errors_propagate_to_all_waiters():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+
+    async def loader(tenant_id):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database is down")
+
+    results = await asyncio.gather(*(cache.get_or_load(1, loader) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.lookup(1) == (False, None)
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+async def test_get_or_load_in_session_hands_session_to_the_loading_caller():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    sessions = []
+
+    def session_factory():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    async def loader(session, tenant_id):
+        await asyncio.sleep(0.01)
+        return f"tenant-{tenant_id}"
+
+    results = await asyncio.gather(*(cache.get_or_load_in_session(3, session_factory, loader) for _ in range(4)))
+    assert [tenant for tenant, _ in results] == ["tenant-3"] * 4
+    assert [session for _, session in results if session is not None] == sessions
+    assert len(sessions) == 1
+    # 命中缓存时不打开 session
+    assert await cache.get_or_load_in_session(3, session_factory, loader) == ("tenant-3", None)
+    assert len(sessions) == 1
+
+
+async def test_get_or_load_in_session_closes_session_on_error():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    session = FakeSession()
+
+    async def loader(session, tenant_id):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load_in_session(1, lambda: session, loader)
+    assert session.closed
+
+
+class RecordingSession:
+    """只记录执行的语句; after_commit 事件挂在真实的 (无绑定的) Session 上"""
+
+    def __init__(self):
+        self.sync_session = Session()
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+async def test_invalidate_on_commit_notifies_other_processes():
+    cache = TenantCache(max_size=10, ttl=30, negative_ttl=5)
+    db = RecordingSession()
+    cache.store(1, None)
+    await cache.invalidate_on_commit(db, 1)
+    assert cache.lookup(1) == (False, None)
+    assert [str(s) for s in db.statements] == ["SELECT pg_notify('tenant_cache_invalidation', '1') AS pg_notify_1"]
+
+    # 提交前被其他请求写回的旧数据在提交后再次失效
+    cache.store(1, None)
+    db.sync_session.commit()
+    assert cache.lookup(1) == (False, None)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from models.public import Tenant
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from core.config import settings
+from core.tenant_cache import TenantCache
+from middlewares import tenant as tenant_middleware
+from middlewares.tenant import TenantMiddleware, resolve_tenant
+
+TENANTS = {
+    1: Tenant(id=1, name="Adidas", schema_name="tenant_adidas", shard="default", tenancy="schema", is_active=True),
+    2: Tenant(id=2, name="Puma", schema_name="tenant_puma", shard="shard_b", tenancy="schema", is_active=True),
+}
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """用内存中的租户代替 public.tenants，记录每次加载与打开的 session"""
+    calls = {"plain": [], "bound": [], "sessions": []}
+
+    async def load_active_tenant(tenant_id):
+        calls["plain"].append(tenant_id)
+        return TENANTS.get(tenant_id)
+
+    async def load_and_bind_tenant(session, tenant_id):
+        calls["bound"].append(tenant_id)
+        return TENANTS.get(tenant_id)
+
+    def session_factory():
+        calls["sessions"].append(FakeSession())
+        return calls["sessions"][-1]
+
+    monkeypatch.setattr(tenant_middleware, "tenant_cache", TenantCache(max_size=10, ttl=30, negative_ttl=5))
+    monkeypatch.setattr(tenant_middleware, "_load_active_tenant", load_active_tenant)
+    monkeypatch.setattr(tenant_middleware, "_load_and_bind_tenant", load_and_bind_tenant)
+    monkeypatch.setattr(tenant_middleware, "AsyncSessionFactory", session_factory)
+    return calls
+
+
+@pytest.mark.parametrize("bind_session", [False, True])
+@pytest.mark.parametrize("raw_tenant_id, status_code", [(None, 403), ("abc", 400), ("404", 404)])
+async def test_resolve_tenant_errors(loads, bind_session, raw_tenant_id, status_code):
+    tenant, session, response = await resolve_tenant(raw_tenant_id, bind_session=bind_session)
+    assert (tenant, session) == (None, None)
+    assert response.status_code == status_code
+    assert all(session.closed for session in loads["sessions"])
+
+
+async def test_resolve_tenant_without_session(loads):
+    tenant, session, response = await resolve_tenant("1")
+    assert (tenant, session, response) == (TENANTS[1], None, None)
+    assert await resolve_tenant("1") == (TENANTS[1], None, None)
+    assert loads["plain"] == [1]
+    assert loads["sessions"] == []
+
+
+async def test_resolve_tenant_binds_session_on_cache_miss(loads):
+    tenant, session, response = await resolve_tenant("1", bind_session=True)
+    assert (tenant, response) == (TENANTS[1], None)
+    assert session is loads["sessions"][0] and not session.closed
+    # 缓存命中时不再打开 session
+    assert await resolve_tenant("1", bind_session=True) == (TENANTS[1], None, None)
+    assert loads["bound"] == [1]
+
+
+async def test_resolve_tenant_closes_session_for_other_shards(loads):
+    tenant, session, _ = await resolve_tenant("2", bind_session=True)
+    assert (tenant, session) == (TENANTS[2], None)
+    assert loads["sessions"][0].closed
+
+
+async def test_resolve_tenant_load_error(loads, monkeypatch):
+    async def failing_loader(tenant_id):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(tenant_middleware, "_load_active_tenant", failing_loader)
+    tenant, session, response = await resolve_tenant("1")
+    assert (tenant, session) == (None, None)
+    assert response.status_code == 500
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/items")
+    def read_state(request: Request):
+        state = request.scope["state"]
+        return {
+            "tenant_schema": state["tenant_schema"],
+            "tenant_shard": state["tenant_shard"],
+            "has_db_session": state.get("db_session") is not None,
+        }
+
+    app.add_middleware(TenantMiddleware)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("request_scoped_session", [False, True])
+def test_middleware_sets_tenant_state(loads, client, monkeypatch, request_scoped_session):
+    monkeypatch.setattr(settings, "DB_REQUEST_SCOPED_SESSION", request_scoped_session)
+    response = client.get("/items", headers={"X-Tenant-ID": "1"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "tenant_schema": "tenant_adidas",
+        "tenant_shard": "default",
+        "has_db_session": request_scoped_session,
+    }
+    # 请求级会话在响应结束后由中间件关闭
+    assert len(loads["sessions"]) == int(request_scoped_session)
+    assert all(session.closed for session in loads["sessions"])
+
+
+@pytest.mark.parametrize("request_scoped_session", [False, True])
+def test_middleware_rejects_unknown_tenant(loads, client, monkeypatch, request_scoped_session):
+    monkeypatch.setattr(settings, "DB_REQUEST_SCOPED_SESSION", request_scoped_session)
+    assert client.get("/items", headers={"X-Tenant-ID": "404"}).status_code == 404
+    assert client.get("/items").status_code == 403
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from core.write_batching import WriteBatcher
+
+
+class FakeFlush:
+    """记录每批写入的 key 与行，并统计同时执行的批次数；值为 "bad" 的行使整批失败"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches: list[tuple] = []
+        self.running = 0
+        self.peak = 0
+
+    async def __call__(self, key, items):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if "bad" in items:
+                raise ValueError("bad row")
+            self.batches.append((key, list(items)))
+            return [f"{key}:{item}" for item in items]
+        finally:
+            self.running -= 1
+
+
+async def test_rows_of_one_key_are_coalesced():
+    flush = FakeFlush()
+    batcher = WriteBatcher(flush, max_batch_size=10, max_delay=0.01)
+    results = await asyncio.gather(*(batcher.submit("t1", i) for i in range(3)), batcher.submit("t2", 9))
+    assert results == ["t1:0", "t1:1", "t1:2", "t2:9"]
+    assert sorted(flush.batches) == [("t1", [0, 1, 2]), ("t2", [9])]
+    assert batcher.stats()["flushed_on_delay"] == 2
+
+
+async def test_full_batch_is_flushed_without_waiting():
+    flush = FakeFlush()
+    batcher = WriteBatcher(flush, max_batch_size=2, max_delay=60)
+    results = await asyncio.wait_for(asyncio.gather(batcher.submit("t", "a"), batcher.submit("t", "b")), timeout=1)
+    assert results == ["t:a", "t:b"]
+    assert batcher.stats()["flushed_full"] == 1
+
+
+async def test_concurrent_batches_are_capped():
+    flush = FakeFlush(delay=0.02)
+    batcher = WriteBatcher(flush, max_batch_size=1, max_delay=0, max_concurrency=2)
+    await asyncio.gather(*(batcher.submit(f"t{i}", i) for i in range(6)))
+    assert len(flush.batches) == 6
+    assert flush.peak == 2
+
+
+async def test_failed_batch_is_retried_row_by_row():
+    flush = FakeFlush()
+    batcher = WriteBatcher(flush, max_batch_size=3, max_delay=60)
+    results = await asyncio.gather(
+        batcher.submit("t", "a"), batcher.submit("t", "bad"), batcher.submit("t", "c"), return_exceptions=True
+    )
+    assert results[0] == "t:a" and results[2] == "t:c"
+    assert isinstance(results[1], ValueError)
+    stats = batcher.stats()
+    assert stats["failed_batches"] == 1 and stats["retried_rows"] == 3
+
+
+async def test_custom_retry_results_are_delivered():
+    async def retry(key, items):
+        return [RuntimeError(item) if item == "bad" else f"retried:{item}" for item in items]
+
+    batcher = WriteBatcher(FakeFlush(), max_batch_size=2, max_delay=60, retry=retry)
+    ok, failed = await asyncio.gather(batcher.submit("t", "a"), batcher.submit("t", "bad"), return_exceptions=True)
+    assert ok == "retried:a"
+    assert isinstance(failed, RuntimeError)
+
+
+async def test_single_row_failure_is_not_retried():
+    batcher = WriteBatcher(FakeFlush(), max_batch_size=1, max_delay=0)
+    with pytest.raises(ValueError):
+        await batcher.submit("t", "bad")
+    assert batcher.stats()["retried_rows"] == 0
+
+
+async def test_cancelled_callers_are_not_written():
+    flush = FakeFlush()
+    batcher = WriteBatcher(flush, max_batch_size=10, max_delay=0.02)
+    cancelled = asyncio.create_task(batcher.submit("t", "gone"))
+    kept = asyncio.create_task(batcher.submit("t", "kept"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    assert await kept == "t:kept"
+    assert flush.batches == [("t", ["kept"])]
+    assert batcher.stats()["cancelled_rows"] == 1
+
+
+async def test_drain_flushes_pending_rows():
+    flush = FakeFlush()
+    batcher = WriteBatcher(flush, max_batch_size=10, max_delay=60)
+    pending = asyncio.create_task(batcher.submit("t", "a"))
+    await asyncio.sleep(0)
+    await batcher.drain()
+    assert await pending == "t:a"